@@ -1,12 +1,464 @@
 ﻿const API_URL = "http://127.0.0.1:5000/analyze";
+const FILTER_URL = "http://127.0.0.1:5000/blacklist_filter";
+const VERDICT_URL = "http://127.0.0.1:5000/verdict";
+const CANCEL_URL = "http://127.0.0.1:5000/cancel";
+const PRECHECK_URL = "http://127.0.0.1:5000/precheck";
+const PROTOCOL_VERSION = 2;
+const FILTER_SYNC_MINUTES = 5;
+const DEFAULT_VERDICT_TTL = 600;
+const MAX_CACHED_VERDICTS = 500;
+const MAX_PRECHECK_BATCH = 20;     // 與後端 precheck.MAX_PRECHECK_URLS 相同
+const MAX_CACHED_PRECHECKS = 1000;
+const PRECHECK_WAIT_MS = 300;      // 導航時預檢還在進行中，最多等這麼久
+
+// 工具：計算文字的 SHA-256（與後端 payload.content_hash 相同格式）
+async function sha256Hex(text) {
+    const buf = await crypto.subtle.digest("SHA-256", new TextEncoder().encode(text));
+    return [...new Uint8Array(buf)].map(b => b.toString(16).padStart(2, "0")).join("");
+}
+
+// 工具：gzip 壓縮字串
+async function gzipString(str) {
+    const stream = new Blob([str]).stream().pipeThrough(new CompressionStream("gzip"));
+    return await new Response(stream).arrayBuffer();
+}
+
+// 組出 v2 結構化請求（url / title / text / links / forms 分開，並附內容雜湊）
+// 單頁應用換頁時 content.js 只送與上一次擷取（base）相比新增 / 移除的連結與文字差異（hash 仍是完整文字的雜湊）
+async function buildAnalyzeRequest(msg) {
+    const text = msg.text || "";
+    const fields = {
+        v: PROTOCOL_VERSION,
+        url: msg.url || "",
+        title: msg.title || "",
+        forms: msg.forms || [],
+        hash: `sha256:${await sha256Hex(text)}`
+    };
+    if (msg.captureId) fields.capture_id = msg.captureId;
+    if (msg.base) {
+        fields.base = msg.base;
+        fields.links_added = msg.linksAdded || [];
+        fields.links_removed = msg.linksRemoved || [];
+        if (msg.textDelta) fields.text_delta = msg.textDelta;
+        else fields.text = text;
+    } else {
+        fields.text = text;
+        fields.links = msg.links || [];
+    }
+    const body = JSON.stringify(fields);
+
+    if (typeof CompressionStream === "undefined") {
+        return { headers: { "Content-Type": "application/json" }, body };
+    }
+    return {
+        headers: { "Content-Type": "application/json", "Content-Encoding": "gzip" },
+        body: await gzipString(body)
+    };
+}
+
+// ===== 進行中的分析請求（分頁 → 請求），分頁關閉或離開頁面時取消 =====
+
+const inflight = new Map(); // tabId → { requestId, url, controller }
+
+function cancelAnalysis(tabId, reason) {
+    const job = inflight.get(tabId);
+    if (!job) return;
+    inflight.delete(tabId);
+    console.log(`[SCHED] 取消分析 (${reason}):`, job.url);
+    job.controller.abort();
+    fetch(CANCEL_URL, {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ request_id: job.requestId })
+    }).catch(() => {});
+}
+
+// 擴充功能實例 id：後端依此做每個客戶端的速率限制與排隊上限（見 admission.py）
+let clientId = null;
+
+async function getClientId() {
+    if (clientId) return clientId;
+    const { client_id } = await chrome.storage.local.get("client_id");
+    clientId = client_id || crypto.randomUUID();
+    if (!client_id) await chrome.storage.local.set({ client_id: clientId });
+    return clientId;
+}
+
+// 手動擷取或使用者正在看的分頁 → foreground；背景分頁的自動擷取 → background
+function analyzePriority(msg, sender) {
+    return (msg.manual || sender?.tab?.active) ? "foreground" : "background";
+}
 
 // 工具：安全發送訊息 (避免接收端不存在時報錯)
 function safeSendMessage(payload) {
     chrome.runtime.sendMessage(payload, () => void chrome.runtime.lastError);
 }
 
+// ===== 本地黑名單過濾器（與後端 blacklist_filter.py 相同演算法）=====
+
+const CRC_TABLE = (() => {
+    const table = new Uint32Array(256);
+    for (let n = 0; n < 256; n++) {
+        let c = n;
+        for (let k = 0; k < 8; k++) c = (c & 1) ? (0xEDB88320 ^ (c >>> 1)) : (c >>> 1);
+        table[n] = c >>> 0;
+    }
+    return table;
+})();
+
+// 與 Python zlib.crc32 相同；reverse = true 時由尾到頭計算
+function crc32(bytes, reverse = false) {
+    let crc = 0xFFFFFFFF;
+    const n = bytes.length;
+    for (let j = 0; j < n; j++) {
+        const b = bytes[reverse ? n - 1 - j : j];
+        crc = CRC_TABLE[(crc ^ b) & 0xFF] ^ (crc >>> 8);
+    }
+    return (crc ^ 0xFFFFFFFF) >>> 0;
+}
+
+function* filterPositions(filter, url) {
+    const data = new TextEncoder().encode(url);
+    const h1 = crc32(data);
+    const h2 = crc32(data, true) % (filter.m - 1) + 1;
+    for (let i = 0; i < filter.k; i++) yield (h1 + i * h2) % filter.m;
+}
+
+function filterHas(filter, url) {
+    if (!filter) return false;
+    for (const pos of filterPositions(filter, url)) {
+        if (!(filter.bits[pos >> 3] & (1 << (pos & 7)))) return false;
+    }
+    return true;
+}
+
+function filterAdd(filter, url) {
+    for (const pos of filterPositions(filter, url)) filter.bits[pos >> 3] |= 1 << (pos & 7);
+}
+
+function decodeFilter(raw) {
+    if (!raw) return null;
+    const bin = atob(raw.bits);
+    const bits = new Uint8Array(bin.length);
+    for (let i = 0; i < bin.length; i++) bits[i] = bin.charCodeAt(i);
+    return { m: raw.m, k: raw.k, bits };
+}
+
+function encodeBits(bits) {
+    let bin = "";
+    for (let i = 0; i < bits.length; i += 0x8000) {
+        bin += String.fromCharCode(...bits.subarray(i, i + 0x8000));
+    }
+    return btoa(bin);
+}
+
+// 記憶體中的解碼結果；service worker 重啟後從 storage 還原
+let blFilter = null;
+
+async function loadFilterState() {
+    if (blFilter) return blFilter;
+    const { bl_filter } = await chrome.storage.local.get("bl_filter");
+    if (!bl_filter) return null;
+    blFilter = {
+        raw: bl_filter,
+        official: decodeFilter(bl_filter.official),
+        user: decodeFilter(bl_filter.user)
+    };
+    return blFilter;
+}
+
+// 向後端同步過濾器：只下載版本有變的部分，使用者名單只有新增時走增量更新
+async function syncBlacklistFilter() {
+    const state = await loadFilterState();
+    const params = new URLSearchParams();
+    if (state) {
+        params.set("epoch", state.raw.epoch);
+        params.set("official", state.raw.official_version);
+        params.set("user", state.raw.user_version);
+    }
+
+    const data = await fetch(`${FILTER_URL}?${params}`).then(r => r.json());
+    if (!data.success) return;
+
+    const raw = state ? { ...state.raw } : {};
+    const next = {
+        official: state?.official ?? null,
+        user: state?.user ?? null
+    };
+
+    if (data.official) {
+        raw.official = data.official;
+        next.official = decodeFilter(data.official);
+    }
+    if (data.user) {
+        raw.user = data.user;
+        next.user = decodeFilter(data.user);
+    } else if (data.user_add?.length && next.user) {
+        data.user_add.forEach(url => filterAdd(next.user, url));
+        raw.user = { ...raw.user, bits: encodeBits(next.user.bits) };
+    }
+
+    raw.epoch = data.epoch;
+    raw.official_version = data.official_version;
+    raw.user_version = data.user_version;
+
+    blFilter = { raw, ...next };
+    await chrome.storage.local.set({ bl_filter: raw });
+}
+
+function safeSyncFilter() {
+    syncBlacklistFilter().catch(err => console.warn("[BLK] 過濾器同步失敗:", err));
+}
+
+// 回傳命中來源 "official" / "user"，未命中回傳 null（官方優先，與後端一致）
+async function matchLocalBlacklist(url) {
+    const state = await loadFilterState();
+    if (!state) return null;
+
+    const candidates = url.endsWith("/") ? [url, url.slice(0, -1)] : [url, url + "/"];
+    if (candidates.some(u => filterHas(state.official, u))) return "official";
+    if (candidates.some(u => filterHas(state.user, u))) return "user";
+    return null;
+}
+
+function redirectToBlockPage(tabId, source, originalUrl) {
+    // 判斷是官方還是使用者黑名單
+    const pageName = (source === "official") ? "block_official.html" : "block_user.html";
+    chrome.tabs.update(tabId, {
+        url: chrome.runtime.getURL(`${pageName}?target=${encodeURIComponent(originalUrl)}`)
+    });
+}
+
+// ===== 判定結果快取（origin + path → 結果 / 版本 / 到期時間）=====
+
+function verdictKey(url) {
+    try {
+        const u = new URL(url);
+        return u.origin + u.pathname;
+    } catch {
+        return null;
+    }
+}
+
+function parseMaxAge(resp) {
+    const m = /max-age=(\d+)/.exec(resp.headers.get("Cache-Control") || "");
+    return m ? Number(m[1]) : DEFAULT_VERDICT_TTL;
+}
+
+async function cacheVerdict(url, data) {
+    const key = verdictKey(url);
+    if (!key || !data.verdict_version) return;
+
+    const { verdict_cache = {} } = await chrome.storage.local.get("verdict_cache");
+    verdict_cache[key] = {
+        result: data,
+        version: data.verdict_version,
+        expires: Date.now() + (data.cache_ttl ?? DEFAULT_VERDICT_TTL) * 1000
+    };
+
+    // 超過上限時先丟掉最早到期的項目
+    const keys = Object.keys(verdict_cache);
+    if (keys.length > MAX_CACHED_VERDICTS) {
+        keys.sort((a, b) => verdict_cache[a].expires - verdict_cache[b].expires)
+            .slice(0, keys.length - MAX_CACHED_VERDICTS)
+            .forEach(k => delete verdict_cache[k]);
+    }
+    await chrome.storage.local.set({ verdict_cache });
+}
+
+// 查詢判定快取；過期的項目帶 ETag 向後端重新驗證（未變動時只回 304）
+async function lookupVerdict(url) {
+    const key = verdictKey(url);
+    if (!key) return null;
+
+    const { verdict_cache = {} } = await chrome.storage.local.get("verdict_cache");
+    const entry = verdict_cache[key];
+    if (!entry) return null;
+    if (Date.now() < entry.expires) return entry.result;
+
+    const resp = await fetch(`${VERDICT_URL}?url=${encodeURIComponent(url)}`, {
+        headers: { "If-None-Match": `"${entry.version}"` }
+    });
+
+    if (resp.status === 304) {
+        entry.expires = Date.now() + parseMaxAge(resp) * 1000;
+        await chrome.storage.local.set({ verdict_cache });
+        return entry.result;
+    }
+
+    delete verdict_cache[key];
+    await chrome.storage.local.set({ verdict_cache });
+    if (!resp.ok) return null;
+
+    const data = await resp.json();
+    // 黑名單結果不快取，每次都由後端 / 本地過濾器重新確認
+    if (!data.result.is_blacklisted) await cacheVerdict(url, data.result);
+    return data.result;
+}
+
+// ===== 連結預檢快取（網址去掉 # → 預檢結果 / 到期時間）=====
+// 只放記憶體：預檢是投機性的，service worker 重啟後遺失也只是少了提前攔截
+
+const precheckCache = new Map(); // key → { result, expires, pending }
+
+function precheckKey(url) {
+    try {
+        const u = new URL(url);
+        u.hash = "";
+        return u.toString();
+    } catch {
+        return null;
+    }
+}
+
+function precheckUrls(urls) {
+    const now = Date.now();
+    const todo = [];
+    for (const url of urls) {
+        const key = precheckKey(url);
+        if (!key || todo.includes(key)) continue;
+        const entry = precheckCache.get(key);
+        if (entry && (entry.pending || now < entry.expires)) continue;
+        todo.push(key);
+    }
+
+    for (let i = 0; i < todo.length; i += MAX_PRECHECK_BATCH) {
+        const batch = todo.slice(i, i + MAX_PRECHECK_BATCH);
+        const pending = fetch(PRECHECK_URL, {
+            method: "POST",
+            headers: { "Content-Type": "application/json" },
+            body: JSON.stringify({ urls: batch })
+        })
+        .then(resp => resp.json())
+        .then(data => {
+            const expires = Date.now() + (data.ttl ?? DEFAULT_VERDICT_TTL) * 1000;
+            const byUrl = new Map((data.results || []).map(r => [r.url, r]));
+            batch.forEach(key => {
+                const result = byUrl.get(key);
+                if (result) precheckCache.set(key, { result, expires });
+                else precheckCache.delete(key);
+            });
+        })
+        .catch(err => {
+            batch.forEach(key => precheckCache.delete(key));
+            console.warn("[PRECHECK] 預檢失敗:", err);
+        });
+        batch.forEach(key => precheckCache.set(key, { result: null, expires: 0, pending }));
+    }
+
+    // Map 依插入順序，超過上限時丟掉最早的項目
+    for (const key of precheckCache.keys()) {
+        if (precheckCache.size <= MAX_CACHED_PRECHECKS) break;
+        precheckCache.delete(key);
+    }
+}
+
+// 取得預檢結果；還在進行中就等一下（最多 waitMs），沒有或已過期回傳 null
+async function lookupPrecheck(url, waitMs) {
+    const key = precheckKey(url);
+    let entry = key && precheckCache.get(key);
+    if (!entry) return null;
+    if (entry.pending) {
+        await Promise.race([entry.pending, new Promise(r => setTimeout(r, waitMs))]);
+        entry = precheckCache.get(key);
+        if (!entry || entry.pending) return null;
+    }
+    return Date.now() < entry.expires ? entry.result : null;
+}
+
+chrome.runtime.onInstalled.addListener(safeSyncFilter);
+chrome.runtime.onStartup.addListener(safeSyncFilter);
+chrome.alarms.create("bl_filter_sync", { periodInMinutes: FILTER_SYNC_MINUTES });
+chrome.alarms.onAlarm.addListener((alarm) => {
+    if (alarm.name === "bl_filter_sync") safeSyncFilter();
+});
+
+chrome.tabs.onRemoved.addListener((tabId) => cancelAnalysis(tabId, "分頁關閉"));
+
+// 導航開始前就先查本地過濾器，命中黑名單不需等頁面載入或後端往返
+chrome.webNavigation.onBeforeNavigate.addListener(async (details) => {
+    if (details.frameId !== 0) return;
+    // 離開頁面：上一頁的分析結果已經沒人需要
+    cancelAnalysis(details.tabId, "離開頁面");
+    if (!/^https?:/.test(details.url)) return;
+
+    const { enabled, skip_once } = await chrome.storage.local.get({ enabled: true, skip_once: null });
+    if (!enabled) return;
+    if (skip_once && details.url.includes(skip_once)) return;
+
+    const source = await matchLocalBlacklist(details.url);
+    if (source) {
+        console.log("[BLK] 本地過濾器攔截:", source, details.url);
+        redirectToBlockPage(details.tabId, source, details.url);
+        return;
+    }
+
+    // 使用者停在連結上時已預檢過：黑名單直接攔截，高風險先顯示預檢結果（頁面載入後仍會完整分析）
+    const pre = await lookupPrecheck(details.url, PRECHECK_WAIT_MS);
+    if (!pre?.warn) return;
+    if (pre.blacklisted) {
+        console.log("[BLK] 預檢攔截:", pre.blacklist_source, details.url);
+        redirectToBlockPage(details.tabId, pre.blacklist_source, details.url);
+        return;
+    }
+    chrome.storage.local.set({
+        last_analysis_result: {
+            is_potential_phishing: true,
+            is_blacklisted: false,
+            blacklist_source: null,
+            explanation: pre.reasons.map(r => r.replace(/（[+-]?\d+分）/, "")).join("、") || "網址檢查發現可疑特徵",
+            risk_score: pre.risk_score,
+            model_probability: pre.model_probability,
+            elapsed_time: 0,
+            precheck: true
+        }
+    }, () => safeSendMessage({ type: "analysis_result_done" }));
+});
+
+// 單頁應用以 History API 換頁（pushState / replaceState / 上一頁）時不會重新載入 content.js，
+// 通知 content.js 等畫面穩定後重新擷取（content script 在隔離環境，無法自己攔截頁面的 pushState）
+chrome.webNavigation.onHistoryStateUpdated.addListener((details) => {
+    if (details.frameId !== 0) return;
+    chrome.tabs.sendMessage(details.tabId, { action: "spa_navigation", url: details.url }).catch(() => {});
+});
+
 chrome.runtime.onMessage.addListener((msg, sender, sendResponse) => {
+
+    // 0. 使用者黑名單異動（來自 popup）→ 立即同步過濾器
+    if (msg.type === "blacklist_changed") {
+        safeSyncFilter();
+        return;
+    }
     
+    // 0-1. 連結預檢 (來自 content.js，使用者停在外部連結上)
+    if (msg.type === "precheck") {
+        precheckUrls(msg.urls || []);
+        return;
+    }
+
+    // 0-2. 查詢判定快取 (來自 content.js，命中就不必擷取與上傳)
+    if (msg.type === "verdict_lookup") {
+        lookupVerdict(msg.url)
+        .then(result => {
+            if (!result) {
+                sendResponse({ hit: false });
+                return;
+            }
+            chrome.storage.local.set({ last_analysis_result: { ...result, cached: true } }, () => {
+                safeSendMessage({ type: "analysis_result_done" });
+            });
+            if (result.is_blacklisted && sender?.tab?.id) {
+                redirectToBlockPage(sender.tab.id, result.blacklist_source, msg.url);
+            }
+            sendResponse({ hit: true });
+        })
+        .catch(err => {
+            console.warn("[CACHE] 判定快取查詢失敗:", err);
+            sendResponse({ hit: false });
+        });
+        return true;
+    }
+
     // 1. 處理「仍要前往」 (使用者在警告頁面點擊放行)
     if (msg.type === "open_original_site" && msg.target) {
         chrome.storage.local.set({ skip_once: msg.target }, () => {
@@ -21,44 +473,79 @@ chrome.runtime.onMessage.addListener((msg, sender, sendResponse) => {
 
     // 2. 處理分析請求 (來自 content.js)
     if (msg.type === "analyze_request") {
-        const text = msg.text || "";
         safeSendMessage({ stage: "已傳送至後端分析…" });
 
+        // 同一分頁只保留最新一次擷取
+        const tabId = sender?.tab?.id;
+        if (tabId !== undefined) cancelAnalysis(tabId, "重新擷取");
+        const job = { requestId: crypto.randomUUID(), url: msg.url, controller: new AbortController() };
+        if (tabId !== undefined) inflight.set(tabId, job);
+
         // 呼叫 Python 後端
-        fetch(API_URL, {
+        Promise.all([buildAnalyzeRequest(msg), getClientId()])
+        .then(([req, cid]) => fetch(API_URL, {
             method: "POST",
-            headers: { "Content-Type": "application/json" },
-            body: JSON.stringify({ text })
-        })
+            headers: {
+                ...req.headers,
+                "X-Client-Id": cid,
+                "X-Request-Id": job.requestId,
+                "X-Analyze-Priority": analyzePriority(msg, sender)
+            },
+            body: req.body,
+            signal: job.controller.signal
+        }))
         .then(resp => {
             safeSendMessage({ stage: "模型正在運算中…" });
             return resp.json();
         })
         .then(data => {
+            if (inflight.get(tabId) === job) inflight.delete(tabId);
+
+            // 增量請求的 base 後端已不認得（過期 / 換了節點）：由 content.js 改送完整內容
+            if (data.success === false && data.reason === "need_full") {
+                sendResponse({ ok: false, need_full: true });
+                return;
+            }
+
+            // 後端排程器逾時丟棄 / 已取消：沒有判定結果，只更新狀態
+            if (data.success === false) {
+                chrome.storage.local.set({ analysis_running: false });
+                safeSendMessage({ stage: data.message });
+                sendResponse({ ok: false, error: data.message });
+                return;
+            }
+
             // 儲存結果供 Popup 顯示
             chrome.storage.local.set({ last_analysis_result: data }, () => {
                 safeSendMessage({ type: "analysis_result_done" });
             });
 
+            // 記錄判定結果，之後同一頁面在 TTL 內不再擷取
+            // （伺服器忙碌時的快速判定 degraded 不快取，下次擷取會重新完整分析）
+            if (!data.is_blacklisted && !data.degraded && msg.url) {
+                cacheVerdict(msg.url, data).catch(err => console.warn("[CACHE] 寫入失敗:", err));
+            }
+
             // ★ 核心阻擋邏輯 ★
             if (data.is_blacklisted === true) {
                 console.log("[BLK] 觸發黑名單攔截:", data.blacklist_source);
-                
-                // 判斷是官方還是使用者黑名單
-                const pageName = (data.blacklist_source === "official") ? "block_official.html" : "block_user.html";
-                
+
                 // 取得原始網址 (優先用 content.js 傳來的，沒有的話用 tab url)
                 const originalUrl = msg.url || sender?.tab?.url;
 
                 // 執行導向
-                chrome.tabs.update(sender.tab.id, {
-                    url: chrome.runtime.getURL(`${pageName}?target=${encodeURIComponent(originalUrl)}`)
-                });
+                redirectToBlockPage(sender.tab.id, data.blacklist_source, originalUrl);
             }
             
             sendResponse({ ok: true });
         })
         .catch(err => {
+            if (inflight.get(tabId) === job) inflight.delete(tabId);
+            if (err.name === "AbortError") {
+                chrome.storage.local.set({ analysis_running: false });
+                sendResponse({ ok: false, error: "cancelled" });
+                return;
+            }
             console.error("後端分析失敗:", err);
             safeSendMessage({ stage: "連線後端失敗" });
             sendResponse({ ok: false, error: String(err) });
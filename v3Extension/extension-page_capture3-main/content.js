@@ -1,4 +1,130 @@
-﻿async function mainCapture() {
+﻿// ===== 頁面擷取：在瀏覽器空閒時分段進行，文字與連結到上限就停止，不讀取整頁的 innerText / outerHTML =====
+const MAX_TEXT_CHARS = 20000;    // 限制長度避免 Payload 太大
+const MAX_LINKS = 500;           // 限制連結數量
+const MAX_FORMS = 50;
+const IDLE_TIMEOUT_MS = 1000;    // 頁面一直忙碌時最多等這麼久，之後強制執行
+const FORCED_SLICE_STEPS = 200;  // 強制執行時每段處理的節點數
+const SPA_SETTLE_MS = 500;       // 單頁應用換頁後 DOM 停止變動這麼久才擷取
+const SPA_SETTLE_MAX_MS = 3000;  // 一直變動（動畫、輪播）時最多等這麼久
+const SKIP_TAGS = new Set(["head", "script", "style", "noscript", "template", "svg", "canvas", "iframe", "object"]);
+const INLINE_TAGS = new Set(["a", "abbr", "b", "bdi", "cite", "code", "em", "font", "i", "kbd", "label", "mark", "q", "s", "small", "span", "strong", "sub", "sup", "time", "u"]);
+
+let lastCapture = null;  // 上一次送出的擷取 { id, links, text }，單頁應用換頁時只送差異
+let captureSeq = 0;      // 較新的擷取開始後，進行中的舊擷取直接放棄
+
+const idle = () => new Promise(resolve => {
+    if (typeof requestIdleCallback === "function") {
+        requestIdleCallback(resolve, { timeout: IDLE_TIMEOUT_MS });
+    } else {
+        setTimeout(() => resolve({ didTimeout: true, timeRemaining: () => 0 }), 0);
+    }
+});
+
+// 每處理一個節點呼叫一次：空閒時間用完（逾時觸發時則每 FORCED_SLICE_STEPS 個節點）就讓出主執行緒
+function idleSlicer() {
+    let deadline = null;
+    let steps = 0;
+    return async () => {
+        steps++;
+        if (deadline) {
+            if (deadline.timeRemaining() > 1) return;
+            if (deadline.didTimeout && steps < FORCED_SLICE_STEPS) return;
+        }
+        deadline = await idle();
+        steps = 0;
+    };
+}
+
+// 與 innerText 相同不收錄畫面上看不到的文字（display:none、visibility:hidden、content-visibility:hidden），
+// 否則攻擊者可以藏一段文字來左右評分。visibility:hidden 底下又設回 visible 的少數情況一併略過
+function isHidden(el) {
+    const style = getComputedStyle(el);
+    return style.display === "none" || style.visibility === "hidden" || style.contentVisibility === "hidden";
+}
+
+// 依文件順序走訪文字節點，略過 script / style 與隱藏元素，湊滿 MAX_TEXT_CHARS 就停止
+async function extractText(root, slice) {
+    const walker = document.createTreeWalker(root, NodeFilter.SHOW_ELEMENT | NodeFilter.SHOW_TEXT, {
+        acceptNode(node) {
+            if (node.nodeType === Node.TEXT_NODE) return NodeFilter.FILTER_ACCEPT;
+            if (SKIP_TAGS.has(node.localName) || isHidden(node)) return NodeFilter.FILTER_REJECT;
+            return NodeFilter.FILTER_SKIP;
+        }
+    });
+
+    let text = "";
+    let prevParent = null;
+    while (text.length < MAX_TEXT_CHARS) {
+        await slice();
+        const node = walker.nextNode();
+        if (!node) break;
+        const part = node.data.replace(/\s+/g, " ").trim();
+        if (!part) continue;
+        const parent = node.parentNode.localName;
+        // 行內元素（<b>、<a>…）與前後文字以空白相接，其餘視為不同段落
+        if (text) text += INLINE_TAGS.has(parent) || INLINE_TAGS.has(prevParent) ? " " : "\n";
+        text += part;
+        prevParent = parent;
+    }
+    return text.slice(0, MAX_TEXT_CHARS);
+}
+
+// 正規化：移除追蹤參數與 #
+function normalizeLink(u) {
+    try {
+        const url = new URL(u, location.href);
+        ["utm_source", "utm_medium", "utm_campaign", "fbclid"].forEach(p => url.searchParams.delete(p));
+        url.hash = "";
+        return url.toString();
+    } catch { return u; }
+}
+
+// 邊走訪邊去重，收滿 MAX_LINKS 就停止（getElementsByTagName 是即時集合，不會先列出全部 <a>）
+async function collectLinks(slice) {
+    const links = new Set();
+    for (const a of document.getElementsByTagName("a")) {
+        await slice();
+        const href = a.getAttribute("href");
+        if (!href || href.startsWith("javascript:") || href.startsWith("mailto:") || href.startsWith("#")) continue;
+        links.add(normalizeLink(href));
+        if (links.size >= MAX_LINKS) break;
+    }
+    return [...links];
+}
+
+// 文字差異 [相同開頭長度, 相同結尾長度, 中間的新文字]（UTF-16 索引，不切開代理對），後端以上一次的文字還原
+function textDelta(before, after) {
+    const max = Math.min(before.length, after.length);
+    let prefix = 0;
+    while (prefix < max && before.charCodeAt(prefix) === after.charCodeAt(prefix)) prefix++;
+    if (prefix > 0 && prefix < after.length && /[\uD800-\uDBFF]/.test(after[prefix - 1])) prefix--;
+    let suffix = 0;
+    while (suffix < max - prefix
+        && before.charCodeAt(before.length - 1 - suffix) === after.charCodeAt(after.length - 1 - suffix)) suffix++;
+    if (suffix > 0 && /[\uDC00-\uDFFF]/.test(after[after.length - suffix])) suffix--;
+    return [prefix, suffix, after.slice(prefix, after.length - suffix)];
+}
+
+// 表單摘要：送出目標與是否含密碼欄位（後端判斷帳密是否送往外部 / 可疑網域）
+function collectForms(currentURL) {
+    const resolveAction = (form) => {
+        try { return new URL(form.getAttribute("action") || "", location.href).toString(); }
+        catch { return ""; }
+    };
+    const forms = [...document.forms].slice(0, MAX_FORMS).map(form => ({
+        action: resolveAction(form),
+        method: (form.getAttribute("method") || "get").toLowerCase(),
+        password: !!form.querySelector("input[type=password]")
+    }));
+    // 不在 <form> 內的密碼欄位（由 JS 送出），視為送往頁面本身
+    if ([...document.querySelectorAll("input[type=password]")].some(input => !input.form)) {
+        forms.push({ action: currentURL, method: "post", password: true });
+    }
+    return forms;
+}
+
+async function mainCapture(manual = false) {
+    const seq = ++captureSeq;
     const currentURL = location.href;
 
     // 1. 檢查是否跳過 (Skip Logic)
@@ -10,6 +136,16 @@
         return; 
     }
 
+    // 1-1. 近期已判定過的頁面（同 origin + path）直接沿用結果，不擷取也不上傳
+    if (!manual) {
+        const cached = await chrome.runtime.sendMessage({ type: "verdict_lookup", url: currentURL })
+            .catch(() => null);
+        if (cached?.hit) {
+            console.log("[EXT] 沿用快取判定:", currentURL);
+            return;
+        }
+    }
+
     // 2. 開始 UI 狀態更新
     chrome.storage.local.set({ analysis_running: true });
     chrome.runtime.sendMessage({ stage: "開始分析" });
@@ -18,65 +154,151 @@
     chrome.storage.local.set({ analysis_start_time: start });
     chrome.runtime.sendMessage({ stage: "資料擷取中…" });
 
-    // 3. 抓取網頁內容
-    // 這裡不又fetch一次，直接用渲染好的內容通常更準確
-    let html = document.documentElement.outerHTML;
-    const doc = document; // 直接使用當前 document
-
-    // 4. 提取主要文字
+    // 3. 提取主要文字（直接用渲染好的 DOM，不再 fetch 一次）
+    const slice = idleSlicer();
     const mainSelectors = ["article", "main", "#content", ".content", ".post", ".entry", ".article", ".main"];
     let mainArea = null;
     for (const sel of mainSelectors) {
-        mainArea = doc.querySelector(sel);
+        mainArea = document.querySelector(sel);
         if (mainArea) break;
     }
+    const text = await extractText(mainArea || document.body, slice);
 
-    let contentText = mainArea ? mainArea.innerText : doc.body.innerText;
-    // 簡單清洗：去除非文字雜訊
-    contentText = contentText
-        .replace(/\n\s*\n+/g, "\n\n") // 把多個換行變成兩個
-        .replace(/[ \t]{2,}/g, " ")   // 把多個空白變成一個
-        .trim();
-
-    // 5. 提取連結 (正規化)
-    const normalize = (u) => {
-        try {
-            const url = new URL(u, location.href);
-            // 移除追蹤參數
-            ["utm_source", "utm_medium", "utm_campaign", "fbclid"].forEach(p => url.searchParams.delete(p));
-            url.hash = "";
-            return url.toString();
-        } catch { return u; }
-    };
+    // 4. 提取連結 (正規化) 與表單摘要
+    const links = await collectLinks(slice);
+    if (seq !== captureSeq) return;  // 擷取期間又換頁或手動擷取，交給較新的擷取
+    const forms = collectForms(currentURL);
 
-    const links = [...doc.querySelectorAll("a[href]")]
-        .map(a => a.getAttribute("href"))
-        .filter(h => h && !h.startsWith("javascript:") && !h.startsWith("mailto:") && !h.startsWith("#"))
-        .map(normalize);
-
-    // 6. 組合資料
-    const output = [
-        `=== URL ===\n${currentURL}`,
-        `=== Timestamp ===\n${Date.now()}`,
-        `=== Page Title ===\n${document.title.trim()}`,
-        `=== Visible Text (main excerpt) ===\n${contentText.slice(0, 20000)}`, // 限制長度避免 Payload 太大
-        `=== Links ===\n${links.slice(0, 500).join("\n")}` // 限制連結數量
-    ].join("\n\n");
-
-    // 7. 發送給 Background 處理
-    chrome.runtime.sendMessage({
+    // 5. 發送給 Background 處理（結構化欄位，由 background.js 編碼成 v2 格式）
+    const captureId = crypto.randomUUID();
+    const message = {
         type: "analyze_request",
-        text: output,
-        url: currentURL, // 補上 URL 參數方便後端使用
+        url: currentURL,
+        title: document.title.trim(),
+        text,
+        forms,
+        captureId,
+        manual, // 手動擷取 → 後端優先處理
         startTime: start
+    };
+    const previous = lastCapture;
+    lastCapture = { id: captureId, links, text };
+
+    // 5-1. 單頁應用換頁：只送與上一次擷取相比新增 / 移除的連結與文字差異；後端不認得上一次擷取時改送完整內容
+    if (previous && !manual) {
+        const before = new Set(previous.links);
+        const after = new Set(links);
+        const delta = textDelta(previous.text, text);
+        const response = await chrome.runtime.sendMessage({
+            ...message,
+            base: previous.id,
+            linksAdded: links.filter(l => !before.has(l)),
+            linksRemoved: previous.links.filter(l => !after.has(l)),
+            textDelta: delta[2].length < text.length ? delta : null
+        }).catch(() => null);
+        if (!response?.need_full) return;
+        console.log("[EXT] 後端要求完整內容:", currentURL);
+    }
+    chrome.runtime.sendMessage({ ...message, links }).catch(() => {});
+}
+
+// ===== 單頁應用換頁（History API）：網址（不含 #）改變後等 DOM 穩定再擷取 =====
+let captureEnabled = false;
+let lastNavigation = location.href.split("#")[0];
+
+// DOM 連續 SPA_SETTLE_MS 沒有變動（或等滿 SPA_SETTLE_MAX_MS）才 resolve
+function waitForDomSettle() {
+    return new Promise(resolve => {
+        const done = () => {
+            observer.disconnect();
+            clearTimeout(quiet);
+            clearTimeout(limit);
+            resolve();
+        };
+        let quiet = setTimeout(done, SPA_SETTLE_MS);
+        const limit = setTimeout(done, SPA_SETTLE_MAX_MS);
+        const observer = new MutationObserver(() => {
+            clearTimeout(quiet);
+            quiet = setTimeout(done, SPA_SETTLE_MS);
+        });
+        observer.observe(document.body, { childList: true, subtree: true, characterData: true });
     });
 }
 
+async function onSpaNavigation() {
+    const target = location.href.split("#")[0];
+    if (!captureEnabled || target === lastNavigation) return;
+    lastNavigation = target;
+    await waitForDomSettle();
+    if (location.href.split("#")[0] !== target) return;  // 等待期間又換頁
+    mainCapture();
+    precheckFewOffsiteLinks();
+}
+
+// ===== 連結預檢：滑鼠移到 / 聚焦外部連結時先請後端檢查目標網址，導航時判定已在快取中 =====
+const PRECHECK_DELAY_MS = 150;   // 滑鼠停留這麼久才送出（只是劃過的連結不送）
+const PRECHECK_AUTO_MAX = 10;    // 外部連結不超過這個數量的頁面，載入後直接整批預檢
+const prechecked = new Set();
+let precheckTimer = null;
+
+// 指向其他主機的 http(s) 連結，回傳去掉 # 的網址；其餘回傳 null
+function offsiteTarget(a) {
+    try {
+        const url = new URL(a.href, location.href);
+        if (!/^https?:$/.test(url.protocol) || url.host === location.host) return null;
+        url.hash = "";
+        return url.toString();
+    } catch { return null; }
+}
+
+function requestPrecheck(urls) {
+    const fresh = urls.filter(u => !prechecked.has(u));
+    if (!fresh.length) return;
+    fresh.forEach(u => prechecked.add(u));
+    chrome.runtime.sendMessage({ type: "precheck", urls: fresh }).catch(() => {});
+}
+
+function onLinkIntent(event) {
+    const a = event.target.closest?.("a[href]");
+    if (!a) return;
+    const url = offsiteTarget(a);
+    if (!url || prechecked.has(url)) return;
+    clearTimeout(precheckTimer);
+    // 按下滑鼠時立即送出，離導航只剩約 100 ms
+    if (event.type === "pointerdown") {
+        requestPrecheck([url]);
+        return;
+    }
+    precheckTimer = setTimeout(() => requestPrecheck([url]), PRECHECK_DELAY_MS);
+}
+
+function precheckFewOffsiteLinks() {
+    const targets = new Set();
+    for (const a of document.querySelectorAll("a[href]")) {
+        const url = offsiteTarget(a);
+        if (url) targets.add(url);
+        if (targets.size > PRECHECK_AUTO_MAX) return;
+    }
+    if (targets.size) requestPrecheck([...targets]);
+}
+
+function startPrecheck() {
+    document.addEventListener("mouseover", onLinkIntent, { capture: true, passive: true });
+    document.addEventListener("focusin", onLinkIntent, { capture: true });
+    document.addEventListener("pointerdown", onLinkIntent, { capture: true, passive: true });
+    precheckFewOffsiteLinks();
+}
+
 // 初始化與監聽
 chrome.storage.local.get({ enabled: true }, (items) => {
-    if (items.enabled) mainCapture();
+    if (!items.enabled) return;
+    captureEnabled = true;
+    mainCapture();
+    startPrecheck();
+    window.addEventListener("popstate", onSpaNavigation);
 });
 
 chrome.runtime.onMessage.addListener((msg) => {
-    if (msg.action === "manual_capture") mainCapture();
+    if (msg.action === "manual_capture") mainCapture(true);
+    if (msg.action === "spa_navigation") onSpaNavigation();
 });
\ No newline at end of file
@@ -103,6 +103,13 @@
             `;
         }
         
+        // 伺服器忙碌時只做了快速檢查（規則 / URL 模型），沒有經過 LLM 分析
+        const degradedHtml = result.degraded
+            ? `<div style="font-size: 11px; color: #b8860b;">⚠️ 伺服器忙碌，此為快速檢查結果</div>`
+            : result.precheck
+            ? `<div style="font-size: 11px; color: #b8860b;">⚠️ 導航前的網址預檢結果，頁面分析進行中</div>`
+            : "";
+
         ui.result.innerHTML = `
             <div>
                 <b>偵測結果：</b> ${result.is_potential_phishing ? "<span style='color: red;'>⚠️ 釣魚網站</span>" : "<span style='color: green;'>✓ 合法網站</span>"}
@@ -111,6 +118,7 @@
             <br>
             <div><b>理由：</b><br>${result.explanation}</div>
             ${similarSiteHtml}
+            ${degradedHtml}
             <br>
             <div style="font-size: 11px; color: #666;"><b>耗時：</b> ${elapsed} 秒</div>
         `;
@@ -149,7 +157,10 @@
         const data = await callApi(endpoint, { url });
         if (data) {
             alert(data.message);
-            if (data.success) loadBlacklist();
+            if (data.success) {
+                loadBlacklist();
+                chrome.runtime.sendMessage({ type: "blacklist_changed" });
+            }
         }
     }
 
@@ -211,7 +222,10 @@
         const data = await callApi("/clear_blacklist", {}); // 空物件觸發 POST
         if (data) {
             alert(data.message);
-            if (data.success) loadBlacklist();
+            if (data.success) {
+                loadBlacklist();
+                chrome.runtime.sendMessage({ type: "blacklist_changed" });
+            }
         }
     });
 
@@ -0,0 +1,199 @@
+# admission.py — /analyze 的准入控制與降載
+#
+# 突發流量（例如瀏覽器一次還原 40 個分頁）時，每個請求都會進入排程器等 LLM，
+# 所有人的延遲一起拉長，Flask 的請求執行緒也被等待中的請求佔滿。請求送進排程器前先在這裡決定：
+#   - 每個客戶端（X-Client-Id = 擴充功能實例 id；沒有時用 IP）一個 token bucket，限制送出速率
+#   - 每個客戶端同時排隊 / 執行中的分析數有上限
+#   - 全域排隊數或預估等待時間超過門檻時降載：不排隊，直接回傳規則 / URL 模型的快速判定（degraded）
+# 背景分頁的門檻只有前景的一半，負載升高時先降載背景分頁。
+# 准入、降載原因、排隊等待時間等計數器由 /metrics 輸出。
+
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+
+from scheduler import DEFAULT_DEADLINE, MAX_DEADLINE, PRIORITY_BACKGROUND, PRIORITY_FOREGROUND, WORKERS
+
+# 每個客戶端每秒補充的 token 數與桶子容量（容量 = 可瞬間送出的請求數）
+CLIENT_RATE = float(os.environ.get("ADMIT_CLIENT_RATE", 0.5))
+CLIENT_BURST = float(os.environ.get("ADMIT_CLIENT_BURST", 10))
+# 每個客戶端同時排隊 + 執行中的分析上限
+CLIENT_MAX_INFLIGHT = int(os.environ.get("ADMIT_CLIENT_MAX_INFLIGHT", 6))
+# 全域降載門檻（前景請求；背景請求乘上 BACKGROUND_FACTOR）
+SHED_QUEUE_DEPTH = int(os.environ.get("SHED_QUEUE_DEPTH", 24))
+SHED_PREDICTED_WAIT = float(os.environ.get("SHED_PREDICTED_WAIT", 20))
+BACKGROUND_FACTOR = 0.5
+# 還沒有完成任何分析時假設的單次分析耗時（秒），之後以指數移動平均更新
+INITIAL_SERVICE_TIME = float(os.environ.get("ADMIT_INITIAL_SERVICE_TIME", 5))
+SERVICE_EWMA_ALPHA = 0.2
+
+MAX_CLIENTS = 10000
+CLIENT_ID_MAX_LEN = 64
+# 等待時間分布的上界（秒）
+WAIT_BUCKETS = (0.1, 0.5, 1, 2, 5, 10, 30, 60)
+
+SHED_MESSAGES = {
+    "client_rate": "請求過於頻繁",
+    "client_inflight": "同時分析的頁面過多",
+    "queue_depth": "分析佇列已滿",
+    "predicted_wait": "預估等待時間過長",
+}
+
+
+class _Client:
+    __slots__ = ("tokens", "updated", "inflight")
+
+    def __init__(self, now: float):
+        self.tokens = CLIENT_BURST
+        self.updated = now
+        self.inflight = 0
+
+    def refill(self, now: float):
+        self.tokens = min(CLIENT_BURST, self.tokens + (now - self.updated) * CLIENT_RATE)
+        self.updated = now
+
+
+@dataclass
+class Ticket:
+    client_id: str
+    admitted: bool
+    reason: str | None = None          # 降載原因（SHED_MESSAGES 的 key）
+    predicted_wait: float = 0.0
+    _client: _Client | None = None
+
+    @property
+    def message(self) -> str:
+        return SHED_MESSAGES.get(self.reason, "")
+
+
+_lock = threading.Lock()
+_clients = OrderedDict()   # client_id → _Client（LRU）
+_service_time = INITIAL_SERVICE_TIME
+_counters = Counter()
+_shed = Counter()
+_wait_hist = [0] * (len(WAIT_BUCKETS) + 1)
+_wait_total = 0.0
+_wait_max = 0.0
+
+
+def client_id(header_value: str | None, remote_addr: str | None) -> str:
+    """擴充功能送來的實例 id 優先，否則以 IP 區分。"""
+    value = (header_value or "").strip()
+    if value:
+        return "id:" + value[:CLIENT_ID_MAX_LEN]
+    return "ip:" + (remote_addr or "unknown")
+
+
+def _predicted_wait(queue_depth: dict, running: int, priority: int) -> float:
+    """排在前面的工作數 × 平均分析耗時 / worker 數。前景只需等前景，背景要等全部。"""
+    ahead = queue_depth.get("foreground", 0)
+    if priority == PRIORITY_BACKGROUND:
+        ahead += queue_depth.get("background", 0)
+    busy = max(0, running - WORKERS + 1)
+    return (ahead + busy) * _service_time / max(1, WORKERS)
+
+
+def admit(cid: str, priority: int, scheduler, deadline_ms: int | None = None) -> Ticket:
+    """決定請求要排入分析或降載；admitted 的 Ticket 之後必須交給 release()。
+
+    deadline_ms 與 scheduler.submit 相同：預估等待超過截止時間時排了也只會逾時，直接降載。
+    """
+    depth = scheduler.queue_depth()
+    running = scheduler.running_count()
+    factor = BACKGROUND_FACTOR if priority == PRIORITY_BACKGROUND else 1.0
+    now = time.monotonic()
+
+    with _lock:
+        client = _clients.get(cid)
+        if client is None:
+            client = _clients[cid] = _Client(now)
+            while len(_clients) > MAX_CLIENTS:
+                _clients.popitem(last=False)
+        else:
+            _clients.move_to_end(cid)
+        client.refill(now)
+
+        queued = depth.get("foreground", 0)
+        if priority == PRIORITY_BACKGROUND:
+            queued += depth.get("background", 0)
+        predicted = _predicted_wait(depth, running, priority)
+        deadline = DEFAULT_DEADLINE[priority]
+        if deadline_ms is not None and deadline_ms > 0:
+            deadline = min(deadline_ms / 1000, MAX_DEADLINE)
+        wait_limit = min(SHED_PREDICTED_WAIT * factor, deadline)
+
+        if client.inflight >= CLIENT_MAX_INFLIGHT:
+            reason = "client_inflight"
+        elif client.tokens < 1:
+            reason = "client_rate"
+        elif queued >= SHED_QUEUE_DEPTH * factor:
+            reason = "queue_depth"
+        elif predicted > wait_limit:
+            reason = "predicted_wait"
+        else:
+            reason = None
+
+        if reason is not None:
+            _shed[reason] += 1
+            _counters["shed"] += 1
+            return Ticket(cid, False, reason, predicted)
+
+        client.tokens -= 1
+        client.inflight += 1
+        _counters["admitted"] += 1
+        _counters["admitted_" + ("background" if priority == PRIORITY_BACKGROUND else "foreground")] += 1
+        return Ticket(cid, True, None, predicted, client)
+
+
+def release(ticket: Ticket, job=None):
+    """准入的請求結束（完成、失敗、取消或逾時）時呼叫，並記錄排隊等待與分析耗時。"""
+    global _service_time, _wait_total, _wait_max
+    if not ticket.admitted or ticket._client is None:
+        return
+    with _lock:
+        ticket._client.inflight = max(0, ticket._client.inflight - 1)
+        ticket._client = None
+        if job is None or job.started is None:
+            return
+        wait = job.started - job.submitted
+        _wait_total += wait
+        _wait_max = max(_wait_max, wait)
+        _counters["waited"] += 1
+        i = 0
+        while i < len(WAIT_BUCKETS) and wait > WAIT_BUCKETS[i]:
+            i += 1
+        _wait_hist[i] += 1
+        if job.finished is not None and job.state == "done":
+            service = job.finished - job.started
+            _service_time += SERVICE_EWMA_ALPHA * (service - _service_time)
+
+
+def snapshot(scheduler=None) -> dict:
+    """/metrics 用的計數器快照。"""
+    depth = scheduler.queue_depth() if scheduler is not None else {}
+    running = scheduler.running_count() if scheduler is not None else 0
+    with _lock:
+        waited = _counters["waited"]
+        labels = [f"le_{b}" for b in WAIT_BUCKETS] + ["inf"]
+        return {
+            "admitted": _counters["admitted"],
+            "admitted_foreground": _counters["admitted_foreground"],
+            "admitted_background": _counters["admitted_background"],
+            "shed": _counters["shed"],
+            "shed_reasons": {reason: _shed[reason] for reason in SHED_MESSAGES},
+            "clients": len(_clients),
+            "clients_inflight": sum(c.inflight for c in _clients.values()),
+            "service_time_ewma": round(_service_time, 3),
+            "predicted_wait": {
+                "foreground": round(_predicted_wait(depth, running, PRIORITY_FOREGROUND), 3),
+                "background": round(_predicted_wait(depth, running, PRIORITY_BACKGROUND), 3),
+            },
+            "queue_wait": {
+                "count": waited,
+                "avg": round(_wait_total / waited, 3) if waited else 0.0,
+                "max": round(_wait_max, 3),
+                "histogram": dict(zip(labels, _wait_hist)),
+            },
+        }
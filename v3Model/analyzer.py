@@ -6,13 +6,19 @@ from typing import List, Dict
 from functools import lru_cache
 from urllib.parse import urlparse
 
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_openai import ChatOpenAI
-
-from models import SimplePhishingAnalysis
+# langchain_openai（連帶 openai / httpx）與 models（pydantic schema）只在建立 chain 時才載入，
+# 模型判定或規則即可回應的請求不需要付出這段匯入成本
+from url_classifier import phishing_probability, get_classifier, DECIDE_HIGH, DECIDE_LOW
+from rule_engine import get_rules
+from link_analysis import analyze_links, blacklisted_hosts, is_safe_domain
+from profiler import stage
+import script_table
+# server 在請求進入排程器前先送出 DNS 查詢（透過 get_analyzer() 延後載入 asyncio）
+from dns_intel import prefetch_urls
 from tools import (
     check_url_safety,
     analyze_domain_age,
+    check_dns_hosting,
     check_url_patterns,
     extract_contact_info,
     detect_language_anomaly,
@@ -24,18 +30,6 @@ MODEL = "qwen3:8b"
 BASE_URL = "http://127.0.0.1:11434/v1"
 API_KEY = "ollama"
 
-# ★ 弱白名單（不跳過分析，但限制理由）
-SAFE_DOMAINS = [
-    "google.com", "google.com.tw", "gstatic.com",
-    "facebook.com", "microsoft.com", "github.com",
-    "edu.tw", "gov.tw",
-    "niu.edu.tw",
-]
-
-def is_safe_domain(url):
-    host = urlparse(url).netloc.lower()
-    return any(sd in host for sd in SAFE_DOMAINS)
-
 # 工具結果 → Evidence Block
 def collect_tool_evidence(urls: List[str], visible: str) -> Dict[str, str]:
     evidence = {}
@@ -59,6 +53,12 @@ def collect_tool_evidence(urls: List[str], visible: str) -> Dict[str, str]:
         if age:
             evidence["網域年齡檢查"] = str(age)
 
+    # --- DNS 解析與主機位置（頁面 + 連結主機，請求進來時已先送出查詢） ---
+    if urls:
+        dns = check_dns_hosting.invoke({"urls": urls})
+        if dns:
+            evidence["DNS 解析檢查"] = str(dns)
+
     # --- URL 結構檢查 ---
     patt = check_url_patterns.invoke({"urls": urls})
     if patt:
@@ -102,6 +102,10 @@ def _find_urls(text: str) -> List[str]:
 # LangChain Chain（Evidence → 決定理由）
 @lru_cache(maxsize=4)
 def _build_chain():
+    from langchain_core.prompts import ChatPromptTemplate
+    from langchain_openai import ChatOpenAI
+
+    from models import SimplePhishingAnalysis
 
     llm = ChatOpenAI(
         model=MODEL,
@@ -168,27 +172,156 @@ def _build_chain():
 
     return prompt | llm.with_structured_output(SimplePhishingAnalysis)
 
+def warm_up():
+    """預先載入規則、URL 模型、黑名單網域、字元分類表與 LLM chain（由 server 的背景執行緒呼叫）。"""
+    get_rules()
+    get_classifier()
+    blacklisted_hosts()
+    script_table.get_table()
+    _build_chain()
+
+
+def _parse_risk_score(risk_score_result) -> int | None:
+    if not risk_score_result:
+        return None
+    score_match = re.search(r"(\d+)/100", risk_score_result)
+    return int(score_match.group(1)) if score_match else None
+
+
+def _model_decision(model_prob, risk_score_value):
+    """URL 模型機率夠極端時回傳判定結果（True = 釣魚），否則回傳 None 交給 LLM。"""
+    if model_prob is None:
+        return None
+    if model_prob >= DECIDE_HIGH:
+        return True
+    if model_prob <= DECIDE_LOW and (risk_score_value or 0) < 20:
+        return False
+    return None
+
+
+def _heuristic_result(is_phishing, evidence_dict, risk_score_value, model_prob, start, decided_by) -> dict:
+    """不經 LLM，直接由工具證據組出與 analyze_deep 相同格式的結果。"""
+    if is_phishing:
+        parts = []
+        if model_prob is not None and model_prob >= 0.5:
+            parts.append(f"URL 模型判定釣魚機率 {model_prob:.2f}")
+        reasons = re.search(r"評分依據：(.+)", evidence_dict.get("風險評分", ""))
+        if reasons:
+            parts += [re.sub(r"（[+-]?\d+分）", "", r) for r in reasons.group(1).split("、")]
+        explanation = "、".join(parts[:3]) if parts else "規則檢測發現可疑特徵"
+    else:
+        explanation = "未發現可疑特徵"
+
+    similar = evidence_dict.get("相似網站檢測")
+
+    return {
+        "is_potential_phishing": is_phishing,
+        "explanation": explanation,
+        "elapsed_time": round(time.time() - start, 2),
+        "risk_score": risk_score_value,
+        "similar_site_detection": similar,
+        "model_probability": round(model_prob, 4) if model_prob is not None else None,
+        "decided_by": decided_by,
+    }
+
+# 降載時的快速判定：風險評分達此門檻即視為釣魚（對應「高風險」以上）
+QUICK_PHISHING_SCORE = 50
+
+
+def analyze_quick(urls: List[str], forms: List[dict] | None = None) -> dict:
+    """伺服器忙碌時使用：只做網址規則、連結分析與 URL 模型（皆為毫秒級），不呼叫 LLM。"""
+    start = time.time()
+    evidence_dict = {}
+    if urls and is_safe_domain(urls[0]):
+        evidence_dict["白名單檢查"] = "官方安全域名（低風險）"
+    if urls:
+        evidence_dict["URL 安全檢查"] = str(check_url_safety.invoke({"url": urls[0]}))
+    patt = check_url_patterns.invoke({"urls": urls})
+    if patt:
+        evidence_dict["可疑結構檢查"] = str(patt)
+
+    link_report = analyze_links(urls, forms)
+    link_evidence = link_report.evidence()
+    if link_evidence:
+        evidence_dict["連結分析"] = link_evidence
+
+    model_prob = phishing_probability(urls[0]) if urls else None
+    if model_prob is not None:
+        evidence_dict["URL 模型評估"] = f"釣魚機率 {model_prob:.2f}"
+
+    risk_score_value = None
+    if urls:
+        evidence_dict["風險評分"] = calculate_risk_score.invoke({
+            "url": urls[0],
+            "evidence": "\n".join(f"{k}: {v}" for k, v in evidence_dict.items()),
+            "model_probability": model_prob,
+        })
+        risk_score_value = _parse_risk_score(evidence_dict["風險評分"])
+
+    decided = _model_decision(model_prob, risk_score_value)
+    if decided is None:
+        decided = (risk_score_value or 0) >= QUICK_PHISHING_SCORE
+    result = _heuristic_result(decided, evidence_dict, risk_score_value, model_prob, start, "quick")
+    result["link_analysis"] = link_report.to_dict()
+    return result
+
 # 主分析流程
-def analyze_deep(text: str) -> dict:
+def analyze_deep(text: str, urls: List[str] | None = None, visible: str | None = None,
+                 forms: List[dict] | None = None, checkpoint=None) -> dict:
+    """深度分析頁面內容。
+
+    urls / visible 由結構化請求（v2）直接提供時，就不再從 text 重新萃取。
+    forms 為頁面表單摘要（送出目標、是否含密碼欄位），供連結分析判斷帳密送往何處。
+    checkpoint 由排程器提供，呼叫 LLM 前執行；請求已取消或逾時時會丟出例外中止分析。
+    """
     start = time.time()
 
-    visible = _extract_visible_text(text)
-    urls = _find_urls(text)
+    with stage("extract_text"):
+        if visible is None:
+            visible = _extract_visible_text(text)
+        if urls is None:
+            urls = _find_urls(text)
     urls_str = "\n".join(urls[:10]) if urls else "（無網址）"
 
     # Collect Evidence
-    evidence_dict = collect_tool_evidence(urls, visible)
+    with stage("tools"):
+        evidence_dict = collect_tool_evidence(urls, visible)
+
+    # 整頁連結批次評估（所有連結，不只 urls[0]）
+    with stage("link_analysis"):
+        link_report = analyze_links(urls, forms)
+    link_evidence = link_report.evidence()
+    if link_evidence:
+        evidence_dict["連結分析"] = link_evidence
+
+    # 本地 URL 分類器（沒有模型檔時為 None）
+    with stage("url_model"):
+        model_prob = phishing_probability(urls[0]) if urls else None
+    if model_prob is not None:
+        evidence_dict["URL 模型評估"] = f"釣魚機率 {model_prob:.2f}"
 
     # 計算風險評分
     risk_score_result = None
     if urls:
         evidence_text_for_score = "\n".join(f"{k}: {v}" for k, v in evidence_dict.items())
-        risk_score_result = calculate_risk_score.invoke({
-            "url": urls[0],
-            "evidence": evidence_text_for_score
-        })
+        with stage("risk_score"):
+            risk_score_result = calculate_risk_score.invoke({
+                "url": urls[0],
+                "evidence": evidence_text_for_score,
+                "model_probability": model_prob,
+            })
         evidence_dict["風險評分"] = risk_score_result
 
+    # 提取風險評分數字
+    risk_score_value = _parse_risk_score(risk_score_result)
+
+    # 模型夠有把握 → 不呼叫 LLM 直接判定
+    decided = _model_decision(model_prob, risk_score_value)
+    if decided is not None:
+        result = _heuristic_result(decided, evidence_dict, risk_score_value, model_prob, start, "model")
+        result["link_analysis"] = link_report.to_dict()
+        return result
+
     # Format Evidence → 傳給 LLM
     evidence_text = (
         "\n".join(f"{k}: {v}" for k, v in evidence_dict.items())
@@ -196,13 +329,18 @@ def analyze_deep(text: str) -> dict:
         "（所有工具檢測正常）"
     )
 
+    # LLM 是最耗時的一步：請求若已取消 / 逾時就不再呼叫
+    if checkpoint is not None:
+        checkpoint()
+
     chain = _build_chain()
 
-    resp = chain.invoke({
-        "visible_text": visible[:3000],
-        "urls": urls_str,
-        "evidence": evidence_text,
-    })
+    with stage("llm"):
+        resp = chain.invoke({
+            "visible_text": visible[:3000],
+            "urls": urls_str,
+            "evidence": evidence_text,
+        })
 
     parsed = resp.model_dump() if hasattr(resp, "model_dump") else dict(resp)
 
@@ -213,13 +351,6 @@ def analyze_deep(text: str) -> dict:
     parts = parts[:3]
     explanation_final = "、".join(parts) if parts else "未發現可疑特徵"
 
-    # 提取風險評分數字
-    risk_score_value = None
-    if risk_score_result:
-        score_match = re.search(r"(\d+)/100", risk_score_result)
-        if score_match:
-            risk_score_value = int(score_match.group(1))
-
     # 提取相似網站檢測
     similar_site_value = parsed.get("similar_site_detection")
     if not similar_site_value and "相似網站檢測" in evidence_dict:
@@ -233,4 +364,7 @@ def analyze_deep(text: str) -> dict:
         "elapsed_time": elapsed,
         "risk_score": risk_score_value,
         "similar_site_detection": similar_site_value if similar_site_value and "未發現" not in similar_site_value else None,
+        "model_probability": round(model_prob, 4) if model_prob is not None else None,
+        "decided_by": "llm",
+        "link_analysis": link_report.to_dict(),
     }
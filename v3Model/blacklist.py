@@ -1,12 +1,57 @@
 # blacklist.py — 官方黑名單 + 使用者黑名單
 import csv
 import os
+import threading
 OFFICIAL_BLACKLIST = set()
 USER_BLACKLIST = set()
-USER_FILE = "user_blacklist.txt"
+USER_FILE = os.environ.get("USER_BLACKLIST_FILE", "user_blacklist.txt")
+
+# 版本號：官方名單每次載入 +1；使用者名單每次異動 +1 並記錄在 USER_CHANGES
+OFFICIAL_VERSION = 0
+USER_VERSION = 0
+USER_CHANGES = []  # [(version, op, url)]，op 為 "add" / "delete" / "clear"
+MAX_USER_CHANGES = 1000
+
+# 使用者名單的所有異動（集合、版本號、異動通知＝複寫的 LWW 時間戳、檔案改寫）都在這把鎖內完成；
+# replication 也用同一把鎖，請求執行緒與複寫執行緒的異動不會交錯
+USER_LOCK = threading.RLock()
+
+def _rewrite_user_file():
+    """在 USER_LOCK 內呼叫：以目前名單的快照寫入暫存檔再替換，寫到一半失敗也不會留下截斷的檔案。"""
+    urls = sorted(list(USER_BLACKLIST))
+    tmp = USER_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        for u in urls:
+            f.write(u + "\n")
+    os.replace(tmp, USER_FILE)
+
+def _record_user_change(op: str, url: str = ""):
+    global USER_VERSION
+    USER_VERSION += 1
+    USER_CHANGES.append((USER_VERSION, op, url))
+    if len(USER_CHANGES) > MAX_USER_CHANGES:
+        del USER_CHANGES[:len(USER_CHANGES) - MAX_USER_CHANGES]
+
+# 使用者在本節點操作名單時的通知對象（replication 用來寫入變更紀錄），參數為 (op, url)
+USER_CHANGE_LISTENERS = []
+
+def _notify_user_change(op: str, url: str = ""):
+    for fn in USER_CHANGE_LISTENERS:
+        try:
+            fn(op, url)
+        except Exception as e:
+            print("[BLACKLIST] 異動通知失敗:", e)
+
+def get_user_changes_since(version: int):
+    """回傳 version 之後的使用者名單異動；版本太舊或不合法時回傳 None。"""
+    if version == USER_VERSION:
+        return []
+    if version > USER_VERSION or not USER_CHANGES or USER_CHANGES[0][0] > version + 1:
+        return None
+    return [c for c in USER_CHANGES if c[0] > version]
 
 def load_blacklist(csv_path: str):
-    global OFFICIAL_BLACKLIST
+    global OFFICIAL_BLACKLIST, OFFICIAL_VERSION
 
     try:
         with open(csv_path, "r", encoding="utf-8") as f:
@@ -16,6 +61,7 @@ def load_blacklist(csv_path: str):
                 if url:
                     OFFICIAL_BLACKLIST.add(url)
 
+        OFFICIAL_VERSION += 1
         print(f"[BLACKLIST] 已載入官方黑名單 {len(OFFICIAL_BLACKLIST)} 筆")
     except Exception as e:
         print("[BLACKLIST] 官方黑名單載入失敗:", e)
@@ -27,49 +73,54 @@ def load_user_blacklist():
     if not os.path.exists(USER_FILE):
         return
 
-    try:
-        with open(USER_FILE, "r", encoding="utf-8") as f:
-            for line in f:
-                url = line.strip()
-                if url:
-                    USER_BLACKLIST.add(url)
+    with USER_LOCK:
+        _record_user_change("reload")
+        try:
+            with open(USER_FILE, "r", encoding="utf-8") as f:
+                for line in f:
+                    url = line.strip()
+                    if url:
+                        USER_BLACKLIST.add(url)
 
-        print(f"[BLACKLIST] 已載入使用者黑名單 {len(USER_BLACKLIST)} 筆")
-    except Exception as e:
-        print("[BLACKLIST] 使用者黑名單載入失敗:", e)
+            print(f"[BLACKLIST] 已載入使用者黑名單 {len(USER_BLACKLIST)} 筆")
+        except Exception as e:
+            print("[BLACKLIST] 使用者黑名單載入失敗:", e)
 
 def add_to_user_blacklist(url: str) -> bool:
-    global USER_BLACKLIST
     url = url.strip()
     if not url:
         return False
-    if url in USER_BLACKLIST:
-        return True
 
-    try:
-        USER_BLACKLIST.add(url)
-        with open(USER_FILE, "a", encoding="utf-8") as f:
-            f.write(url + "\n")
-        return True
-    except Exception as e:
-        print("[BLACKLIST] 新增使用者黑名單失敗:", e)
-        return False
+    with USER_LOCK:
+        if url in USER_BLACKLIST:
+            return True
+        try:
+            with open(USER_FILE, "a", encoding="utf-8") as f:
+                f.write(url + "\n")
+            USER_BLACKLIST.add(url)
+            _record_user_change("add", url)
+            _notify_user_change("add", url)
+            return True
+        except Exception as e:
+            print("[BLACKLIST] 新增使用者黑名單失敗:", e)
+            return False
 
 def delete_from_user_blacklist(url: str) -> bool:
-    global USER_BLACKLIST
     url = url.strip()
-    if url not in USER_BLACKLIST:
-        return False
 
-    try:
-        USER_BLACKLIST.remove(url)
-        with open(USER_FILE, "w", encoding="utf-8") as f:
-            for u in USER_BLACKLIST:
-                f.write(u + "\n")
-        return True
-    except Exception as e:
-        print("[BLACKLIST] 刪除使用者黑名單失敗:", e)
-        return False
+    with USER_LOCK:
+        if url not in USER_BLACKLIST:
+            return False
+        try:
+            USER_BLACKLIST.remove(url)
+            _rewrite_user_file()
+            _record_user_change("delete", url)
+            _notify_user_change("delete", url)
+            return True
+        except Exception as e:
+            USER_BLACKLIST.add(url)
+            print("[BLACKLIST] 刪除使用者黑名單失敗:", e)
+            return False
 
 def is_blacklisted(url: str) -> bool:
     url = url.strip()
@@ -101,19 +152,54 @@ def get_user_blacklist() -> list:
         return []
 def clear_user_blacklist() -> bool:
     """清空所有使用者黑名單（記憶體 + 檔案）"""
-    global USER_BLACKLIST
-    
-    try:
-        # 1. 清空記憶體中的集合
-        USER_BLACKLIST.clear()
-        
-        # 2. 清空檔案內容 (以 "w" 模式開啟但不寫入任何東西，就會清空檔案)
-        with open(USER_FILE, "w", encoding="utf-8") as f:
-            pass
-            
-        print("[BLACKLIST] 使用者黑名單已全部清空")
-        return True
-        
-    except Exception as e:
-        print("[BLACKLIST] 清空使用者黑名單失敗:", e)
-        return False
\ No newline at end of file
+    with USER_LOCK:
+        try:
+            # 1. 清空檔案內容 (以 "w" 模式開啟但不寫入任何東西，就會清空檔案)
+            with open(USER_FILE, "w", encoding="utf-8") as f:
+                pass
+
+            # 2. 清空記憶體中的集合
+            USER_BLACKLIST.clear()
+            _record_user_change("clear")
+            _notify_user_change("clear")
+
+            print("[BLACKLIST] 使用者黑名單已全部清空")
+            return True
+
+        except Exception as e:
+            print("[BLACKLIST] 清空使用者黑名單失敗:", e)
+            return False
+
+def apply_user_changes(changes) -> int:
+    """套用其他節點複寫過來的異動 [(op, url)]，op 為 "add" / "delete"。
+
+    與 add / delete 相同會更新版本號（擴充功能的過濾器會跟著同步），但不通知
+    USER_CHANGE_LISTENERS，避免複寫的異動又被當成本節點的操作。回傳實際改變的筆數。
+    呼叫端（replication）已持有 USER_LOCK，LWW 狀態與集合一起更新。
+    """
+    with USER_LOCK:
+        added = []
+        removed = 0
+        for op, url in changes:
+            url = url.strip()
+            if not url:
+                continue
+            if op == "add" and url not in USER_BLACKLIST:
+                USER_BLACKLIST.add(url)
+                added.append(url)
+                _record_user_change("add", url)
+            elif op == "delete" and url in USER_BLACKLIST:
+                USER_BLACKLIST.remove(url)
+                removed += 1
+                _record_user_change("delete", url)
+
+        try:
+            if removed:
+                _rewrite_user_file()
+            elif added:
+                with open(USER_FILE, "a", encoding="utf-8") as f:
+                    for u in added:
+                        f.write(u + "\n")
+        except Exception as e:
+            print("[BLACKLIST] 寫入使用者黑名單失敗:", e)
+        return len(added) + removed
@@ -0,0 +1,130 @@
+# blacklist_filter.py — 提供給擴充功能的精簡黑名單過濾器（Bloom filter + 增量更新）
+
+import base64
+import math
+import threading
+import uuid
+import zlib
+
+import blacklist
+
+# 誤判率：1e-6 時官方名單（約 5 萬筆）約 180 KB
+FILTER_FP_RATE = 1e-6
+# 每次伺服器啟動都換一個 epoch，讓擴充功能知道舊版本號已失效
+FILTER_EPOCH = uuid.uuid4().hex[:8]
+
+_lock = threading.Lock()
+_official_cache = None  # (version, payload)
+_user_cache = None      # (version, payload)
+
+
+def _next_prime(n: int) -> int:
+    def is_prime(v):
+        if v < 2 or v % 2 == 0:
+            return v == 2
+        return all(v % d for d in range(3, math.isqrt(v) + 1, 2))
+
+    while not is_prime(n):
+        n += 1
+    return n
+
+
+class BloomFilter:
+    """以 CRC32 雙重雜湊實作的 Bloom filter，JS 端可用相同演算法查詢。
+
+    位置 = (h1 + i * h2) mod m，h1 = crc32(網址)、h2 = crc32(反轉的網址)。
+    m 取質數且 h2 落在 [1, m-1]，確保 k 個位置互不重複。
+    """
+
+    def __init__(self, m: int, k: int):
+        self.m = max(8, m)
+        self.k = max(1, k)
+        self.bits = bytearray((self.m + 7) // 8)
+
+    @classmethod
+    def for_capacity(cls, n: int, fp_rate: float = FILTER_FP_RATE) -> "BloomFilter":
+        n = max(1, n)
+        m = _next_prime(math.ceil(-n * math.log(fp_rate) / (math.log(2) ** 2)))
+        k = round(m / n * math.log(2))
+        return cls(m, k)
+
+    def _positions(self, item: str):
+        data = item.encode("utf-8")
+        h1 = zlib.crc32(data)
+        h2 = zlib.crc32(data[::-1]) % (self.m - 1) + 1
+        return ((h1 + i * h2) % self.m for i in range(self.k))
+
+    def add(self, item: str):
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+    def to_dict(self) -> dict:
+        return {
+            "m": self.m,
+            "k": self.k,
+            "bits": base64.b64encode(bytes(self.bits)).decode("ascii"),
+        }
+
+
+def build_filter(urls, fp_rate: float = FILTER_FP_RATE) -> BloomFilter:
+    urls = list(urls)
+    bf = BloomFilter.for_capacity(len(urls), fp_rate)
+    for url in urls:
+        bf.add(url)
+    return bf
+
+
+def _official_payload() -> dict:
+    global _official_cache
+    version = blacklist.OFFICIAL_VERSION
+    if _official_cache is None or _official_cache[0] != version:
+        bf = build_filter(blacklist.OFFICIAL_BLACKLIST)
+        _official_cache = (version, {"version": version, **bf.to_dict()})
+        print(f"[FILTER] 已建立官方黑名單過濾器 v{version}（{len(bf.bits)} bytes）")
+    return _official_cache[1]
+
+
+def _user_payload() -> dict:
+    global _user_cache
+    version = blacklist.USER_VERSION
+    if _user_cache is None or _user_cache[0] != version:
+        # 保留一些空間給之後的增量新增，避免誤判率很快上升
+        urls = list(blacklist.USER_BLACKLIST)
+        bf = BloomFilter.for_capacity(len(urls) + 256)
+        for url in urls:
+            bf.add(url)
+        _user_cache = (version, {"version": version, **bf.to_dict()})
+    return _user_cache[1]
+
+
+def get_filter_update(epoch: str | None, official_version: int | None, user_version: int | None) -> dict:
+    """依擴充功能目前持有的版本，回傳需要更新的部分。
+
+    - official：版本不同才附上完整過濾器
+    - user：版本相同回傳 unchanged；只有新增時回傳 add 清單；
+      有刪除 / 清空或版本過舊則附上完整過濾器（Bloom filter 無法刪除）
+    """
+    with _lock:
+        same_epoch = epoch == FILTER_EPOCH
+        result = {
+            "epoch": FILTER_EPOCH,
+            "official_version": blacklist.OFFICIAL_VERSION,
+            "user_version": blacklist.USER_VERSION,
+        }
+
+        if not same_epoch or official_version != blacklist.OFFICIAL_VERSION:
+            result["official"] = _official_payload()
+
+        changes = None
+        if same_epoch and user_version is not None:
+            changes = blacklist.get_user_changes_since(user_version)
+
+        if changes is not None and all(op == "add" for _, op, _ in changes):
+            result["user_add"] = [url for _, _, url in changes]
+        else:
+            result["user"] = _user_payload()
+
+        return result
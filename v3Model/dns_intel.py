@@ -0,0 +1,462 @@
+# dns_intel.py — 非同步 DNS 解析與主機位置情報
+#
+# 原本的工具都只看網址字串，沒有人檢查主機實際解析到哪裡。這裡提供：
+#   - 以 asyncio 實作的精簡 DNS 用戶端（UDP、A 紀錄），上游可設定（DNS_UPSTREAM，可指向本機測試用 DNS）
+#   - 遵守 TTL 的正向 / 負向快取；同一主機同時只有一個查詢在進行，重複的主機不再查
+#   - 一頁所有連結主機整批並行查詢，在背景事件迴圈執行緒上跑；請求一進來就先送出（prefetch_urls），
+#     分析時只讀快取、從不等待，還沒查完的主機回報為「尚未解析完成」，結果留給下一次使用
+# 依解析結果產生的訊號：
+#   - fast-flux：同一次解析 TTL 很短且 A 紀錄多、分散在多個網段（只看單次回應；CDN 輪替 IP 不會累積成 fast-flux）
+#   - 新出現的 IP：本程序觀察一段時間、過去（DNS_HISTORY_WINDOW 內）一直解析到同一個網段（/16）的主機，
+#     整組回應換到另一個網段（可能遭劫持或換了主機商；原本就分散在多個網段的 CDN 不算）
+#   - 內部 / 保留位址：公開網域解析到私有或保留位址（DNS rebinding 常見手法）
+#   - 可疑網段：落在本地網段表（DNS_BAD_RANGES_PATH，JSON）列出的 ASN / CIDR 範圍
+#
+# 網段表格式：{"version": 1, "ranges": [{"cidr": "203.0.113.0/24", "asn": 64500, "name": "說明"}]}
+
+import asyncio
+import bisect
+import ipaddress
+import json
+import os
+import random
+import struct
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from urllib.parse import urlsplit
+
+
+def _default_upstream() -> str:
+    try:
+        with open("/etc/resolv.conf", "r", encoding="utf-8") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0] == "nameserver":
+                    return parts[1]
+    except OSError:
+        pass
+    return "8.8.8.8"
+
+
+# "ip" 或 "ip:port"；設為 off 停用 DNS 檢查
+DNS_UPSTREAM = os.environ.get("DNS_UPSTREAM") or _default_upstream()
+DNS_TIMEOUT = float(os.environ.get("DNS_TIMEOUT", 1.0))       # 單次查詢逾時（秒）
+DNS_ATTEMPTS = 2
+DNS_CONCURRENCY = 32
+MAX_DNS_HOSTS = 50
+
+MAX_TTL = 3600
+NEGATIVE_TTL = 300     # NXDOMAIN / 無紀錄且沒有 SOA 時
+ERROR_TTL = 30         # 逾時 / SERVFAIL，稍後重試
+MAX_CACHE = 10000
+
+FLUX_MAX_TTL = 300
+FLUX_MIN_IPS = 4
+FLUX_MIN_PREFIXES = 3
+# 主機至少觀察這麼久（秒）後出現的新 IP 才算「新出現」，避免剛啟動時每個 IP 都是新的
+NEW_IP_MIN_AGE = float(os.environ.get("DNS_NEW_IP_MIN_AGE", 3600))
+# 解析歷史只保留這段時間（秒）內看過的 IP
+HISTORY_WINDOW = float(os.environ.get("DNS_HISTORY_WINDOW", 7 * 86400))
+
+BAD_RANGES_PATH = os.environ.get(
+    "DNS_BAD_RANGES_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "dns_bad_ranges.json"),
+)
+
+_TYPE_A, _TYPE_SOA = 1, 6
+_RCODE_NXDOMAIN = 3
+
+
+@dataclass
+class DnsResult:
+    status: str            # "ok" / "nxdomain" / "nodata" / "error"
+    ips: tuple = ()
+    ttl: int = 0
+    new_ips: tuple = ()    # 原本固定在同一網段的主機換到新網段時的 IP（見 NEW_IP_MIN_AGE）
+    expires: float = 0.0
+
+
+# ------------------------------
+# DNS 封包
+# ------------------------------
+def build_query(host: str, qid: int) -> bytes:
+    header = struct.pack(">HHHHHH", qid, 0x0100, 1, 0, 0, 0)  # RD=1，一個問題
+    qname = b"".join(
+        bytes([len(label)]) + label for label in host.encode("idna").split(b".") if label
+    ) + b"\x00"
+    return header + qname + struct.pack(">HH", _TYPE_A, 1)
+
+
+def _skip_name(data: bytes, pos: int) -> int:
+    while True:
+        n = data[pos]
+        if n == 0:
+            return pos + 1
+        if n & 0xC0 == 0xC0:  # 壓縮指標
+            return pos + 2
+        pos += n + 1
+
+
+def parse_response(data: bytes, qid: int) -> tuple:
+    """回傳 (rcode, [(ip, ttl)], 負向快取 TTL 或 None)；id 不符或封包截斷時丟出 ValueError。"""
+    try:
+        return _parse_response(data, qid)
+    except (struct.error, IndexError):
+        raise ValueError("DNS 回應格式錯誤")
+
+
+def _parse_response(data: bytes, qid: int) -> tuple:
+    rid, flags, qd, an, ns, _ = struct.unpack_from(">HHHHHH", data, 0)
+    if rid != qid or not flags & 0x8000:
+        raise ValueError("DNS 回應 id 不符")
+    rcode = flags & 0x000F
+    pos = 12
+    for _ in range(qd):
+        pos = _skip_name(data, pos) + 4
+
+    answers = []
+    for _ in range(an):
+        pos = _skip_name(data, pos)
+        rtype, _, ttl, rdlen = struct.unpack_from(">HHIH", data, pos)
+        pos += 10
+        if pos + rdlen > len(data):
+            raise ValueError("DNS 回應格式錯誤")
+        if rtype == _TYPE_A and rdlen == 4:
+            answers.append((".".join(str(b) for b in data[pos:pos + 4]), ttl))
+        pos += rdlen
+
+    negative_ttl = None
+    for _ in range(ns):
+        pos = _skip_name(data, pos)
+        rtype, _, ttl, rdlen = struct.unpack_from(">HHIH", data, pos)
+        pos += 10
+        if rtype == _TYPE_SOA:
+            end = pos + rdlen
+            p = _skip_name(data, _skip_name(data, pos))  # mname、rname
+            minimum = struct.unpack_from(">I", data, p + 16)[0] if p + 20 <= end else ttl
+            negative_ttl = min(ttl, minimum)
+        pos += rdlen
+    return rcode, answers, negative_ttl
+
+
+class _QueryProtocol(asyncio.DatagramProtocol):
+    def __init__(self, qid: int, future):
+        self.qid = qid
+        self.future = future
+
+    def datagram_received(self, data, addr):
+        if self.future.done():
+            return
+        try:
+            self.future.set_result(parse_response(data, self.qid))
+        except (ValueError, struct.error, IndexError):
+            pass  # 不是這個查詢的回應（或格式錯誤），繼續等
+
+    def error_received(self, exc):
+        if not self.future.done():
+            self.future.set_exception(exc)
+
+
+def _upstream() -> tuple:
+    host, _, port = DNS_UPSTREAM.rpartition(":") if DNS_UPSTREAM.count(":") == 1 else (DNS_UPSTREAM, "", "")
+    return host, int(port or 53)
+
+
+async def _query(host: str) -> tuple:
+    loop = asyncio.get_running_loop()
+    last_error = None
+    for _ in range(DNS_ATTEMPTS):
+        qid = random.getrandbits(16)
+        future = loop.create_future()
+        transport, _ = await loop.create_datagram_endpoint(
+            lambda: _QueryProtocol(qid, future), remote_addr=_upstream()
+        )
+        try:
+            transport.sendto(build_query(host, qid))
+            return await asyncio.wait_for(future, DNS_TIMEOUT)
+        except (asyncio.TimeoutError, OSError) as e:
+            last_error = e
+        finally:
+            transport.close()
+    raise last_error or asyncio.TimeoutError()
+
+
+# ------------------------------
+# 快取（事件迴圈執行緒寫入，請求執行緒讀取）
+# ------------------------------
+_lock = threading.Lock()
+_cache = OrderedDict()      # host → DnsResult
+_history = OrderedDict()    # host → (第一次解析的時間, {IP: 最後看到的時間})
+_inflight = {}              # host → asyncio.Future（只在事件迴圈執行緒存取）
+_loop = None
+_semaphore = None
+_loop_lock = threading.Lock()
+
+
+def _prefix16(ip: str) -> str:
+    return ip.rsplit(".", 2)[0]
+
+
+def _moved_ips(known: dict, ips: tuple) -> tuple:
+    """過去只解析到單一網段的主機，這次回應完全落在其他網段時回傳這些 IP。"""
+    prefixes = {_prefix16(ip) for ip in known}
+    if len(prefixes) != 1 or any(_prefix16(ip) in prefixes for ip in ips):
+        return ()
+    return ips
+
+
+def _remember(host: str, status: str, answers: list, ttl: int) -> DnsResult:
+    now = time.time()
+    ips = tuple(sorted({ip for ip, _ in answers}))
+    with _lock:
+        new_ips = ()
+        if ips:
+            first, known = _history.get(host, (now, {}))
+            known = {ip: seen for ip, seen in known.items() if now - seen <= HISTORY_WINDOW}
+            if not known:
+                first = now
+            new_ips = _moved_ips(known, ips) if now - first >= NEW_IP_MIN_AGE else ()
+            known.update((ip, now) for ip in ips)
+            _history[host] = (first, known)
+            _history.move_to_end(host)
+            while len(_history) > MAX_CACHE:
+                _history.popitem(last=False)
+        result = DnsResult(status, ips, ttl, new_ips, now + ttl)
+        _cache[host] = result
+        _cache.move_to_end(host)
+        while len(_cache) > MAX_CACHE:
+            _cache.popitem(last=False)
+    return result
+
+
+async def _resolve(host: str):
+    try:
+        async with _semaphore:
+            rcode, answers, negative_ttl = await _query(host)
+    except (asyncio.TimeoutError, OSError, UnicodeError, ValueError):
+        _remember(host, "error", [], ERROR_TTL)
+        return
+    if answers:
+        ttl = min(min(t for _, t in answers), MAX_TTL)
+        _remember(host, "ok", answers, ttl)
+    elif rcode == _RCODE_NXDOMAIN:
+        _remember(host, "nxdomain", [], min(negative_ttl or NEGATIVE_TTL, MAX_TTL))
+    elif rcode == 0:
+        _remember(host, "nodata", [], min(negative_ttl or NEGATIVE_TTL, MAX_TTL))
+    else:
+        _remember(host, "error", [], ERROR_TTL)
+
+
+async def _resolve_all(hosts: list):
+    tasks = []
+    now = time.time()
+    for host in hosts:
+        task = _inflight.get(host)
+        if task is None:
+            with _lock:
+                if _cached(host, now) is not None:
+                    continue  # 排入之後其他請求已查完
+
+            task = _inflight[host] = asyncio.ensure_future(_resolve(host))
+            task.add_done_callback(lambda _, h=host: _inflight.pop(h, None))
+        tasks.append(task)
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def _ensure_loop():
+    global _loop, _semaphore
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="dns-resolver", daemon=True).start()
+                _semaphore = asyncio.run_coroutine_threadsafe(_make_semaphore(), loop).result()
+                _loop = loop
+    return _loop
+
+
+async def _make_semaphore():
+    return asyncio.Semaphore(DNS_CONCURRENCY)
+
+
+def enabled() -> bool:
+    return DNS_UPSTREAM.lower() not in ("", "off", "none")
+
+
+def _cached(host: str, now: float) -> DnsResult | None:
+    result = _cache.get(host)
+    return result if result is not None and result.expires > now else None
+
+
+def _schedule(hosts: list):
+    """把快取沒有的主機送到背景事件迴圈查詢，回傳 concurrent Future（全部命中時為 None）。"""
+    now = time.time()
+    with _lock:
+        misses = [h for h in dict.fromkeys(hosts) if h and _cached(h, now) is None]
+    if not misses:
+        return None
+    return asyncio.run_coroutine_threadsafe(_resolve_all(misses), _ensure_loop())
+
+
+def hosts_of(urls: list) -> list:
+    hosts = []
+    for u in urls:
+        try:
+            host = (urlsplit(u).hostname or "").rstrip(".")
+        except ValueError:
+            continue
+        if host and not _is_ip(host):
+            hosts.append(host)
+    return list(dict.fromkeys(hosts))[:MAX_DNS_HOSTS]
+
+
+def _is_ip(host: str) -> bool:
+    try:
+        ipaddress.ip_address(host)
+        return True
+    except ValueError:
+        return False
+
+
+def prefetch_urls(urls: list):
+    """請求一進來就先送出查詢（不等待），與排隊時間重疊。"""
+    if enabled() and urls:
+        _schedule(hosts_of(urls))
+
+
+def lookup_many(hosts: list) -> dict:
+    """回傳 {host: DnsResult 或 None}；只讀快取、不等待，None 表示還沒查完（已排入查詢，結果之後會進快取）。"""
+    _schedule(hosts)
+    now = time.time()
+    with _lock:
+        return {h: _cached(h, now) for h in hosts}
+
+
+# ------------------------------
+# 可疑網段表
+# ------------------------------
+_ranges = None   # (起點 list, [(起點, 終點, 說明)])
+
+
+def _load_ranges():
+    global _ranges
+    if _ranges is not None:
+        return _ranges
+    rows = []
+    try:
+        with open(BAD_RANGES_PATH, "r", encoding="utf-8") as f:
+            spec = json.load(f)
+        for item in spec.get("ranges") or []:
+            net = ipaddress.ip_network(item["cidr"], strict=False)
+            if net.version != 4:
+                continue
+            label = item.get("name") or ""
+            if item.get("asn"):
+                label = f"AS{item['asn']} {label}".strip()
+            rows.append((int(net.network_address), int(net.broadcast_address), label or str(net)))
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        print(f"[DNS] 無法載入網段表 {BAD_RANGES_PATH}：{e}")
+    rows.sort()
+    _ranges = ([r[0] for r in rows], rows)
+    print(f"[DNS] 已載入可疑網段 {len(rows)} 筆")
+    return _ranges
+
+
+def bad_range(ip: str) -> str | None:
+    starts, rows = _load_ranges()
+    value = int(ipaddress.IPv4Address(ip))
+    i = bisect.bisect_right(starts, value) - 1
+    # 範圍可能重疊：往前檢查所有起點 ≤ value 的範圍（表通常很小）
+    while i >= 0:
+        start, end, label = rows[i]
+        if start <= value <= end:
+            return label
+        i -= 1
+    return None
+
+
+# ------------------------------
+# 訊號彙整
+# ------------------------------
+def _is_fast_flux(result: DnsResult) -> bool:
+    if result.ttl > FLUX_MAX_TTL:
+        return False
+    prefixes = {_prefix16(ip) for ip in result.ips}
+    return len(result.ips) >= FLUX_MIN_IPS and len(prefixes) >= FLUX_MIN_PREFIXES
+
+
+@dataclass
+class DnsReport:
+    page_host: str = ""
+    page: DnsResult | None = None
+    resolved: int = 0
+    pending: int = 0
+    fast_flux: list = field(default_factory=list)
+    new_ips: list = field(default_factory=list)       # [(host, ip)]
+    internal: list = field(default_factory=list)      # [(host, ip)]
+    bad_ranges: list = field(default_factory=list)    # [(host, ip, 說明)]
+    nxdomain: list = field(default_factory=list)
+
+    def text(self) -> str:
+        lines = []
+        if self.page is None:
+            lines.append(f"頁面網域 {self.page_host} 尚未解析完成" if self.page_host else "無可解析的網域")
+        elif self.page.status == "ok":
+            ips = "、".join(self.page.ips[:4]) + ("…" if len(self.page.ips) > 4 else "")
+            lines.append(f"頁面網域 {self.page_host} 解析到 {ips}（TTL {self.page.ttl} 秒）")
+        elif self.page.status == "nxdomain":
+            lines.append(f"頁面網域 {self.page_host} 不存在（NXDOMAIN）")
+        else:
+            lines.append(f"頁面網域 {self.page_host} 無法解析")
+
+        if self.fast_flux:
+            lines.append("疑似 fast-flux（短 TTL、IP 分散在多個網段）：" + "、".join(self.fast_flux[:3]))
+        if self.bad_ranges:
+            lines.append("解析到可疑網段：" + "、".join(f"{h}（{ip}，{label}）" for h, ip, label in self.bad_ranges[:3]))
+        if self.internal:
+            lines.append("公開網域解析到內部或保留位址：" + "、".join(f"{h}（{ip}）" for h, ip in self.internal[:3]))
+        if self.new_ips:
+            lines.append("網域解析到新出現的 IP（原本固定在其他網段）：" + "、".join(f"{h}（{ip}）" for h, ip in self.new_ips[:3]))
+        if self.pending:
+            lines.append(f"另有 {self.pending} 個網域尚未解析完成")
+        return "\n".join(lines)
+
+
+def analyze_urls(urls: list) -> DnsReport:
+    """urls[0] 為頁面網址；頁面與連結主機只讀快取，沒查完的主機排入查詢並計入 pending。"""
+    hosts = hosts_of(urls)
+    report = DnsReport()
+    if not hosts:
+        return report
+    try:
+        page_host = (urlsplit(urls[0]).hostname or "").rstrip(".")
+    except ValueError:
+        page_host = ""
+    report.page_host = page_host if page_host in hosts else ""
+
+    results = lookup_many(hosts)
+    report.page = results.get(report.page_host)
+    for host, result in results.items():
+        if result is None:
+            report.pending += 1
+            continue
+        report.resolved += 1
+        if result.status == "nxdomain":
+            report.nxdomain.append(host)
+            continue
+        if result.status != "ok":
+            continue
+        if _is_fast_flux(result):
+            report.fast_flux.append(host)
+        report.new_ips += [(host, ip) for ip in result.new_ips]
+        for ip in result.ips:
+            if not ipaddress.IPv4Address(ip).is_global:
+                report.internal.append((host, ip))
+            label = bad_range(ip)
+            if label:
+                report.bad_ranges.append((host, ip, label))
+    return report
@@ -1,27 +1,211 @@
 # HTML 處理與萃取
 
-from bs4 import BeautifulSoup
 import re
+from dataclasses import dataclass, field
+from html.parser import HTMLParser
 from urllib.parse import urlparse, urlunparse
 
-def extract_relevant_html(raw_html: str, max_length: int = 3000) -> str:
-    """保留 title、部分 meta 與可見文字，供模型快速分析。"""
-    soup = BeautifulSoup(raw_html, "html.parser")
+# 可選的加速後端：有安裝 lxml 就用它的 C 解析器，否則退回標準庫 HTMLParser
+try:
+    from lxml import etree as _lxml_etree
+except ImportError:
+    _lxml_etree = None
 
-    title = soup.title.string if soup.title else ""
-    metas = [
-        str(meta)
-        for meta in soup.find_all("meta")
-        if meta.get("name") in ["description", "keywords", "author"]
-    ]
-    links = [a.get("href") for a in soup.find_all("a", href=True)[:10]]
-    body_text = soup.get_text("\n", strip=True)[:1000]
+# 解析預算：一份頁面最多餵進解析器的字元數、保留的連結數與文字長度
+MAX_PARSE_CHARS = 1_000_000
+MAX_PARSE_LINKS = 500
+MAX_PARSE_TEXT = 1000
+MAX_PARSE_FORMS = 20
+_FEED_CHUNK = 64 * 1024
+
+_META_NAMES = ("description", "keywords", "author")
+
+# 不用 text.lower() 複製整份文字，直接以不分大小寫的 regex 判斷（找到即停止）
+_HTML_ROOT_RE = re.compile(r"<html", re.IGNORECASE)
+_HTML_HINT_RE = re.compile(r"<html|<a\s|href=", re.IGNORECASE)
+_URL_RE = re.compile(r"(?i)\b((?:https?://|www\.)[^\s<>\"'\)]{3,})")
+_SKIP_TAGS = {"script", "style", "noscript", "template"}
+
+
+@dataclass
+class ParsedPage:
+    """單次解析的結果，供 extract_relevant_html 與 extract_urls 共用。"""
+    title: str = ""
+    metas: list = field(default_factory=list)
+    links: list = field(default_factory=list)
+    text: str = ""
+    forms: list = field(default_factory=list)  # [{"action", "method", "password"}]
+    truncated: bool = False
+
+
+class _PageCollector:
+    """SAX 式收集器：邊解析邊取 title / meta / 連結 / 可見文字，預算滿了就停止。
+
+    介面同時符合 lxml 的 parser target（start / end / data / close），
+    標準庫後端則由 _StdlibFeeder 轉接。
+    """
+
+    def __init__(self, max_links: int, max_text: int):
+        self.page = ParsedPage()
+        self.max_links = max_links
+        self.max_text = max_text
+        self._text_parts = []
+        self._text_len = 0
+        self._seen_links = set()
+        self._in_title = False
+        self._title_done = False
+        self._title_parts = []
+        self._skip_depth = 0
+        self._form = None
+
+    @property
+    def done(self) -> bool:
+        return (
+            self._title_done
+            and self._text_len >= self.max_text
+            and len(self.page.links) >= self.max_links
+        )
+
+    def start(self, tag, attrib):
+        tag = tag.lower()
+        if tag in _SKIP_TAGS:
+            self._skip_depth += 1
+            return
+        if tag == "title" and not self._title_done:
+            self._in_title = True
+        elif tag == "body":
+            self._title_done = True
+        elif tag == "meta":
+            name = attrib.get("name")
+            if name in _META_NAMES:
+                attrs = " ".join(f'{k}="{v}"' for k, v in attrib.items())
+                self.page.metas.append(f"<meta {attrs}/>")
+        elif tag == "a" and len(self.page.links) < self.max_links:
+            href = (attrib.get("href") or "").strip()
+            if href and href not in self._seen_links:
+                self._seen_links.add(href)
+                self.page.links.append(href)
+        elif tag == "form" and len(self.page.forms) < MAX_PARSE_FORMS:
+            self._form = {
+                "action": (attrib.get("action") or "").strip(),
+                "method": (attrib.get("method") or "get").strip().lower(),
+                "password": False,
+            }
+            self.page.forms.append(self._form)
+        elif tag == "input" and (attrib.get("type") or "").lower() == "password":
+            if self._form is not None:
+                self._form["password"] = True
+            elif len(self.page.forms) < MAX_PARSE_FORMS:
+                # 不在 <form> 內的密碼欄位（多半由 JS 送出），視為送往頁面本身
+                self.page.forms.append({"action": "", "method": "post", "password": True})
+
+    def end(self, tag):
+        tag = tag.lower()
+        if tag in _SKIP_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+        elif tag == "title" and self._in_title:
+            self._in_title = False
+            self._title_done = True
+        elif tag == "form":
+            self._form = None
+
+    def data(self, data):
+        if self._skip_depth:
+            return
+        if self._in_title:
+            self._title_parts.append(data)
+            return
+        if self._text_len >= self.max_text:
+            return
+        chunk = data.strip()
+        if chunk:
+            self._text_parts.append(chunk)
+            self._text_len += len(chunk) + 1
+
+    def close(self):
+        self.page.title = "".join(self._title_parts).strip()
+        self.page.text = "\n".join(self._text_parts)[:self.max_text]
+        return self.page
+
+
+class _StdlibFeeder(HTMLParser):
+    """把標準庫 HTMLParser 的事件轉給 _PageCollector。"""
+
+    def __init__(self, collector: _PageCollector):
+        super().__init__(convert_charrefs=True)
+        self.collector = collector
+
+    def handle_starttag(self, tag, attrs):
+        self.collector.start(tag, {k: (v or "") for k, v in attrs})
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        self.collector.end(tag)
+
+    def handle_endtag(self, tag):
+        self.collector.end(tag)
+
+    def handle_data(self, data):
+        self.collector.data(data)
+
+
+def parse_html(
+    raw_html: str,
+    max_links: int = MAX_PARSE_LINKS,
+    max_text: int = MAX_PARSE_TEXT,
+    max_chars: int = MAX_PARSE_CHARS,
+) -> ParsedPage:
+    """串流解析 HTML，一次取得 title、meta、連結與可見文字。
+
+    分段餵給解析器，收集完預算內的內容（或超過 max_chars）就提早停止，
+    多 MB 的頁面也只會花固定的 CPU 與記憶體。
+    """
+    collector = _PageCollector(max_links, max_text)
+
+    if _lxml_etree is not None:
+        feeder = _lxml_etree.HTMLParser(target=collector, recover=True)
+    else:
+        feeder = _StdlibFeeder(collector)
+
+    limit = min(len(raw_html), max_chars)
+    pos = 0
+    try:
+        while pos < limit and not collector.done:
+            end = min(pos + _FEED_CHUNK, limit)
+            feeder.feed(raw_html[pos:end])
+            pos = end
+        page = feeder.close() if _lxml_etree is not None else None
+    except Exception:
+        page = None
+
+    if not isinstance(page, ParsedPage):
+        page = collector.close()
+    page.truncated = pos < len(raw_html)
+    return page
+
+
+def has_html_root(text: str) -> bool:
+    """文字中是否含有 <html 標籤（完整 HTML 頁面）。"""
+    return _HTML_ROOT_RE.search(text) is not None
+
+
+def looks_like_html(text: str) -> bool:
+    """文字中是否含有 HTML 標記（<html、<a、href=）。"""
+    return _HTML_HINT_RE.search(text) is not None
+
+
+def extract_relevant_html(raw_html, max_length: int = 3000) -> str:
+    """保留 title、部分 meta 與可見文字，供模型快速分析。
+
+    可直接傳入 parse_html() 的結果，避免同一份 HTML 重複解析。
+    """
+    page = raw_html if isinstance(raw_html, ParsedPage) else parse_html(raw_html)
 
     result = (
-        f"<title>{title}</title>\n"
-        f"{' '.join(metas)}\n"
-        f"<links>{links}</links>\n"
-        f"<body>{body_text}</body>"
+        f"<title>{page.title}</title>\n"
+        f"{' '.join(page.metas)}\n"
+        f"<links>{page.links[:10]}</links>\n"
+        f"<body>{page.text[:1000]}</body>"
     )
 
     return result[:max_length]
@@ -69,29 +253,45 @@ def _normalize_url(url: str) -> str | None:
         return None
 
 # 擷取 URL
-def extract_urls(text: str, max_count: int = 50) -> list[str]:
-    """從 HTML 或純文字中萃取網址，並格式化。"""
-    urls = set()
-    lowered = text.lower()
+def extract_urls(
+    text: str,
+    max_count: int = 50,
+    page: ParsedPage | None = None,
+    max_scan: int = MAX_PARSE_LINKS,
+) -> list[str]:
+    """從 HTML 或純文字中萃取網址，並格式化。
+
+    page 為同一份 text 的 parse_html() 結果；有傳入就直接沿用其中的連結。
+    regex 模式最多檢查 max_scan 個候選網址，避免連結灌爆的頁面拖慢請求。
+    結果保留出現順序（不排序），超過 max_count 時截掉的是最後面的網址，
+    舊版文字格式開頭的頁面網址不會因此被擠掉。
+    """
+    candidates = []
+
+    # Regex 模式（www., http://, https://）：依文字順序，開頭的頁面網址排第一
+    for i, m in enumerate(_URL_RE.finditer(text)):
+        if i >= max_scan:
+            break
+        candidates.append(m.group(1))
 
     # HTML 模式（<a href>）
-    if "<html" in lowered or "<a " in lowered or "href=" in lowered:
-        try:
-            soup = BeautifulSoup(text, "html.parser")
-            for a in soup.find_all("a", href=True):
-                href = (a.get("href") or "").strip()
-                norm = _normalize_url(href)
-                if norm:
-                    urls.add(norm)
-        except:
-            pass
-
-    # Regex 模式（www., http://, https://）
-    pattern = re.compile(r"(?i)\b((?:https?://|www\.)[^\s<>\"'\)]{3,})")
-    for m in pattern.finditer(text):
-        cand = m.group(1)
-        norm = _normalize_url(cand)
-        if norm:
-            urls.add(norm)
+    if page is None and looks_like_html(text):
+        page = parse_html(text, max_links=max_scan)
+    if page is not None:
+        candidates.extend(page.links)
+
+    return normalize_urls(candidates, max_count=max_count)
 
-    return sorted(urls)[:max_count]
+
+def normalize_urls(candidates, max_count: int = MAX_PARSE_LINKS) -> list[str]:
+    """正規化並去重一串網址，保留原本順序（第一個通常是頁面本身的網址）。"""
+    seen = set()
+    urls = []
+    for cand in candidates:
+        norm = _normalize_url(cand)
+        if norm and norm not in seen:
+            seen.add(norm)
+            urls.append(norm)
+            if len(urls) >= max_count:
+                break
+    return urls
@@ -0,0 +1,314 @@
+# link_analysis.py — 整頁連結的批次風險評估
+#
+# 原本只有頁面網址（urls[0]）會經過安全 / 網域 / 相似網站檢查，其餘連結最多看 20 個。
+# 這裡對頁面上所有連結（最多 MAX_LINKS 個）做一次批次評估：
+#   - 先把連結歸併成不重複的主機，每個主機只評估一次
+#   - 主機評估結果（所屬網站、規則命中、模型機率）跨請求快取
+#   - 未快取的主機整批丟給 rule_engine（每個欄位一次 regex 掃描）與 URL 分類器（一次向量化推論）
+# 再把結果彙整成外部網域比例、可疑 / 黑名單網域比例、密碼表單送出目標等訊號，
+# 以「連結分析」證據交給 calculate_risk_score 與 LLM。
+
+import os
+import re
+import socket
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from urllib.parse import urljoin, urlparse
+
+import blacklist
+from rule_engine import get_rules, domain_fields
+
+MAX_HOST_CACHE = int(os.environ.get("LINK_HOST_CACHE", 4096))
+# URL 分類器對主機給出的機率超過門檻即視為可疑
+LINK_MODEL_SUSPICIOUS = float(os.environ.get("LINK_MODEL_SUSPICIOUS", 0.9))
+
+SUSPICIOUS_SHARE = 0.3
+OFFSITE_SHARE = 0.8
+MIN_LINKS_FOR_SHARE = 5
+
+# ★ 弱白名單（不跳過分析，但限制理由）
+SAFE_DOMAINS = [
+    "google.com", "google.com.tw", "gstatic.com",
+    "facebook.com", "microsoft.com", "github.com",
+    "edu.tw", "gov.tw",
+    "niu.edu.tw",
+]
+
+# 任何人都能在上面放內容的託管 / 雲端硬碟 / 表單 / 短網址 / 社群平台：
+# 官方黑名單裡的某個網址在這些主機上，不代表整個主機都是惡意的
+SHARED_HOSTS = [
+    "googleusercontent.com", "googleapis.com", "appspot.com", "firebaseapp.com", "web.app", "forms.gle",
+    "live.com", "1drv.ms", "sharepoint.com", "office.com", "dropbox.com", "box.com", "wetransfer.com",
+    "github.io", "githubusercontent.com", "gitlab.io", "netlify.app", "vercel.app", "pages.dev", "workers.dev",
+    "herokuapp.com", "glitch.me", "repl.co", "azurewebsites.net", "cloudfront.net", "amazonaws.com",
+    "windows.net", "r2.dev", "ipfs.io", "000webhostapp.com", "wixsite.com", "weebly.com", "blogspot.com",
+    "wordpress.com", "notion.site", "sites.google.com",
+    "bit.ly", "tinyurl.com", "t.co", "goo.gl", "is.gd", "cutt.ly", "rebrand.ly", "ow.ly", "buff.ly",
+    "lnkd.in", "shorturl.at", "rb.gy", "t.ly",
+    "linkedin.com", "fb.me", "instagram.com", "twitter.com", "x.com", "t.me", "telegram.me", "wa.me",
+    "whatsapp.com", "line.me", "discord.gg", "discord.com", "youtube.com", "youtu.be",
+]
+
+
+def is_safe_domain(url):
+    host = urlparse(url).netloc.lower()
+    return any(sd in host for sd in SAFE_DOMAINS)
+
+
+def _under(host: str, domains) -> bool:
+    """host 是 domains 其中之一或其子網域。"""
+    return any(host == d or host.endswith("." + d) for d in domains)
+
+
+# 常見的二級網域（example.com.tw 的網站是 example.com.tw，不是 com.tw）
+_SECOND_LEVEL = {"com", "net", "org", "edu", "gov", "co", "ac", "or", "ne", "go", "idv", "mil", "gob"}
+
+
+def site_of(host: str) -> str:
+    """主機所屬的網站（可註冊網域的近似）；IP 位址直接回傳本身。"""
+    if not host:
+        return ""
+    try:
+        socket.inet_aton(host)
+        return host
+    except OSError:
+        pass
+    parts = host.split(".")
+    if len(parts) >= 3 and parts[-2] in _SECOND_LEVEL and len(parts[-1]) == 2:
+        return ".".join(parts[-3:])
+    return ".".join(parts[-2:])
+
+
+# 連結都已正規化成 scheme://netloc/...，直接以 regex 取主機，比 urlsplit 快一個數量級
+_HOST_RE = re.compile(r"[a-zA-Z][a-zA-Z0-9+.-]*://(?:[^@/?#]*@)?(\[[^\]/?#]*\]|[^:/?#]*)")
+
+
+def _host_of(url: str) -> str:
+    m = _HOST_RE.match(url)
+    return m.group(1).lower().rstrip(".") if m else ""
+
+
+@dataclass
+class HostInfo:
+    site: str
+    findings: tuple  # 規則的 "link" 訊息
+    model_prob: float | None
+
+    @property
+    def suspicious(self) -> bool:
+        return bool(self.findings) or (
+            self.model_prob is not None and self.model_prob >= LINK_MODEL_SUSPICIOUS
+        )
+
+
+# ------------------------------
+# 主機評估快取（規則熱更新後自動清空）
+# ------------------------------
+_cache_lock = threading.Lock()
+_host_cache = OrderedDict()
+_cache_rules = None
+
+
+def _evaluate_hosts(hosts: list) -> dict:
+    """回傳 {host: HostInfo}；只有快取沒有的主機才重新評估（整批）。"""
+    global _cache_rules
+    rules = get_rules()
+    result = {}
+    with _cache_lock:
+        if _cache_rules is not rules:
+            _host_cache.clear()
+            _cache_rules = rules
+        misses = []
+        for h in hosts:
+            info = _host_cache.get(h)
+            if info is None:
+                misses.append(h)
+            else:
+                _host_cache.move_to_end(h)
+                result[h] = info
+
+    if not misses:
+        return result
+
+    hits_list = rules.evaluate_fields_batch([domain_fields(h) for h in misses])
+    probs = _model_probs(misses)
+    fresh = {
+        h: HostInfo(site_of(h), tuple(rules.findings(hits, "link")), probs[i] if probs else None)
+        for i, (h, hits) in enumerate(zip(misses, hits_list))
+    }
+
+    with _cache_lock:
+        for h, info in fresh.items():
+            _host_cache[h] = info
+        while len(_host_cache) > MAX_HOST_CACHE:
+            _host_cache.popitem(last=False)
+    result.update(fresh)
+    return result
+
+
+def _model_probs(hosts: list) -> list | None:
+    # 分類器（numpy）延後到第一次使用才載入；沒有模型檔就略過
+    from url_classifier import get_classifier
+
+    clf = get_classifier()
+    if clf is None:
+        return None
+    return [float(p) for p in clf.predict_proba([f"https://{h}/" for h in hosts])]
+
+
+# ------------------------------
+# 黑名單網域（由黑名單網址歸納，依名單版本快取）
+# ------------------------------
+_bl_lock = threading.Lock()
+_bl_official = (None, frozenset())
+_bl_user = (None, frozenset())
+
+
+def _hosts_from(urls, exclude=()) -> frozenset:
+    """只收錄名單上有「網站根目錄」網址（https://host 或 https://host/）的主機。
+
+    名單中 https://host/某個路徑 只代表那個網址是惡意的（常見於共用平台上的單一檔案或表單），
+    不把整個主機當成黑名單網域。exclude 內的網域（含子網域）一律不收錄。
+    """
+    hosts = set()
+    for u in urls:
+        m = _HOST_RE.match(u)
+        if not m:
+            continue
+        rest = u[m.end():]
+        if rest.startswith(":"):
+            rest = rest[rest.find("/"):] if "/" in rest else ""
+        if rest not in ("", "/"):
+            continue
+        h = m.group(1).lower().rstrip(".")
+        if h and not _under(h, exclude):
+            hosts.add(h)
+    return frozenset(hosts)
+
+
+def blacklisted_hosts() -> tuple:
+    """回傳 (官方黑名單網域, 使用者黑名單網域)；名單版本變動時才重新歸納。"""
+    global _bl_official, _bl_user
+    with _bl_lock:
+        if _bl_official[0] != blacklist.OFFICIAL_VERSION:
+            _bl_official = (
+                blacklist.OFFICIAL_VERSION,
+                _hosts_from(list(blacklist.OFFICIAL_BLACKLIST), SAFE_DOMAINS + SHARED_HOSTS),
+            )
+        if _bl_user[0] != blacklist.USER_VERSION:
+            # 使用者名單是使用者親自加入的，不排除共用平台
+            _bl_user = (blacklist.USER_VERSION, _hosts_from(list(blacklist.USER_BLACKLIST)))
+        return _bl_official[1], _bl_user[1]
+
+
+# ------------------------------
+# 彙整
+# ------------------------------
+@dataclass
+class LinkReport:
+    links: int = 0
+    hosts: int = 0
+    page_blacklisted_host: bool = False
+    offsite_hosts: int = 0
+    offsite_link_share: float = 0.0
+    suspicious_hosts: list = field(default_factory=list)
+    blacklisted_hosts: list = field(default_factory=list)
+    credential_forms: list = field(default_factory=list)  # [{"action", "host", "reasons"}]
+
+    @property
+    def suspicious_share(self) -> float:
+        return round(len(self.suspicious_hosts) / self.hosts, 3) if self.hosts else 0.0
+
+    @property
+    def blacklisted_share(self) -> float:
+        return round(len(self.blacklisted_hosts) / self.hosts, 3) if self.hosts else 0.0
+
+    def evidence(self) -> str | None:
+        """轉成證據文字；沒有值得一提的訊號時回傳 None。"""
+        findings = []
+        if self.page_blacklisted_host:
+            findings.append("頁面網域出現在黑名單網址中")
+        if self.blacklisted_hosts:
+            findings.append(f"連結指向黑名單網域：{'、'.join(self.blacklisted_hosts[:3])}")
+        if len(self.suspicious_hosts) >= 2 and self.suspicious_share >= SUSPICIOUS_SHARE:
+            findings.append(
+                f"可疑連結網域比例偏高（{len(self.suspicious_hosts)}/{self.hosts}）："
+                + "、".join(self.suspicious_hosts[:3])
+            )
+        if self.links >= MIN_LINKS_FOR_SHARE and self.offsite_link_share >= OFFSITE_SHARE:
+            findings.append(f"連結大多指向外部網域（{self.offsite_link_share:.0%}）")
+        for form in self.credential_forms[:2]:
+            findings.append(f"密碼表單送往{'、'.join(form['reasons'])}：{form['host'] or form['action']}")
+
+        if not findings:
+            return None
+        return f"共 {self.links} 個連結、{self.hosts} 個網域\n" + "\n".join(findings)
+
+    def to_dict(self) -> dict:
+        return {
+            "links": self.links,
+            "hosts": self.hosts,
+            "page_blacklisted_host": self.page_blacklisted_host,
+            "offsite_hosts": self.offsite_hosts,
+            "offsite_link_share": self.offsite_link_share,
+            "suspicious_share": self.suspicious_share,
+            "blacklisted_share": self.blacklisted_share,
+            "suspicious_hosts": self.suspicious_hosts[:10],
+            "blacklisted_hosts": self.blacklisted_hosts[:10],
+            "credential_forms": self.credential_forms[:5],
+        }
+
+
+def analyze_links(urls: list, forms: list | None = None) -> LinkReport:
+    """urls[0] 為頁面網址，其餘為頁面上的連結（已正規化、去重）。"""
+    report = LinkReport()
+    if not urls:
+        return report
+
+    page_url = urls[0]
+    page_host = _host_of(page_url)
+    link_hosts = [_host_of(u) for u in urls[1:]]
+    link_hosts = [h for h in link_hosts if h]
+    report.links = len(link_hosts)
+
+    # 不重複主機（保留出現順序），每個只評估一次
+    unique = list(dict.fromkeys(link_hosts))
+    form_hosts = []
+    for form in forms or []:
+        if form.get("password"):
+            action = urljoin(page_url, form.get("action") or "")
+            form_hosts.append((form, action, _host_of(action)))
+    extra = [h for _, _, h in form_hosts if h and h not in unique]
+    infos = _evaluate_hosts(([page_host] if page_host else []) + unique + extra)
+
+    page_site = infos[page_host].site if page_host else ""
+    official_hosts, user_hosts = blacklisted_hosts()
+    is_bl_host = lambda h: h in official_hosts or h in user_hosts
+
+    offsite = {h for h in unique if infos[h].site != page_site}
+    report.hosts = len(unique)
+    report.offsite_hosts = len(offsite)
+    if link_hosts:
+        report.offsite_link_share = round(sum(1 for h in link_hosts if h in offsite) / len(link_hosts), 3)
+    report.suspicious_hosts = [h for h in unique if infos[h].suspicious and h != page_host]
+    report.blacklisted_hosts = [h for h in unique if is_bl_host(h) and h != page_host]
+    report.page_blacklisted_host = bool(page_host) and is_bl_host(page_host)
+
+    # 含密碼欄位的表單：送往外部網域、黑名單 / 可疑網域、或以 HTTP 明文送出
+    for form, action, host in form_hosts:
+        reasons = []
+        if not host:
+            continue
+        if infos[host].site != page_site:
+            reasons.append("外部網域")
+        if is_bl_host(host):
+            reasons.append("黑名單網域")
+        elif infos[host].suspicious:
+            reasons.append("可疑網域")
+        if action.startswith("http://"):
+            reasons.append("未加密連線")
+        if reasons:
+            report.credential_forms.append({"action": action, "host": host, "reasons": reasons})
+
+    return report
@@ -0,0 +1,292 @@
+# payload.py — /analyze 請求內容的讀取與大小限制
+
+import hashlib
+import json
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+# 可選的壓縮 / 編碼格式，沒安裝就只接受 JSON + gzip
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# 可用環境變數調整的上限
+MAX_BODY_BYTES = int(os.environ.get("ANALYZE_MAX_BODY_BYTES", 1024 * 1024))
+MAX_TEXT_CHARS = int(os.environ.get("ANALYZE_MAX_TEXT_CHARS", 40000))
+MAX_LINKS = int(os.environ.get("ANALYZE_MAX_LINKS", 500))
+MAX_FORMS = 50
+# 解壓縮後的上限（防止壓縮炸彈）
+MAX_DECODED_BYTES = int(os.environ.get("ANALYZE_MAX_DECODED_BYTES", 4 * MAX_BODY_BYTES))
+
+# 結構化請求格式版本（v1 = 舊版 {"text": "=== URL === ..."}）
+PROTOCOL_VERSION = 2
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack")
+
+# 增量請求（單頁應用換頁）：伺服器記住每次擷取的連結清單與文字，下一次只送新增 / 移除的連結與文字的差異
+LINK_CACHE_SIZE = int(os.environ.get("ANALYZE_LINK_CACHE_SIZE", 256))
+LINK_CACHE_TTL = int(os.environ.get("ANALYZE_LINK_CACHE_TTL", 600))
+# 快取的是未截斷的完整文字（text_delta 與 hash 都以完整文字計算），另以總字數限制記憶體用量
+LINK_CACHE_MAX_CHARS = int(os.environ.get("ANALYZE_LINK_CACHE_MAX_CHARS", 8_000_000))
+CAPTURE_ID_MAX_LEN = 64
+
+_READ_CHUNK = 64 * 1024
+
+
+class PayloadError(Exception):
+    """請求內容無法處理（過大或格式錯誤），status 為回傳的 HTTP 狀態碼。"""
+
+    def __init__(self, message: str, status: int = 400, reason: str | None = None):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.reason = reason
+
+
+_link_lock = threading.Lock()
+# (客戶端, capture_id) → (到期時間, 連結清單, 文字)（LRU）
+# capture_id 由客戶端產生，以客戶端區分，其他客戶端送相同的 id 也讀不到、蓋不掉別人的內容
+_link_cache = OrderedDict()
+_link_cache_chars = 0
+
+
+def _remember_capture(client: str, capture_id: str, links: list, text: str):
+    global _link_cache_chars
+    key = (client, capture_id)
+    with _link_lock:
+        old = _link_cache.pop(key, None)
+        if old is not None:
+            _link_cache_chars -= len(old[2])
+        _link_cache[key] = (time.monotonic() + LINK_CACHE_TTL, links, text)
+        _link_cache_chars += len(text)
+        while len(_link_cache) > LINK_CACHE_SIZE or (_link_cache_chars > LINK_CACHE_MAX_CHARS and len(_link_cache) > 1):
+            _, dropped = _link_cache.popitem(last=False)
+            _link_cache_chars -= len(dropped[2])
+
+
+def _cached_capture(client: str, capture_id: str) -> tuple | None:
+    """回傳 (連結清單, 文字)；不存在或已過期時回傳 None。"""
+    global _link_cache_chars
+    key = (client, capture_id)
+    with _link_lock:
+        entry = _link_cache.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del _link_cache[key]
+            _link_cache_chars -= len(entry[2])
+            return None
+        return entry[1], entry[2]
+
+
+def _need_full() -> PayloadError:
+    return PayloadError("找不到先前的擷取內容，請送出完整內容", 409, reason="need_full")
+
+
+def apply_text_delta(previous: str, delta) -> str:
+    """text_delta = [保留的開頭長度, 保留的結尾長度, 中間的新文字]。
+
+    長度以 UTF-16 code unit 計（與擴充功能的 JavaScript 字串索引一致），
+    因此以 UTF-16 編碼後切割再解碼；格式不對時丟出 PayloadError(400)。
+    """
+    if (
+        not isinstance(delta, list) or len(delta) != 3
+        or not all(type(n) is int and n >= 0 for n in delta[:2])
+        or not isinstance(delta[2], str)
+    ):
+        raise PayloadError("text_delta 欄位格式錯誤")
+    prefix, suffix, middle = delta
+    units = previous.encode("utf-16-le", "surrogatepass")
+    if 2 * (prefix + suffix) > len(units):
+        raise PayloadError("text_delta 超出先前文字的長度")
+    joined = units[:2 * prefix] + middle.encode("utf-16-le", "surrogatepass") + units[len(units) - 2 * suffix:]
+    try:
+        return joined.decode("utf-16-le")
+    except UnicodeDecodeError:
+        raise PayloadError("text_delta 切在字元中間")
+
+
+def _string_list(value, name: str) -> list:
+    if value is None:
+        return []
+    if not isinstance(value, list):
+        raise PayloadError(f"{name} 欄位格式錯誤")
+    return [v for v in value[:MAX_LINKS] if isinstance(v, str)]
+
+
+def read_body(stream, content_length: int | None, limit: int = MAX_BODY_BYTES) -> bytes:
+    """分段讀取請求內容，超過 limit 就立即停止讀取並丟出 PayloadError(413)。"""
+    if content_length is not None and content_length > limit:
+        raise PayloadError(f"請求內容過大（{content_length} bytes，上限 {limit}）", 413)
+
+    chunks = []
+    total = 0
+    while True:
+        chunk = stream.read(min(_READ_CHUNK, limit + 1 - total))
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > limit:
+            raise PayloadError(f"請求內容過大（超過 {limit} bytes）", 413)
+        chunks.append(chunk)
+
+    return b"".join(chunks)
+
+
+def _decompress(raw: bytes, encoding: str) -> bytes:
+    """依 Content-Encoding 解壓縮，輸出超過 MAX_DECODED_BYTES 即拒絕。"""
+    if encoding in ("gzip", "x-gzip"):
+        d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            out = d.decompress(raw, MAX_DECODED_BYTES + 1)
+        except zlib.error:
+            raise PayloadError("gzip 內容損毀")
+        if len(out) > MAX_DECODED_BYTES or d.unconsumed_tail:
+            raise PayloadError("解壓縮後內容過大", 413)
+        return out
+
+    if encoding == "zstd":
+        if zstandard is None:
+            raise PayloadError("伺服器未安裝 zstandard，不支援 zstd", 415)
+        try:
+            reader = zstandard.ZstdDecompressor().stream_reader(raw)
+            out = reader.read(MAX_DECODED_BYTES + 1)
+        except zstandard.ZstdError:
+            raise PayloadError("zstd 內容損毀")
+        if len(out) > MAX_DECODED_BYTES:
+            raise PayloadError("解壓縮後內容過大", 413)
+        return out
+
+    raise PayloadError(f"不支援的 Content-Encoding：{encoding}", 415)
+
+
+def content_hash(text: str) -> str:
+    """結構化請求使用的內容雜湊（sha256 of UTF-8 text）。"""
+    return "sha256:" + hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _clean_form(form: dict) -> dict:
+    """表單摘要：送出目標、方法、是否含密碼欄位（與 html_utils.ParsedPage.forms 同格式）。"""
+    action = form.get("action")
+    method = form.get("method")
+    return {
+        "action": action.strip()[:2048] if isinstance(action, str) else "",
+        "method": method.strip().lower()[:10] if isinstance(method, str) else "get",
+        "password": bool(form.get("password")),
+    }
+
+
+def load_analyze_payload(
+    raw: bytes,
+    content_type: str | None = None,
+    content_encoding: str | None = None,
+    client: str = "",
+) -> dict:
+    """解析 /analyze 的請求內容，回傳統一格式的 dict。
+
+    支援：
+    - v1：{"text": "..."}，由伺服器自行從文字中萃取 URL 與連結
+    - v2：{"v": 2, "url", "title", "text", "links", "forms", "hash"}，欄位已由擴充功能拆好
+      可另帶 capture_id；之後的請求以 {"base": 先前的 capture_id, "links_added", "links_removed"}
+      取代 links，並可用 "text_delta"（見 apply_text_delta）取代 text。伺服器不認得 base（過期或換了節點）
+      或還原後的文字與 hash 不符時丟出 PayloadError(409, reason="need_full")，擴充功能改送完整內容。
+      capture_id 只在同一個 client（admission.client_id）內有效
+    內容可用 gzip / zstd 壓縮（Content-Encoding），或以 MessagePack 編碼。
+    """
+    encoding = (content_encoding or "identity").strip().lower()
+    if raw and encoding != "identity":
+        raw = _decompress(raw, encoding)
+
+    if not raw:
+        return {"version": 1, "text": ""}
+
+    mime = (content_type or "").split(";")[0].strip().lower()
+    try:
+        if mime in MSGPACK_TYPES:
+            if msgpack is None:
+                raise PayloadError("伺服器未安裝 msgpack，不支援 MessagePack", 415)
+            data = msgpack.unpackb(raw, raw=False)
+        else:
+            data = json.loads(raw)
+    except PayloadError:
+        raise
+    except Exception:
+        raise PayloadError("請求內容格式錯誤")
+
+    if not isinstance(data, dict):
+        raise PayloadError("請求內容格式錯誤")
+
+    text = data.get("text") or ""
+    if not isinstance(text, str):
+        raise PayloadError("text 欄位必須為字串")
+
+    version = data.get("v", 1)
+    if version == 1:
+        return {"version": 1, "text": text[:MAX_TEXT_CHARS]}
+    if version != PROTOCOL_VERSION:
+        raise PayloadError(f"不支援的協定版本：{version}")
+
+    url = data.get("url") or ""
+    title = data.get("title") or ""
+    if not isinstance(url, str) or not isinstance(title, str):
+        raise PayloadError("url / title 欄位格式錯誤")
+
+    capture_id = data.get("capture_id")
+    if capture_id is not None and not (isinstance(capture_id, str) and 0 < len(capture_id) <= CAPTURE_ID_MAX_LEN):
+        raise PayloadError("capture_id 欄位格式錯誤")
+
+    digest = data.get("hash")
+    base = data.get("base")
+    if base is not None:
+        if not isinstance(base, str):
+            raise PayloadError("base 欄位格式錯誤")
+        previous = _cached_capture(client, base)
+        if previous is None:
+            raise _need_full()
+        previous_links, previous_text = previous
+        if "text_delta" in data:
+            text = apply_text_delta(previous_text, data["text_delta"])
+            if not digest:
+                raise PayloadError("text_delta 必須附上 hash")
+            if digest != content_hash(text):
+                raise _need_full()
+        removed = set(_string_list(data.get("links_removed"), "links_removed"))
+        links = [l for l in previous_links if l not in removed]
+        known = set(links)
+        for l in _string_list(data.get("links_added"), "links_added"):
+            if l not in known:
+                known.add(l)
+                links.append(l)
+        links = links[:MAX_LINKS]
+    else:
+        links = _string_list(data.get("links"), "links")
+
+    if digest and digest != content_hash(text):
+        raise PayloadError("內容雜湊不符")
+
+    forms = data.get("forms") or []
+    if not isinstance(forms, list):
+        raise PayloadError("forms 欄位格式錯誤")
+
+    # 全部檢查通過才記住；記住完整文字，下一次的 text_delta 才能還原出與客戶端相同的內容
+    if capture_id is not None:
+        _remember_capture(client, capture_id, links, text)
+
+    return {
+        "version": PROTOCOL_VERSION,
+        "url": url.strip(),
+        "title": title.strip()[:500],
+        "text": text[:MAX_TEXT_CHARS],
+        "links": links,
+        "delta": base is not None,
+        "forms": [_clean_form(f) for f in forms[:MAX_FORMS] if isinstance(f, dict)],
+        "hash": digest or content_hash(text),
+    }
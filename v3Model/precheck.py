@@ -0,0 +1,93 @@
+# precheck.py — 導航前的連結預檢（/precheck）
+#
+# 完整分析要等目的頁面載入、content.js 在 document_idle 擷取後才開始，判定出來時使用者已經在看頁面了。
+# 擴充功能在使用者把滑鼠移到 / 聚焦外部連結，或頁面上的外部連結不多時，先把目標網址送來預檢：
+#   - 黑名單：原始網址、正規化網址與去掉結尾 "/" 的版本（與 /analyze 相同）
+#   - 網址規則評分（rule_engine）與「主機出現在黑名單網址中」（link_analysis 的黑名單網域）
+#   - 官方安全域名的減分（與 /analyze 的白名單檢查相同）
+#   - URL 分類器機率（整批一次推論）
+# 不抓取頁面、不呼叫 LLM，評分方式與 calculate_risk_score 相同（只是少了頁面內容的證據）。
+# 擴充功能快取結果；導航開始時預檢為黑名單就直接攔截，高風險則先顯示預檢結果。
+
+import os
+from urllib.parse import urlsplit
+
+from blacklist import is_blacklisted, check_blacklist_source
+from html_utils import normalize_urls
+from link_analysis import blacklisted_hosts, is_safe_domain
+from rule_engine import get_rules
+
+MAX_PRECHECK_URLS = 20
+# 擴充功能快取預檢結果的秒數
+PRECHECK_TTL = int(os.environ.get("PRECHECK_TTL", 600))
+# 風險評分達此門檻（「高風險」以上）或 URL 模型機率達到直接判定釣魚的門檻即標記 warn
+WARN_SCORE = 50
+MAX_REASONS = 5
+
+
+def _blacklist_hit(url: str):
+    """回傳 (命中的網址, 來源)；未命中回傳 (None, None)。"""
+    candidates = [url]
+    for u in normalize_urls([url], max_count=1):
+        candidates.append(u)
+        if u.endswith("/"):
+            candidates.append(u[:-1])
+    for c in candidates:
+        if is_blacklisted(c):
+            return c, check_blacklist_source(c)
+    return None, None
+
+
+def precheck_urls(urls: list) -> list:
+    """逐一回傳預檢結果（順序與 urls 相同，url 欄位為原始輸入）。"""
+    rules = get_rules()
+    official_hosts, user_hosts = blacklisted_hosts()
+    normalized = [(normalize_urls([u], max_count=1) or [u])[0] for u in urls]
+    hits_list = rules.evaluate_batch(normalized)
+
+    # 分類器（numpy）與評分工具（langchain）延後到第一次使用才載入；沒有模型檔就略過
+    from url_classifier import get_classifier, DECIDE_HIGH
+    from tools import model_score
+
+    clf = get_classifier()
+    probs = [float(p) for p in clf.predict_proba(normalized)] if clf is not None else [None] * len(urls)
+
+    results = []
+    for url, norm, hits, prob in zip(urls, normalized, hits_list, probs):
+        matched, source = _blacklist_hit(url)
+        if matched is not None:
+            results.append({
+                "url": url,
+                "blacklisted": True,
+                "blacklist_source": source,
+                "warn": True,
+                "explanation": f"偵測到黑名單惡意網址：{matched}",
+            })
+            continue
+
+        score, reasons = rules.url_score(hits)
+        host = (urlsplit(norm).hostname or "").rstrip(".")
+        if host and (host in official_hosts or host in user_hosts):
+            points, host_reasons = rules.evidence_score("頁面網域出現在黑名單網址中")
+            score += points
+            reasons += host_reasons
+        if is_safe_domain(norm):
+            points, safe_reasons = rules.evidence_score("官方安全域名")
+            score += points
+            reasons += safe_reasons
+        model_points, model_reasons = model_score(prob)
+        score += model_points
+        reasons += model_reasons
+        score = max(0, min(100, score))
+
+        results.append({
+            "url": url,
+            "blacklisted": False,
+            "blacklist_source": None,
+            "warn": score >= WARN_SCORE or (prob is not None and prob >= DECIDE_HIGH),
+            "risk_score": score,
+            "risk_level": rules.level(score),
+            "reasons": reasons[:MAX_REASONS],
+            "model_probability": round(prob, 4) if prob is not None else None,
+        })
+    return results
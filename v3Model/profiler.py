@@ -0,0 +1,319 @@
+# profiler.py — 線上 /analyze 的按需效能剖析
+#
+# 預設關閉；管理者透過 /debug/profile 開啟一次「擷取」，對接下來 N 個 /analyze 請求或 T 秒內的請求：
+#   - sample 模式：背景執行緒每 interval_ms 讀一次 sys._current_frames()，只取正在處理
+#     被剖析請求的執行緒，累計成 collapsed stack（flamegraph.pl / speedscope 可讀）
+#   - cprofile 模式：每個被剖析的請求在各自的執行緒上啟用 cProfile，結果合併成 pstats 表
+# 程式碼以 stage("名稱") 標註處理階段（解析、黑名單、工具、LLM…），sample 模式會把階段
+# 加在堆疊最上層，兩種模式都會統計各階段耗時。
+# 沒有擷取進行中時，stage() 只做一次全域旗標判斷，回傳共用的空 context manager。
+
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+MAX_PROFILE_SECONDS = 600
+MAX_PROFILE_REQUESTS = 1000
+DEFAULT_INTERVAL_MS = 5
+MAX_STACK_DEPTH = 128
+# GET ?wait=1 最多等待的秒數（擷取本身可長達 MAX_PROFILE_SECONDS，不讓請求執行緒一直卡著）
+MAX_WAIT_SECONDS = 30
+# pstats 可用的排序欄位
+SORT_KEYS = ("cumulative", "tottime", "ncalls", "pcalls", "name", "filename", "line", "module")
+
+_NULL = nullcontext()
+_enabled = False          # 有擷取進行中（stage() 的快速判斷只看這個）
+_lock = threading.Lock()
+_session = None           # 進行中或最近一次的擷取
+_local = threading.local()
+
+
+class ProfilerBusy(Exception):
+    """已有擷取進行中。"""
+
+
+class ProfileSession:
+    def __init__(self, mode: str, max_requests: int | None, seconds: float | None, interval_ms: float):
+        self.id = uuid.uuid4().hex[:8]
+        self.mode = mode
+        self.max_requests = max_requests
+        self.seconds = seconds
+        self.interval = interval_ms / 1000
+        self.started = time.time()
+        self.ended = None
+        self.requests_started = 0
+        self.requests_done = 0
+        self.samples = Counter()   # 堆疊 tuple → 取樣次數
+        self.stage_time = Counter()
+        self.stage_calls = Counter()
+        self.stats = None          # cprofile 模式的 pstats.Stats
+        self.threads = {}          # thread id → 該執行緒目前的階段堆疊（list）
+        self.done = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self.ended is None
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "mode": self.mode,
+            "running": self.running,
+            "requests": self.requests_done,
+            "max_requests": self.max_requests,
+            "seconds": self.seconds,
+            "elapsed": round((self.ended or time.time()) - self.started, 2),
+            "samples": sum(self.samples.values()),
+            "stages": {
+                name: {"calls": self.stage_calls[name], "total_ms": round(t * 1000, 2)}
+                for name, t in self.stage_time.most_common()
+            },
+        }
+
+
+# ------------------------------
+# 擷取控制
+# ------------------------------
+def start(mode: str = "sample", requests: int | None = None, seconds: float | None = None,
+          interval_ms: float = DEFAULT_INTERVAL_MS) -> ProfileSession:
+    """參數不合法時丟出 ValueError / TypeError，已有擷取進行中時丟出 ProfilerBusy。"""
+    global _session, _enabled
+    if mode not in ("sample", "cprofile"):
+        raise ValueError("mode 必須為 sample 或 cprofile")
+    if not requests and not seconds:
+        requests = 10
+    if requests is not None:
+        requests = max(1, min(int(requests), MAX_PROFILE_REQUESTS))
+    seconds = min(float(seconds), MAX_PROFILE_SECONDS) if seconds else MAX_PROFILE_SECONDS
+    interval_ms = max(1.0, float(interval_ms))
+
+    with _lock:
+        if _session is not None and _session.running:
+            raise ProfilerBusy("已有擷取進行中")
+        _session = ProfileSession(mode, requests, seconds, interval_ms)
+        _enabled = True
+        session = _session
+
+    threading.Thread(target=_watch, args=(session,), name="profiler", daemon=True).start()
+    print(f"[PROFILE] 開始擷取 {session.id}（{mode}，{requests or '不限'} 個請求，{seconds} 秒）")
+    return session
+
+
+def stop() -> ProfileSession | None:
+    with _lock:
+        session = _session
+        if session is not None and session.running:
+            _finish_locked(session)
+    return session
+
+
+def current() -> ProfileSession | None:
+    return _session
+
+
+def enabled() -> bool:
+    """有擷取進行中（每個請求都會呼叫，只讀一個全域旗標）。"""
+    return _enabled
+
+
+def _finish_locked(session: ProfileSession):
+    global _enabled
+    session.ended = time.time()
+    session.done.set()
+    _enabled = False
+    print(f"[PROFILE] 擷取 {session.id} 結束（{session.requests_done} 個請求）")
+
+
+def _watch(session: ProfileSession):
+    """sample 模式的取樣迴圈；兩種模式都在這裡檢查時間上限。"""
+    deadline = session.started + session.seconds
+    me = threading.get_ident()
+    while session.running:
+        now = time.time()
+        if now >= deadline:
+            with _lock:
+                if session.running:
+                    _finish_locked(session)
+            break
+        if session.mode == "sample" and session.threads:
+            frames = sys._current_frames()
+            with _lock:
+                for tid, stages in list(session.threads.items()):
+                    frame = frames.get(tid)
+                    if frame is None or tid == me:
+                        continue
+                    session.samples[_stack(frame, stages)] += 1
+        time.sleep(session.interval if session.mode == "sample" else 0.2)
+
+
+def _stack(frame, stages: list) -> tuple:
+    names = []
+    while frame is not None and len(names) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    names.reverse()
+    return tuple(f"[stage] {s}" for s in stages) + tuple(names)
+
+
+# ------------------------------
+# 請求與執行緒的標記
+# ------------------------------
+def begin_request():
+    """請求開始時呼叫；這個請求要被剖析就回傳 session，否則 None。"""
+    if not _enabled:
+        return None
+    with _lock:
+        session = _session
+        if session is None or not session.running:
+            return None
+        if session.max_requests is not None and session.requests_started >= session.max_requests:
+            return None
+        session.requests_started += 1
+    _enter_thread(session)
+    return session
+
+
+def end_request(session: ProfileSession):
+    _exit_thread(session)
+    with _lock:
+        session.requests_done += 1
+        if (session.running and session.max_requests is not None
+                and session.requests_done >= session.max_requests):
+            _finish_locked(session)
+
+
+def follow(fn):
+    """把 fn 包成「在其他執行緒（排程器 worker）執行時也繼續剖析」的版本。"""
+    session = getattr(_local, "session", None)
+    if session is None:
+        return fn
+
+    def wrapper(*args, **kwargs):
+        _enter_thread(session)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _exit_thread(session)
+    return wrapper
+
+
+def _enter_thread(session: ProfileSession):
+    _local.session = session
+    _local.stages = []
+    _local.prof = None
+    if session.mode == "cprofile":
+        prof = cProfile.Profile()
+        try:
+            prof.enable()
+            _local.prof = prof
+        except ValueError:
+            # Python 3.12+ 同時只能有一個 profiler；並行的請求只統計階段耗時
+            pass
+    with _lock:
+        session.threads[threading.get_ident()] = _local.stages
+
+
+def _exit_thread(session: ProfileSession):
+    prof = getattr(_local, "prof", None)
+    if prof is not None:
+        prof.disable()
+        _local.prof = None
+    with _lock:
+        session.threads.pop(threading.get_ident(), None)
+        if prof is not None:
+            if session.stats is None:
+                session.stats = pstats.Stats(prof)
+            else:
+                session.stats.add(prof)
+    _local.session = None
+
+
+def stage(name: str):
+    """標註處理階段：with stage("llm"): ...；沒在剖析時幾乎沒有成本。"""
+    if not _enabled or getattr(_local, "session", None) is None:
+        return _NULL
+    return _stage(name)
+
+
+@contextmanager
+def _stage(name: str):
+    session = _local.session
+    stages = _local.stages
+    stages.append(name)
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - t0
+        stages.pop()
+        with _lock:
+            session.stage_time[name] += elapsed
+            session.stage_calls[name] += 1
+
+
+# ------------------------------
+# 輸出
+# ------------------------------
+def collapsed(session: ProfileSession) -> str:
+    """Brendan Gregg 的 collapsed stack 格式：每行「frame;frame;... 次數」。"""
+    with _lock:
+        items = list(session.samples.items())
+    lines = [";".join(f.replace(";", ",") for f in stack) + f" {count}" for stack, count in items]
+    return "\n".join(sorted(lines)) + "\n"
+
+
+def speedscope(session: ProfileSession) -> dict:
+    """speedscope 的 sampled profile（https://www.speedscope.app/file-format-schema.json）。"""
+    with _lock:
+        items = list(session.samples.items())
+    frames = []
+    index = {}
+    samples = []
+    weights = []
+    interval_ms = session.interval * 1000
+    for stack, count in items:
+        ids = []
+        for name in stack:
+            if name not in index:
+                index[name] = len(frames)
+                frames.append({"name": name})
+            ids.append(index[name])
+        samples.append(ids)
+        weights.append(round(count * interval_ms, 3))
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": f"analyze profile {session.id}",
+        "exporter": "v3Model profiler",
+        "shared": {"frames": frames},
+        "profiles": [{
+            "type": "sampled",
+            "name": f"/analyze（{session.requests_done} 個請求）",
+            "unit": "milliseconds",
+            "startValue": 0,
+            "endValue": round(sum(weights), 3),
+            "samples": samples,
+            "weights": weights,
+        }],
+    }
+
+
+def cprofile_text(session: ProfileSession, limit: int = 40, sort: str = "cumulative") -> str:
+    if sort not in SORT_KEYS:
+        raise ValueError(f"sort 必須為 {' / '.join(SORT_KEYS)}")
+    with _lock:
+        stats = session.stats
+        if stats is None:
+            return "（尚無資料）\n"
+        out = io.StringIO()
+        stats.stream = out
+        stats.sort_stats(sort).print_stats(limit)
+    return out.getvalue()
@@ -0,0 +1,336 @@
+# replication.py — 多節點之間複寫使用者黑名單與判定結果
+#
+# 不依賴外部資料庫，各節點互相拉取：
+#   - 使用者黑名單：每個網址是一個 last-writer-wins 暫存器，時間戳為 (ts, 來源節點)。
+#     每次異動（本節點操作或套用其他節點的異動）都以遞增的 seq 追加到變更紀錄檔（JSON Lines），
+#     重啟時重播紀錄還原狀態；啟動時若紀錄過長，只保留每個網址最後一筆（保留原 seq，增量同步不受影響）。
+#   - 判定結果：只是快取，不落地；新判定放進記憶體環狀緩衝區，跟著同一個 /sync 回應送出。
+#     判定不會被轉送第二次，各節點需互相列在 PEERS 裡（黑名單異動則會層層轉送）。
+#   - /sync?since=N 回傳 seq > N 的異動；對方的紀錄檔換過（log_id 不同）時改送完整快照。
+#   - 背景執行緒每 REPLICATION_INTERVAL 秒向 PEERS 拉取增量，每 SNAPSHOT_INTERVAL 秒再做一次
+#     完整快照比對（anti-entropy），補回任何遺漏。
+#
+# 本機測試多節點：
+#   PORT=5001 NODE_ID=a PEERS=http://127.0.0.1:5002 USER_BLACKLIST_FILE=a.txt REPLICATION_LOG=a.jsonl python server.py
+#   PORT=5002 NODE_ID=b PEERS=http://127.0.0.1:5001 USER_BLACKLIST_FILE=b.txt REPLICATION_LOG=b.jsonl python server.py
+# 跨機器部署時以 HOST 指定監聽位址，且必須設定 SYNC_TOKEN（各節點相同）；
+# 非本機位址上 server.py 會關閉 debug 與 reloader（Werkzeug debugger 可遠端執行程式碼）：
+#   HOST=0.0.0.0 SYNC_TOKEN=... PEERS=http://10.0.0.2:5000 python server.py
+
+import ipaddress
+import json
+import os
+import socket
+import threading
+import time
+import urllib.parse
+import urllib.request
+import uuid
+from collections import deque
+
+import blacklist
+import verdict_cache
+
+# 監聽位址：預設只接受本機連線；多節點部署時設成對外位址（例如 0.0.0.0），此時必須設定 SYNC_TOKEN
+HOST = os.environ.get("HOST", "127.0.0.1")
+PORT = int(os.environ.get("PORT", 5000))
+NODE_ID = os.environ.get("NODE_ID") or f"{socket.gethostname()}:{PORT}"
+PEERS = [p.strip().rstrip("/") for p in os.environ.get("PEERS", "").split(",") if p.strip()]
+LOG_PATH = os.environ.get("REPLICATION_LOG", "replication_log.jsonl")
+SYNC_TOKEN = os.environ.get("SYNC_TOKEN", "")
+
+REPLICATION_INTERVAL = float(os.environ.get("REPLICATION_INTERVAL", 1.0))
+SNAPSHOT_INTERVAL = float(os.environ.get("SNAPSHOT_INTERVAL", 60.0))
+SYNC_TIMEOUT = 3.0
+MAX_SYNC_CHANGES = 5000
+VERDICT_RING = 2000
+# 紀錄筆數超過「網址數 × 4 + 1000」時，啟動時壓縮
+COMPACT_FACTOR = 4
+
+# 與使用者黑名單共用同一把（可重入）鎖：本節點的異動在 blacklist 持鎖時通知 _on_user_change 蓋上時間戳，
+# 複寫的異動在這裡持鎖時更新 LWW 狀態與集合，兩者不會交錯
+_lock = blacklist.USER_LOCK
+_log_id = None
+_seq = 0
+_log = []     # [{"seq", "op", "url", "ts", "origin"}]，依 seq 排序
+_state = {}   # url -> 最後一筆紀錄
+_last_ts = 0.0
+
+# 判定結果環狀緩衝區（每次程序啟動都是新的 epoch）
+_verdict_epoch = uuid.uuid4().hex[:12]
+_verdict_seq = 0
+_verdict_ring = deque(maxlen=VERDICT_RING)  # (vseq, key, entry)
+
+_peers = {}   # peer -> {"log_id", "since", "vepoch", "vsince", "snapshot_at"}
+_started = False
+
+
+def is_loopback(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def check_bind(host: str) -> str | None:
+    """/sync 沒有 SYNC_TOKEN 就不驗證身分：不允許在非本機位址上監聽。回傳錯誤訊息（可以監聽時為 None）。"""
+    if SYNC_TOKEN or is_loopback(host):
+        return None
+    return f"HOST={host} 會讓其他機器連到 /sync，請先設定 SYNC_TOKEN"
+
+
+def _stamp(record: dict) -> tuple:
+    return (record["ts"], record["origin"])
+
+
+def _next_ts() -> float:
+    """本節點的時間戳：不小於牆上時間，也嚴格大於看過的所有時間戳。"""
+    global _last_ts
+    _last_ts = max(time.time(), _last_ts + 1e-6)
+    return _last_ts
+
+
+# ------------------------------
+# 變更紀錄檔
+# ------------------------------
+def _write_records(records: list, mode: str = "a"):
+    with open(LOG_PATH, mode, encoding="utf-8") as f:
+        if mode == "w":
+            f.write(json.dumps({"log_id": _log_id}) + "\n")
+        for r in records:
+            f.write(json.dumps(r, ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _load_log():
+    global _log_id, _seq, _last_ts
+    records = []
+    if os.path.exists(LOG_PATH):
+        with open(LOG_PATH, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    item = json.loads(line)
+                except ValueError:
+                    continue  # 寫到一半被中斷的最後一行
+                if "log_id" in item:
+                    _log_id = item["log_id"]
+                elif {"seq", "op", "url", "ts", "origin"} <= item.keys():
+                    records.append(item)
+
+    if _log_id is None:
+        _log_id = uuid.uuid4().hex[:12]
+        records = []
+
+    for r in records:
+        current = _state.get(r["url"])
+        if current is None or _stamp(r) > _stamp(current):
+            _state[r["url"]] = r
+        _seq = max(_seq, r["seq"])
+        _last_ts = max(_last_ts, r["ts"])
+
+    if len(records) > len(_state) * COMPACT_FACTOR + 1000:
+        # 只保留每個網址最新的一筆（原 seq 不變），被覆蓋的舊紀錄對任何同步進度都已無用
+        records = sorted(_state.values(), key=lambda r: r["seq"])
+        _write_records(records, mode="w")
+        print(f"[REPL] 變更紀錄已壓縮為 {len(records)} 筆")
+    elif not os.path.exists(LOG_PATH):
+        _write_records([], mode="w")
+
+    _log.extend(records)
+
+
+def _append(op: str, url: str, ts: float, origin: str) -> dict | None:
+    """在鎖內呼叫：時間戳比現有狀態新才記錄，回傳新紀錄（否則 None）。"""
+    global _seq
+    current = _state.get(url)
+    if current is not None and (ts, origin) <= _stamp(current):
+        return None
+    _seq += 1
+    record = {"seq": _seq, "op": op, "url": url, "ts": ts, "origin": origin}
+    _state[url] = record
+    _log.append(record)
+    return record
+
+
+# ------------------------------
+# 本節點的異動（blacklist / verdict_cache 的通知）
+# ------------------------------
+def _on_user_change(op: str, url: str):
+    with _lock:
+        if op == "clear":
+            urls = [u for u, r in _state.items() if r["op"] == "add"]
+            ops = [("delete", u) for u in urls]
+        elif op in ("add", "delete"):
+            ops = [(op, url)]
+        else:
+            return
+        records = [r for r in (_append(o, u, _next_ts(), NODE_ID) for o, u in ops) if r]
+        if records:
+            _write_records(records)
+
+
+def _on_verdict(key: str, entry: dict):
+    global _verdict_seq
+    with _lock:
+        _verdict_seq += 1
+        _verdict_ring.append((_verdict_seq, key, entry))
+
+
+# ------------------------------
+# 提供給 /sync
+# ------------------------------
+def sync_payload(
+    since: int | None,
+    log_id: str | None = None,
+    vsince: int | None = None,
+    vepoch: str | None = None,
+    snapshot: bool = False,
+) -> dict:
+    """回傳 since 之後的異動；對方持有的 log_id 不同或要求快照時回傳完整狀態。"""
+    with _lock:
+        payload = {"node_id": NODE_ID, "log_id": _log_id, "seq": _seq}
+
+        if snapshot or log_id != _log_id or since is None or since > _seq:
+            payload["snapshot"] = True
+            payload["changes"] = sorted(_state.values(), key=lambda r: r["seq"])
+        else:
+            # _log 依 seq 排序，從尾端往回找起點
+            i = len(_log)
+            while i > 0 and _log[i - 1]["seq"] > since:
+                i -= 1
+            changes = _log[i:i + MAX_SYNC_CHANGES]
+            payload["changes"] = changes
+            if len(_log) - i > MAX_SYNC_CHANGES:
+                payload["seq"] = changes[-1]["seq"]  # 分批送，對方下一輪接著拉
+                payload["more"] = True
+
+        payload["verdict_epoch"] = _verdict_epoch
+        payload["verdict_seq"] = _verdict_seq
+        start = vsince if vepoch == _verdict_epoch and vsince is not None else 0
+        payload["verdicts"] = [
+            {"key": key, **entry} for vseq, key, entry in _verdict_ring if vseq > start
+        ]
+    return payload
+
+
+# ------------------------------
+# 套用其他節點的異動
+# ------------------------------
+def apply_remote(changes: list) -> int:
+    """以 LWW 合併對方的紀錄，較新的才套用並寫進本節點紀錄（再轉送給其他節點）。"""
+    global _last_ts
+    with _lock:
+        applied = []
+        for r in changes:
+            try:
+                op, url, ts, origin = r["op"], r["url"], float(r["ts"]), str(r["origin"])
+            except (KeyError, TypeError, ValueError):
+                continue
+            if op not in ("add", "delete") or not isinstance(url, str):
+                continue
+            _last_ts = max(_last_ts, ts)
+            record = _append(op, url, ts, origin)
+            if record:
+                applied.append(record)
+        if applied:
+            _write_records(applied)
+            blacklist.apply_user_changes([(r["op"], r["url"]) for r in applied])
+    return len(applied)
+
+
+def _fetch(peer: str, params: dict) -> dict:
+    url = f"{peer}/sync?{urllib.parse.urlencode(params)}"
+    req = urllib.request.Request(url, headers={"X-Sync-Token": SYNC_TOKEN} if SYNC_TOKEN else {})
+    with urllib.request.urlopen(req, timeout=SYNC_TIMEOUT) as resp:
+        data = json.loads(resp.read())
+    if not data.get("success"):
+        raise ValueError(data.get("message") or "同步失敗")
+    return data
+
+
+def pull_peer(peer: str) -> int:
+    """向一個節點拉取一次增量（或快照），回傳套用的黑名單異動數。"""
+    cursor = _peers.setdefault(peer, {"log_id": None, "since": 0, "vepoch": None, "vsince": 0, "snapshot_at": 0.0})
+    params = {
+        "since": cursor["since"],
+        "vsince": cursor["vsince"],
+        "node": NODE_ID,
+    }
+    if cursor["log_id"]:
+        params["log_id"] = cursor["log_id"]
+    if cursor["vepoch"]:
+        params["vepoch"] = cursor["vepoch"]
+    if time.time() - cursor["snapshot_at"] > SNAPSHOT_INTERVAL:
+        params["snapshot"] = 1
+
+    data = _fetch(peer, params)
+    applied = apply_remote(data.get("changes") or [])
+    if data.get("snapshot"):
+        cursor["snapshot_at"] = time.time()
+    cursor["log_id"] = data.get("log_id")
+    cursor["since"] = int(data.get("seq") or 0)
+
+    for v in data.get("verdicts") or []:
+        key = v.get("key") if isinstance(v, dict) else None
+        if key:
+            verdict_cache.import_verdict(key, v)
+    cursor["vepoch"] = data.get("verdict_epoch")
+    cursor["vsince"] = int(data.get("verdict_seq") or 0)
+
+    if applied:
+        print(f"[REPL] 從 {data.get('node_id', peer)} 套用 {applied} 筆異動")
+    return applied
+
+
+def _puller():
+    failures = {}
+    while True:
+        for peer in PEERS:
+            try:
+                pull_peer(peer)
+                if failures.pop(peer, None):
+                    print(f"[REPL] 已恢復與 {peer} 的同步")
+            except Exception as e:
+                # 任何錯誤（連線失敗、對方回傳格式不對…）都不能讓拉取執行緒結束；
+                # 同一個節點連續失敗只提示一次，恢復後再提示
+                if not failures.get(peer):
+                    print(f"[REPL] 無法同步 {peer}：{type(e).__name__}: {e}")
+                failures[peer] = True
+        time.sleep(REPLICATION_INTERVAL)
+
+
+# ------------------------------
+# 啟動
+# ------------------------------
+def start():
+    """在 load_blacklist 之後呼叫：重播紀錄、與使用者黑名單檔對齊、掛上通知並啟動拉取執行緒。"""
+    global _started
+    if _started:
+        return
+    _started = True
+
+    with _lock:
+        _load_log()
+
+        # 紀錄檔是權威狀態；使用者名單檔裡紀錄沒有的網址（例如手動編輯）視為本節點新增
+        seeded = [
+            _append("add", u, _next_ts(), NODE_ID)
+            for u in sorted(blacklist.USER_BLACKLIST) if u not in _state
+        ]
+        seeded = [r for r in seeded if r]
+        if seeded:
+            _write_records(seeded)
+        fix = [(r["op"], u) for u, r in _state.items()
+               if (r["op"] == "add") != (u in blacklist.USER_BLACKLIST)]
+        if fix:
+            blacklist.apply_user_changes(fix)
+
+    blacklist.USER_CHANGE_LISTENERS.append(_on_user_change)
+    verdict_cache.VERDICT_LISTENERS.append(_on_verdict)
+    print(f"[REPL] 節點 {NODE_ID}（紀錄 {_log_id}，seq {_seq}），同步對象：{', '.join(PEERS) or '無'}")
+
+    if PEERS:
+        threading.Thread(target=_puller, name="replication-puller", daemon=True).start()
@@ -0,0 +1,340 @@
+# rule_engine.py — 宣告式啟發規則（heuristic_rules.json）編譯與評估
+#
+# 規則檔列出條件、訊息與權重；載入時編譯成：
+#   - 每個欄位一條合併 regex（每條規則是一個具名 lookahead 群組），一次掃描就能找出所有命中
+#   - 長度 / 等於 / 清單等條件轉成數值與 frozenset 查表
+# 規則檔修改後會自動重新載入（不需重啟伺服器）。
+# 批次評估時同一欄位的多筆值以換行串接後一起掃描，因此 regex 以 re.MULTILINE 編譯：
+# ^ / $ 對齊每一筆的開頭 / 結尾；\A、\Z 只對應整個串接字串，載入時拒絕。
+
+import bisect
+import json
+import os
+import re
+import socket
+import threading
+import time
+from dataclasses import dataclass
+from urllib.parse import urlparse
+
+RULES_PATH = os.environ.get(
+    "HEURISTIC_RULES_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "heuristic_rules.json"),
+)
+# 最多每隔幾秒檢查一次規則檔是否更新
+RELOAD_INTERVAL = float(os.environ.get("HEURISTIC_RULES_RELOAD", 2.0))
+
+URL_FIELDS = ("scheme", "domain", "main_domain", "tld", "path")
+
+_STRING_ANCHOR = re.compile(r"(?<!\\)(?:\\\\)*\\[AZ]")
+
+
+class RuleError(Exception):
+    """規則檔內容不合法。"""
+
+
+@dataclass
+class Hit:
+    rule_id: str
+    match: str
+    value: str
+
+
+@dataclass
+class _Rule:
+    id: str
+    field: str
+    findings: dict
+    weight: int
+    reason: str
+    # 非 regex 條件（查表）
+    len_lt: int | None = None
+    len_gt: int | None = None
+    equals: str | None = None
+    in_set: frozenset | None = None
+    not_in_set: frozenset | None = None
+    is_ip: bool = False
+
+    def check(self, value: str) -> bool:
+        if self.len_lt is not None and len(value) < self.len_lt:
+            return True
+        if self.len_gt is not None and len(value) > self.len_gt:
+            return True
+        if self.equals is not None and value == self.equals:
+            return True
+        if self.in_set is not None and value in self.in_set:
+            return True
+        if self.not_in_set is not None and value not in self.not_in_set:
+            return True
+        if self.is_ip:
+            try:
+                socket.inet_aton(value)
+                return True
+            except OSError:
+                return False
+        return False
+
+
+def url_fields(url: str) -> dict:
+    """把 URL 拆成規則使用的欄位。"""
+    parsed = urlparse(url)
+    fields = domain_fields(parsed.netloc)
+    fields["scheme"] = parsed.scheme
+    fields["path"] = parsed.path.lower()
+    return fields
+
+
+def domain_fields(domain: str) -> dict:
+    """只有網域時的欄位（scheme / path 為空字串）。"""
+    domain = domain.lower().strip()
+    parts = domain.split(".")
+    return {
+        "scheme": "",
+        "domain": domain,
+        "main_domain": parts[0] if parts else "",
+        "tld": parts[-1] if len(parts) >= 2 else "",
+        "path": "",
+    }
+
+
+class CompiledRules:
+    def __init__(self, spec: dict):
+        self.version = spec.get("version", 0)
+        lists = {k: [str(x).lower() for x in v] for k, v in (spec.get("lists") or {}).items()}
+
+        def resolve(value):
+            if isinstance(value, str) and value.startswith("@"):
+                if value[1:] not in lists:
+                    raise RuleError(f"找不到清單：{value}")
+                return lists[value[1:]]
+            return value
+
+        self.rules = {}
+        self.order = []
+        self._regex_groups = {f: [] for f in URL_FIELDS}
+        self._patterns = {}  # 群組名稱 → 單一規則的 regex（命中跨到下一筆時重新比對用）
+        self._table_rules = []
+
+        for i, raw in enumerate(spec.get("url_rules") or []):
+            rid = raw.get("id") or f"rule_{i}"
+            field = raw.get("field")
+            if field not in URL_FIELDS:
+                raise RuleError(f"規則 {rid} 的 field 不合法：{field}")
+            if rid in self.rules:
+                raise RuleError(f"規則 id 重複：{rid}")
+
+            rule = _Rule(
+                id=rid,
+                field=field,
+                findings=raw.get("findings") or {},
+                weight=int(raw.get("weight", 0)),
+                reason=raw.get("reason", ""),
+            )
+
+            pattern = None
+            if "regex" in raw:
+                pattern = raw["regex"]
+            elif "contains_any" in raw:
+                words = sorted(resolve(raw["contains_any"]), key=len, reverse=True)
+                pattern = "|".join(re.escape(w) for w in words)
+
+            if pattern is not None:
+                if _STRING_ANCHOR.search(pattern):
+                    raise RuleError(f"規則 {rid} 的 regex 不可使用 \\A / \\Z，請改用 ^ / $")
+                try:
+                    self._patterns[f"r{i}"] = re.compile(pattern, re.MULTILINE)
+                except re.error as e:
+                    raise RuleError(f"規則 {rid} 的 regex 不合法：{e}")
+                self._regex_groups[field].append((f"r{i}", rid, pattern))
+            else:
+                rule.len_lt = raw.get("len_lt")
+                rule.len_gt = raw.get("len_gt")
+                rule.equals = raw.get("equals")
+                if "in" in raw:
+                    rule.in_set = frozenset(resolve(raw["in"]))
+                if "not_in" in raw:
+                    rule.not_in_set = frozenset(resolve(raw["not_in"]))
+                rule.is_ip = bool(raw.get("is_ip"))
+                self._table_rules.append(rule)
+
+            self.rules[rid] = rule
+            self.order.append(rid)
+
+        # 每個欄位一條合併 regex：在每個位置以 lookahead 嘗試所有規則
+        self._combined = {}
+        self._group_to_rule = {}
+        for field, groups in self._regex_groups.items():
+            if not groups:
+                continue
+            # 開頭的 guard 讓沒有任何規則命中的位置直接在 C 層略過
+            guard = "(?=" + "|".join(f"(?:{p})" for _, _, p in groups) + ")"
+            body = "".join(f"(?:(?=(?P<{g}>{p})))?" for g, _, p in groups)
+            self._combined[field] = re.compile(guard + body, re.MULTILINE)
+            for g, rid, _ in groups:
+                self._group_to_rule[g] = rid
+
+        # 證據文字規則：合併成一條 alternation，一次掃描
+        self.evidence_rules = []
+        ev_groups = []
+        for i, raw in enumerate(spec.get("evidence_rules") or []):
+            rid = raw.get("id") or f"evidence_{i}"
+            words = raw.get("contains_any") or []
+            if not words:
+                raise RuleError(f"證據規則 {rid} 缺少 contains_any")
+            self.evidence_rules.append((f"e{i}", rid, int(raw.get("weight", 0)), raw.get("reason", "")))
+            ev_groups.append(f"(?P<e{i}>" + "|".join(re.escape(w) for w in words) + ")")
+        self._evidence_re = re.compile("|".join(ev_groups)) if ev_groups else None
+
+        self.levels = [(int(limit), name) for limit, name in spec.get("score_levels") or []]
+
+    # ------------------------------
+    # 評估
+    # ------------------------------
+    def _scan(self, field: str, joined: str, starts: list, ends: list, out: list):
+        """對串接後的欄位值跑一次合併 regex，把命中分配回各筆資料。"""
+        pattern = self._combined.get(field)
+        if pattern is None:
+            return
+        for m in pattern.finditer(joined):
+            if m.lastindex is None:
+                continue
+            pos = m.start()
+            idx = bisect.bisect_right(starts, pos) - 1
+            for g, text in m.groupdict().items():
+                if text is None:
+                    continue
+                if pos + len(text) > ends[idx]:
+                    # 貪婪的比對跨到下一筆（例如 [^/]+ 吃掉換行）：只在這一筆的範圍內重新比對
+                    single = self._patterns[g].match(joined, pos, ends[idx])
+                    if single is None:
+                        continue
+                    text = single.group()
+                out[idx].append(Hit(self._group_to_rule[g], text, joined[starts[idx]:ends[idx]]))
+
+    def evaluate_fields_batch(self, rows: list) -> list:
+        """評估多筆欄位 dict，每個欄位只掃描一次（各筆以換行串接）。"""
+        out = [[] for _ in rows]
+        for field in self._combined:
+            # 值本身的換行會被當成分隔，先換成空白
+            values = [r.get(field, "").replace("\n", " ") for r in rows]
+            starts, ends = [], []
+            pos = 0
+            for v in values:
+                starts.append(pos)
+                ends.append(pos + len(v))
+                pos += len(v) + 1
+            self._scan(field, "\n".join(values), starts, ends, out)
+
+        for i, row in enumerate(rows):
+            for rule in self._table_rules:
+                value = row.get(rule.field, "")
+                if rule.check(value):
+                    out[i].append(Hit(rule.id, value, value))
+
+        # 依規則檔順序排列
+        rank = {rid: n for n, rid in enumerate(self.order)}
+        for hits in out:
+            hits.sort(key=lambda h: rank[h.rule_id])
+        return out
+
+    def evaluate(self, url: str) -> list:
+        return self.evaluate_fields_batch([url_fields(url)])[0]
+
+    def evaluate_domain(self, domain: str) -> list:
+        return self.evaluate_fields_batch([domain_fields(domain)])[0]
+
+    def evaluate_batch(self, urls) -> list:
+        return self.evaluate_fields_batch([url_fields(u) for u in urls])
+
+    # ------------------------------
+    # 結果轉換
+    # ------------------------------
+    def findings(self, hits: list, tag: str) -> list:
+        """取出某個工具（tag）要顯示的訊息；同一規則、同一命中只出現一次。"""
+        seen = set()
+        messages = []
+        for h in hits:
+            template = self.rules[h.rule_id].findings.get(tag)
+            if template is None:
+                continue
+            key = (h.rule_id, h.match if "{match}" in template else None)
+            if key in seen:
+                continue
+            seen.add(key)
+            messages.append(template.replace("{match}", h.match).replace("{value}", h.value))
+        return messages
+
+    def url_score(self, hits: list) -> tuple:
+        """URL 規則的分數與理由；每條規則最多計分一次。"""
+        counted = []
+        for h in hits:
+            rule = self.rules[h.rule_id]
+            if rule.weight and rule not in counted:
+                counted.append(rule)
+        # 理由依權重由大到小排列，最重要的排前面
+        counted.sort(key=lambda r: -abs(r.weight))
+        score = sum(r.weight for r in counted)
+        reasons = [f"{r.reason}（{r.weight:+d}分）" for r in counted]
+        return score, reasons
+
+    def evidence_score(self, evidence: str) -> tuple:
+        """證據文字規則的分數與理由（一次掃描）。"""
+        if not evidence or self._evidence_re is None:
+            return 0, []
+        matched = {m.lastgroup for m in self._evidence_re.finditer(evidence)}
+        score = 0
+        reasons = []
+        for g, _, weight, reason in self.evidence_rules:
+            if g in matched:
+                score += weight
+                reasons.append(f"{reason}（{weight:+d}分）")
+        return score, reasons
+
+    def level(self, score: int) -> str:
+        for limit, name in self.levels:
+            if score < limit:
+                return name
+        return self.levels[-1][1] if self.levels else ""
+
+
+# ------------------------------
+# 載入與熱更新
+# ------------------------------
+_lock = threading.Lock()
+_rules = None
+_mtime = None
+_checked_at = 0.0
+
+
+def load_rules(path: str = RULES_PATH) -> CompiledRules:
+    with open(path, "r", encoding="utf-8") as f:
+        return CompiledRules(json.load(f))
+
+
+def get_rules() -> CompiledRules:
+    """取得目前的規則；規則檔有更新就重新編譯，編譯失敗則沿用舊規則。"""
+    global _rules, _mtime, _checked_at
+    now = time.monotonic()
+    if _rules is not None and now - _checked_at < RELOAD_INTERVAL:
+        return _rules
+
+    with _lock:
+        if _rules is not None and now - _checked_at < RELOAD_INTERVAL:
+            return _rules
+        _checked_at = now
+        try:
+            mtime = os.path.getmtime(RULES_PATH)
+        except OSError:
+            mtime = None
+
+        if _rules is None or mtime != _mtime:
+            try:
+                _rules = load_rules(RULES_PATH)
+                print(f"[RULES] 已載入規則 v{_rules.version}（{len(_rules.rules)} 條 URL 規則）")
+            except (OSError, ValueError, RuleError) as e:
+                if _rules is None:
+                    raise
+                print("[RULES] 規則檔重新載入失敗，沿用舊規則:", e)
+            _mtime = mtime
+
+    return _rules
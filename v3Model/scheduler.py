@@ -0,0 +1,205 @@
+# scheduler.py — /analyze 的優先序 + 截止時間排程
+#
+# 分析請求不再先到先做：
+#   - 優先序：foreground（使用者正在看的分頁、手動擷取）先於 background（背景分頁自動擷取）
+#   - 截止時間：每個請求有自己的 deadline，排隊超過 deadline 的工作直接丟棄、不計算
+#   - 取消：擴充功能在分頁關閉 / 離開頁面時呼叫 /cancel，排隊中的工作不再執行，
+#           執行中的工作在呼叫 LLM 前的檢查點停止，等待中的 HTTP 請求立即返回
+#
+# 同一優先序內依 deadline 先後處理（EDF），deadline 相同再依送達順序。
+
+import heapq
+import itertools
+import os
+import threading
+import time
+import uuid
+
+PRIORITY_FOREGROUND = 0
+PRIORITY_BACKGROUND = 1
+PRIORITIES = {"foreground": PRIORITY_FOREGROUND, "background": PRIORITY_BACKGROUND}
+
+# 同時執行的分析數（LLM 多半只有一個實例，預設 2：一個跑 LLM 時另一個仍可處理規則 / 模型判定）
+WORKERS = int(os.environ.get("ANALYZE_WORKERS", 2))
+# 預設截止時間（秒）；客戶端可用 X-Analyze-Deadline（毫秒）縮短，但不能超過上限
+DEFAULT_DEADLINE = {
+    PRIORITY_FOREGROUND: float(os.environ.get("ANALYZE_DEADLINE_FOREGROUND", 60)),
+    PRIORITY_BACKGROUND: float(os.environ.get("ANALYZE_DEADLINE_BACKGROUND", 20)),
+}
+MAX_DEADLINE = float(os.environ.get("ANALYZE_DEADLINE_MAX", 120))
+
+
+class JobDropped(Exception):
+    """工作沒有完成：被取消（cancelled）或超過截止時間（expired）。"""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+        if reason == "cancelled":
+            self.message = "分析已取消"
+            self.status = 409
+        else:
+            self.message = "分析等待逾時，已略過"
+            self.status = 503
+
+
+class Job:
+    def __init__(self, fn, request_id: str, priority: int, deadline: float):
+        self.fn = fn
+        self.request_id = request_id
+        self.priority = priority
+        self.deadline = deadline
+        self.submitted = time.monotonic()
+        self.started = None   # 開始執行的時間（仍在排隊時為 None）
+        self.finished = None
+        self.state = "queued"  # queued / running / done / cancelled / expired / failed
+        self.result = None
+        self.error = None
+        self._done = threading.Event()
+
+    def checkpoint(self):
+        """執行中的工作在昂貴步驟前呼叫；已取消或逾時就丟出 JobDropped 停止計算。"""
+        if self.state == "cancelled":
+            raise JobDropped("cancelled")
+        if time.monotonic() > self.deadline:
+            raise JobDropped("expired")
+
+    def wait(self):
+        """等待工作結束並回傳結果；取消 / 逾時丟出 JobDropped，分析失敗則重新丟出原本的例外。"""
+        self._done.wait()
+        if self.state in ("cancelled", "expired"):
+            raise JobDropped(self.state)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def _finish(self, state: str):
+        if self.state != "cancelled":
+            self.state = state
+        self.finished = time.monotonic()
+        self._done.set()
+
+
+class AnalysisScheduler:
+    def __init__(self, workers: int = WORKERS):
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._jobs = {}  # request_id → Job（排隊中或執行中）
+        self.stats = {"submitted": 0, "completed": 0, "expired": 0, "cancelled": 0, "failed": 0}
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"analyze-worker-{i}", daemon=True)
+            for i in range(max(1, workers))
+        ]
+        for t in self._threads:
+            t.start()
+
+    def submit(self, fn, request_id: str | None = None, priority: int = PRIORITY_FOREGROUND,
+               deadline_ms: int | None = None) -> Job:
+        """排入一個分析工作；fn 會以 job.checkpoint 為唯一參數呼叫。"""
+        budget = DEFAULT_DEADLINE[priority]
+        if deadline_ms is not None and deadline_ms > 0:
+            budget = min(deadline_ms / 1000, MAX_DEADLINE)
+        job = Job(fn, request_id or uuid.uuid4().hex, priority, time.monotonic() + budget)
+
+        with self._cond:
+            old = self._jobs.get(job.request_id)
+            if old is not None:
+                # 同一個 request id 重送：舊的那份不再需要
+                self._cancel_locked(old)
+            self._jobs[job.request_id] = job
+            heapq.heappush(self._heap, (job.priority, job.deadline, next(self._seq), job))
+            self.stats["submitted"] += 1
+            self._cond.notify()
+        return job
+
+    def cancel(self, request_id: str) -> bool:
+        with self._cond:
+            job = self._jobs.get(request_id)
+            if job is None:
+                return False
+            self._cancel_locked(job)
+            return True
+
+    def _cancel_locked(self, job: Job):
+        if job.state in ("queued", "running"):
+            # 排隊中的項目留在 heap 裡，取出時略過（lazy deletion）
+            job.state = "cancelled"
+            self.stats["cancelled"] += 1
+            job._done.set()
+        if self._jobs.get(job.request_id) is job:
+            del self._jobs[job.request_id]
+
+    def queue_depth(self) -> dict:
+        with self._cond:
+            depth = {name: 0 for name in PRIORITIES}
+            names = {v: k for k, v in PRIORITIES.items()}
+            for _, _, _, job in self._heap:
+                if job.state == "queued":
+                    depth[names[job.priority]] += 1
+            return depth
+
+    def running_count(self) -> int:
+        with self._cond:
+            return sum(1 for job in self._jobs.values() if job.state == "running")
+
+    def _next_job(self) -> Job:
+        with self._cond:
+            while True:
+                while not self._heap:
+                    self._cond.wait()
+                _, deadline, _, job = heapq.heappop(self._heap)
+                if job.state == "cancelled":
+                    continue
+                if time.monotonic() > deadline:
+                    # 排隊太久：結果已經沒人需要，直接丟棄
+                    job.state = "expired"
+                    self.stats["expired"] += 1
+                    self._jobs.pop(job.request_id, None)
+                    job._done.set()
+                    waited = time.monotonic() - job.submitted
+                    print(f"[SCHED] 逾時丟棄 {job.request_id}（等待 {waited:.1f} 秒）")
+                    continue
+                job.state = "running"
+                job.started = time.monotonic()
+                return job
+
+    def _worker(self):
+        while True:
+            job = self._next_job()
+            try:
+                job.result = job.fn(job.checkpoint)
+                state = "done"
+            except JobDropped as e:
+                state = e.reason
+            except Exception as e:
+                job.error = e
+                state = "failed"
+
+            with self._cond:
+                if job.state != "cancelled":
+                    key = {"done": "completed"}.get(state, state)
+                    self.stats[key] += 1
+                if self._jobs.get(job.request_id) is job:
+                    del self._jobs[job.request_id]
+                job._finish(state)
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> AnalysisScheduler:
+    """第一次使用時才建立 worker 執行緒（reloader 的監看程序不會用到）。"""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = AnalysisScheduler()
+                print(f"[SCHED] 排程器啟動（{WORKERS} 個 worker）")
+    return _scheduler
+
+
+def parse_priority(value: str | None) -> int:
+    """X-Analyze-Priority 標頭；未提供時視為 foreground（舊版客戶端維持原本行為）。"""
+    return PRIORITIES.get((value or "").strip().lower(), PRIORITY_FOREGROUND)
@@ -0,0 +1,175 @@
+# script_table.py — 以 OpenCC 字典建立的字元分類表（簡體 / 繁體 / 中文 / 拉丁字母）
+#
+# detect_language_anomaly 原本只認得 23 個寫死的簡體字，且中文、英文各用一次 regex 全文掃描。
+# 這裡在第一次使用時讀取 OpenCC 的單字字典：
+#   - TSCharacters（繁→簡）的候選字 = 合法的簡體字
+#   - STCharacters（簡→繁）的候選字 = 合法的繁體字
+# 只出現在簡體候選、不出現在繁體候選的字才算「簡體專用」（们、这…）；「后」「面」「里」這類
+# 繁體也照常使用的字兩邊都有，不會被誤判。反之即為「繁體專用」。
+# 分類表是以 code point 為索引的 uint8 陣列：文字編碼成 UTF-32 後以 NumPy 檢視成 code point 陣列，
+# 查表 + bincount 一次算出四類字元數（20 KB 文字約 0.2 ms，原本的逐字判斷 + 兩次 regex 約 5 ms）。
+#
+# 字典來源（依序）：OPENCC_DATA_DIR 目錄、已安裝的 opencc 套件附帶的字典。
+# 支援 OpenCC 原始的文字字典（*.txt）與套件內的二進位字典（*.ocd2，只讀取其中的候選字清單，
+# 不需要 marisa-trie）。都找不到時退回原本的 23 字清單。
+
+import importlib.util
+import os
+import struct
+import threading
+
+import numpy as np
+
+OPENCC_DATA_DIR = os.environ.get("OPENCC_DATA_DIR", "")
+
+# 找不到 OpenCC 字典時使用
+FALLBACK_SIMPLIFIED = "们这对机国观产层战领举办权进体为发过学说语讲"
+
+# 分類代碼（0 = 其他）；*_EXT 是落在 U+4E00～U+9FA5 之外（擴充區、相容字）的簡體 / 繁體專用字，
+# 只計入簡繁字數，不計入中文字數，讓中文字數與原本的 [\u4e00-\u9fa5] 一致
+OTHER, SIMPLIFIED, TRADITIONAL, CJK, LATIN, SIMPLIFIED_EXT, TRADITIONAL_EXT = range(7)
+CJK_FIRST, CJK_LAST = 0x4E00, 0x9FA5
+# 分類表涵蓋 BMP 與 CJK 擴充 B～F（0x2FFFF 以下）；更高的 code point 一律視為其他
+TABLE_SIZE = 0x30000
+
+_OCD2_HEADER = b"OPENCC_MARISA_0.2.5"
+
+_lock = threading.Lock()
+_table = None
+_source = None
+
+
+def _data_dirs() -> list:
+    dirs = [OPENCC_DATA_DIR] if OPENCC_DATA_DIR else []
+    # 只定位套件目錄，不匯入 opencc（匯入會載入 C 擴充模組）
+    spec = importlib.util.find_spec("opencc")
+    if spec is not None and spec.submodule_search_locations:
+        for base in spec.submodule_search_locations:
+            dirs.append(os.path.join(base, "clib", "share", "opencc"))
+            dirs.append(os.path.join(base, "dictionary"))  # opencc-python-reimplemented
+    return [d for d in dirs if os.path.isdir(d)]
+
+
+def _read_txt(path: str) -> list:
+    """OpenCC 文字字典：每行「字<TAB>候選1 候選2…」。"""
+    values = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            parts = line.rstrip("\n").split("\t")
+            if len(parts) >= 2:
+                values.append(parts[1].split())
+    return values
+
+
+def _read_ocd2(path: str) -> list:
+    """OpenCC 二進位字典：檔頭 + marisa trie + 候選字清單。
+
+    候選字清單位在檔案尾端：項目數、字串區長度、以 \\0 結尾的字串區，再來是每個項目的
+    「候選數（uint16）+ 每個候選的位元組長度（uint16）」。trie 的長度不固定，
+    因此從檔頭之後逐一嘗試，找到剛好解析到檔尾的位置。
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if not data.startswith(_OCD2_HEADER):
+        raise ValueError("不是 ocd2 檔案")
+    size = len(data)
+    for pos in range(len(_OCD2_HEADER), size - 8):
+        items, total = struct.unpack_from("<II", data, pos)
+        if not (0 < items < size and 0 < total < size - pos):
+            continue
+        values = _parse_values(data, pos + 8, items, total)
+        if values is not None:
+            return values
+    raise ValueError("找不到候選字清單")
+
+
+def _parse_values(data: bytes, pos: int, items: int, total: int) -> list | None:
+    size = len(data)
+    buf_end = pos + total
+    cursor = buf_end
+    offset = pos
+    values = []
+    for _ in range(items):
+        if cursor + 2 > size:
+            return None
+        (count,) = struct.unpack_from("<H", data, cursor)
+        cursor += 2
+        if cursor + 2 * count > size:
+            return None
+        lengths = struct.unpack_from(f"<{count}H", data, cursor)
+        cursor += 2 * count
+        entry = []
+        for n in lengths:
+            if n == 0 or offset + n > buf_end or data[offset + n - 1] != 0:
+                return None
+            entry.append(data[offset:offset + n - 1])
+            offset += n
+        values.append(entry)
+    if cursor != size or offset != buf_end:
+        return None
+    try:
+        return [[v.decode("utf-8") for v in entry] for entry in values]
+    except UnicodeDecodeError:
+        return None
+
+
+def _load_candidates(name: str) -> tuple:
+    """回傳 (字典中所有候選字, 來源路徑)；找不到時 (None, None)。"""
+    for d in _data_dirs():
+        for ext, reader in ((".txt", _read_txt), (".ocd2", _read_ocd2)):
+            path = os.path.join(d, name + ext)
+            if not os.path.exists(path):
+                continue
+            try:
+                values = reader(path)
+            except (OSError, ValueError) as e:
+                print(f"[SCRIPT] 無法讀取 {path}：{e}")
+                continue
+            chars = {v for entry in values for v in entry if len(v) == 1}
+            return chars, path
+    return None, None
+
+
+def _build() -> tuple:
+    simplified, ts_path = _load_candidates("TSCharacters")
+    traditional, st_path = _load_candidates("STCharacters")
+    if simplified and traditional:
+        simp_only = simplified - traditional
+        trad_only = traditional - simplified
+        source = f"{os.path.basename(ts_path)} + {os.path.basename(st_path)}"
+    else:
+        simp_only, trad_only = set(FALLBACK_SIMPLIFIED), set()
+        source = "內建清單"
+
+    table = np.zeros(TABLE_SIZE + 1, dtype=np.uint8)  # 最後一格給超出範圍的 code point
+    table[CJK_FIRST:CJK_LAST + 1] = CJK
+    table[ord("A"):ord("Z") + 1] = LATIN
+    table[ord("a"):ord("z") + 1] = LATIN
+    for chars, code, ext in ((simp_only, SIMPLIFIED, SIMPLIFIED_EXT),
+                             (trad_only, TRADITIONAL, TRADITIONAL_EXT)):
+        for cp in (ord(c) for c in chars if ord(c) < TABLE_SIZE):
+            table[cp] = code if CJK_FIRST <= cp <= CJK_LAST else ext
+    print(f"[SCRIPT] 字元分類表：簡體專用 {len(simp_only)} 字、繁體專用 {len(trad_only)} 字（{source}）")
+    return table, source
+
+
+def get_table() -> np.ndarray:
+    global _table, _source
+    if _table is None:
+        with _lock:
+            if _table is None:
+                _table, _source = _build()
+    return _table
+
+
+def count_scripts(text: str) -> dict:
+    """回傳 {"simplified", "traditional", "cjk", "latin"}；cjk 只算 U+4E00～U+9FA5（含其中的簡體 / 繁體專用字）。"""
+    table = get_table()
+    cps = np.frombuffer(text.encode("utf-32-le", "surrogatepass"), dtype=np.uint32)
+    counts = np.bincount(table[np.minimum(cps, TABLE_SIZE)], minlength=7)
+    return {
+        "simplified": int(counts[SIMPLIFIED] + counts[SIMPLIFIED_EXT]),
+        "traditional": int(counts[TRADITIONAL] + counts[TRADITIONAL_EXT]),
+        "cjk": int(counts[CJK] + counts[SIMPLIFIED] + counts[TRADITIONAL]),
+        "latin": int(counts[LATIN]),
+    }
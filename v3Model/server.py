@@ -1,12 +1,29 @@
 # server.py
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g
 from flask_cors import CORS
 import time
 import datetime
+import hmac
 import os
+import threading
 
-from html_utils import extract_relevant_html, extract_urls
+from html_utils import (
+    parse_html,
+    extract_relevant_html,
+    extract_urls,
+    has_html_root,
+    looks_like_html,
+    normalize_urls,
+)
+from payload import (
+    PayloadError,
+    read_body,
+    load_analyze_payload,
+    MAX_BODY_BYTES,
+    MAX_LINKS,
+    PROTOCOL_VERSION,
+)
 from blacklist import (
     load_blacklist,
     is_blacklisted,
@@ -16,21 +33,245 @@ from blacklist import (
     get_user_blacklist,
     clear_user_blacklist
 )
-from analyzer import analyze_deep
+from blacklist_filter import get_filter_update
+from verdict_cache import store_verdict, get_verdict, VERDICT_TTL
+from scheduler import get_scheduler, parse_priority, JobDropped, WORKERS
+import admission
+import precheck
+import replication
+import profiler
+from profiler import stage
+
+# analyzer 會帶入 langchain / openai / pydantic / numpy，匯入要數秒；
+# 不在模組載入時匯入，改由背景執行緒預熱，黑名單相關路由可立即回應。
+# 效能剖析：python startup_profile.py
+_analyzer = None
+_analyzer_lock = threading.Lock()
+
+def get_analyzer():
+    """取得 analyzer 模組；第一次呼叫時才匯入（預熱未完成時會等待）。"""
+    global _analyzer
+    if _analyzer is None:
+        with _analyzer_lock:
+            if _analyzer is None:
+                t = time.time()
+                import analyzer
+                _analyzer = analyzer
+                print(f"[WARMUP] analyzer 匯入完成（{time.time() - t:.2f} 秒）")
+    return _analyzer
+
+def _warm_up():
+    t = time.time()
+    try:
+        get_analyzer().warm_up()
+        print(f"[WARMUP] 分析器預熱完成（{time.time() - t:.2f} 秒）")
+    except Exception as e:
+        # 預熱失敗不影響服務，第一個 /analyze 請求會再嘗試
+        print("[WARMUP] 分析器預熱失敗:", e)
+
+_warm_up_started = False
+
+def start_warm_up():
+    """啟動背景預熱；重複呼叫不會再開一個執行緒。"""
+    global _warm_up_started
+    with _analyzer_lock:
+        if _warm_up_started:
+            return
+        _warm_up_started = True
+    threading.Thread(target=_warm_up, name="analyzer-warm-up", daemon=True).start()
 
 app = Flask(__name__)
+app.config["MAX_CONTENT_LENGTH"] = MAX_BODY_BYTES
 CORS(app)
 
-if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+def start_services():
     load_blacklist("phishtank.csv")
+    replication.start()
+    if os.environ.get("ANALYZER_WARM_UP", "1") != "0":
+        start_warm_up()
+
+# debug reloader 的監看程序不處理請求，只在實際服務的子程序載入資料與預熱
+if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+    start_services()
 
 def log(title):
     print("\n==========", title, "==========")
 
+@app.before_request
+def _profile_begin():
+    # 只有 /debug/profile 開啟擷取時才有作用，平常只是一次旗標判斷
+    if profiler.enabled() and request.endpoint == "analyze_route":
+        g.profile_session = profiler.begin_request()
+
+@app.teardown_request
+def _profile_end(exc):
+    session = g.pop("profile_session", None)
+    if session is not None:
+        profiler.end_request(session)
+
+@app.errorhandler(413)
+def payload_too_large(e):
+    # 超過 MAX_CONTENT_LENGTH 時 werkzeug 會在讀取前就拒絕，統一回 JSON 讓前端好判斷
+    return jsonify({"success": False, "message": f"請求內容過大（上限 {MAX_BODY_BYTES} bytes）"}), 413
+
 @app.route("/user_blacklist", methods=["GET"])
 def get_blacklist_route():
     return jsonify({"success": True, "list": get_user_blacklist()})
 
+@app.route("/blacklist_filter", methods=["GET"])
+def blacklist_filter_route():
+    # 擴充功能帶上目前持有的 epoch / 版本，只回傳需要更新的部分
+    update = get_filter_update(
+        request.args.get("epoch"),
+        request.args.get("official", type=int),
+        request.args.get("user", type=int),
+    )
+    return jsonify({"success": True, **update})
+
+def _with_verdict_headers(resp, version, ttl):
+    resp.set_etag(version)
+    resp.cache_control.private = True
+    resp.cache_control.max_age = ttl
+    return resp
+
+@app.route("/verdict", methods=["GET"])
+def verdict_route():
+    # 擴充功能快取過期時帶 If-None-Match 重新驗證，結果未變就回 304
+    url = (request.args.get("url") or "").strip()
+    if not url:
+        return jsonify({"success": False, "message": "網址不可為空"}), 400
+
+    # 黑名單可能在判定之後才加入，每次都重新查
+    for u in [url, *normalize_urls([url])]:
+        if is_blacklisted(u):
+            source = check_blacklist_source(u)
+            return jsonify({"success": True, "result": {
+                "is_potential_phishing": True,
+                "is_blacklisted": True,
+                "blacklist_source": source,
+                "explanation": f"偵測到黑名單惡意網址：{u}",
+            }})
+
+    entry = get_verdict(url)
+    if entry is None:
+        return jsonify({"success": False, "message": "沒有此網址的判定結果"}), 404
+
+    version = entry["version"]
+    if version in request.if_none_match:
+        resp = app.response_class(status=304)
+    else:
+        resp = jsonify({"success": True, "result": {
+            **entry["result"],
+            "is_blacklisted": False,
+            "blacklist_source": None,
+            "verdict_version": version,
+            "cache_ttl": VERDICT_TTL,
+        }})
+    return _with_verdict_headers(resp, version, VERDICT_TTL)
+
+@app.route("/sync", methods=["GET"])
+def sync_route():
+    # 其他節點拉取使用者黑名單異動與新判定（見 replication.py）
+    if replication.SYNC_TOKEN and not hmac.compare_digest(
+        request.headers.get("X-Sync-Token", ""), replication.SYNC_TOKEN
+    ):
+        return jsonify({"success": False, "message": "同步權杖錯誤"}), 403
+    payload = replication.sync_payload(
+        request.args.get("since", type=int),
+        log_id=request.args.get("log_id"),
+        vsince=request.args.get("vsince", type=int),
+        vepoch=request.args.get("vepoch"),
+        snapshot=request.args.get("snapshot") == "1",
+    )
+    return jsonify({"success": True, **payload})
+
+def _is_admin() -> bool:
+    token = request.headers.get("X-Admin-Token", "")
+    auth = request.headers.get("Authorization", "")
+    if not token and auth.startswith("Bearer "):
+        token = auth[7:]
+    return bool(token) and hmac.compare_digest(token, profiler.ADMIN_TOKEN)
+
+@app.route("/debug/profile", methods=["GET", "POST", "DELETE"])
+def debug_profile_route():
+    # 未設定 ADMIN_TOKEN 時整個端點不存在
+    if not profiler.ADMIN_TOKEN:
+        return jsonify({"success": False, "message": "未啟用"}), 404
+    if not _is_admin():
+        return jsonify({"success": False, "message": "需要管理者權杖"}), 403
+
+    if request.method == "POST":
+        # {"mode": "sample" | "cprofile", "requests": N, "seconds": T, "interval_ms": 5}
+        data = request.json or {}
+        try:
+            session = profiler.start(
+                mode=data.get("mode", "sample"),
+                requests=data.get("requests"),
+                seconds=data.get("seconds"),
+                interval_ms=data.get("interval_ms", profiler.DEFAULT_INTERVAL_MS),
+            )
+        except profiler.ProfilerBusy as e:
+            return jsonify({"success": False, "message": str(e)}), 409
+        except (TypeError, ValueError) as e:
+            return jsonify({"success": False, "message": f"參數錯誤：{e}"}), 400
+        return jsonify({"success": True, "session": session.summary()})
+
+    if request.method == "DELETE":
+        session = profiler.stop()
+        if session is None:
+            return jsonify({"success": False, "message": "沒有擷取紀錄"}), 404
+        return jsonify({"success": True, "session": session.summary()})
+
+    session = profiler.current()
+    if session is None:
+        return jsonify({"success": False, "message": "沒有擷取紀錄"}), 404
+
+    fmt = request.args.get("format", "json")
+    sort = request.args.get("sort", "cumulative")
+    if fmt == "pstats" and sort not in profiler.SORT_KEYS:
+        return jsonify({"success": False, "message": f"sort 必須為 {' / '.join(profiler.SORT_KEYS)}"}), 400
+
+    # ?wait=1：等擷取結束再回傳，最多等 MAX_WAIT_SECONDS 秒（還沒結束時 running 仍為 true，可再輪詢）
+    if request.args.get("wait") == "1":
+        session.done.wait(profiler.MAX_WAIT_SECONDS)
+
+    if fmt == "collapsed":
+        return app.response_class(profiler.collapsed(session), mimetype="text/plain")
+    if fmt == "speedscope":
+        resp = jsonify(profiler.speedscope(session))
+        resp.headers["Content-Disposition"] = f'attachment; filename="profile-{session.id}.speedscope.json"'
+        return resp
+    if fmt == "pstats":
+        return app.response_class(profiler.cprofile_text(session, sort=sort), mimetype="text/plain")
+    return jsonify({"success": True, "session": session.summary()})
+
+@app.route("/precheck", methods=["POST"])
+def precheck_route():
+    # 導航前預檢連結目標（黑名單 + 網址規則 + URL 模型，不抓頁面、不呼叫 LLM）
+    data = request.json or {}
+    urls = data.get("urls") or ([data["url"]] if data.get("url") else [])
+    urls = [u.strip() for u in urls if isinstance(u, str) and u.strip().startswith(("http://", "https://"))]
+    if not urls:
+        return jsonify({"success": False, "message": "網址不可為空"}), 400
+    with stage("precheck"):
+        results = precheck.precheck_urls(urls[:precheck.MAX_PRECHECK_URLS])
+    return jsonify({"success": True, "results": results, "ttl": precheck.PRECHECK_TTL})
+
+@app.route("/metrics", methods=["GET"])
+def metrics_route():
+    # 准入 / 降載 / 排程器的計數器（見 admission.py、scheduler.py）
+    scheduler = get_scheduler()
+    return jsonify({
+        "success": True,
+        "admission": admission.snapshot(scheduler),
+        "scheduler": {
+            **scheduler.stats,
+            "workers": WORKERS,
+            "running": scheduler.running_count(),
+            "queue_depth": scheduler.queue_depth(),
+        },
+    })
+
 @app.route("/add_blacklist", methods=["POST"])
 def add_blacklist_route():
     data = request.json or {}
@@ -55,38 +296,143 @@ def handle_clear_blacklist():
         return jsonify({"success": True, "message": "使用者黑名單已全部清空"})
     else:
         return jsonify({"success": False, "message": "清空失敗，請檢查伺服器日誌"})
+@app.route("/cancel", methods=["POST"])
+def cancel_route():
+    # 擴充功能在分頁關閉或離開頁面時取消尚未完成的分析
+    data = request.json or {}
+    ids = data.get("request_ids") or ([data["request_id"]] if data.get("request_id") else [])
+    if not ids:
+        return jsonify({"success": False, "message": "request_id 不可為空"}), 400
+    scheduler = get_scheduler()
+    cancelled = sum(1 for rid in ids if scheduler.cancel(str(rid)))
+    return jsonify({"success": True, "cancelled": cancelled})
+
 @app.route("/analyze", methods=["POST"])
 def analyze_route():
     t0 = time.time()
-    data = request.json or {}
-    text = data.get("text", "")
+    cid = admission.client_id(request.headers.get("X-Client-Id"), request.remote_addr)
+    try:
+        with stage("payload"):
+            raw = read_body(request.stream, request.content_length)
+            data = load_analyze_payload(
+                raw,
+                content_type=request.content_type,
+                content_encoding=request.headers.get("Content-Encoding"),
+                client=cid,
+            )
+    except PayloadError as e:
+        log("請求內容被拒絕")
+        print(f"原因：{e.message}")
+        body = {"success": False, "message": e.message}
+        if e.reason:
+            body["reason"] = e.reason
+        return jsonify(body), e.status
+    text = data["text"]
+    structured = data["version"] == PROTOCOL_VERSION
 
     now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     log("收到分析請求")
     print(f"時間：{now}")
     print(f"IP  ：{request.remote_addr}")
     print(f"長度：{len(text)}")
+    print(f"格式：v{data['version']}{'（增量）' if data.get('delta') else ''}（{request.content_length or 0} bytes）")
+
+    if structured:
+        # 結構化請求：URL 與連結已由擴充功能拆好，不需再從文字萃取
+        is_html = False
+        urls = normalize_urls([data["url"], *data["links"]], max_count=MAX_LINKS)
+    else:
+        # 同一份 HTML 只解析一次，extract_urls 與 extract_relevant_html 共用
+        with stage("parse_html"):
+            is_html = has_html_root(text)
+            page = None
+            if is_html or looks_like_html(text):
+                page = parse_html(text, max_links=MAX_LINKS)
+
+            urls = extract_urls(text, max_count=MAX_LINKS, page=page, max_scan=MAX_LINKS)
 
-    urls = extract_urls(text)
+    # 黑名單以原始字串比對，正規化會補上結尾的 "/"：頁面原始網址與去掉 "/" 的版本也一起檢查
+    candidates = [data["url"]] if structured and data["url"] else []
     for u in urls:
-        if is_blacklisted(u):
-            source = check_blacklist_source(u)
-            elapsed = round(time.time() - t0, 2)
-            log("黑名單命中 → 直接返回")
-            print(f"黑名單網址：{u}")
-            print(f"來源：{source}")
-            print(f"耗時：{elapsed} 秒")
+        candidates.append(u)
+        if u.endswith("/"):
+            candidates.append(u[:-1])
+    with stage("blacklist"):
+        u = next((c for c in candidates if is_blacklisted(c)), None)
+    if u is not None:
+        source = check_blacklist_source(u)
+        elapsed = round(time.time() - t0, 2)
+        log("黑名單命中 → 直接返回")
+        print(f"黑名單網址：{u}")
+        print(f"來源：{source}")
+        print(f"耗時：{elapsed} 秒")
 
-            return jsonify({
-                "is_potential_phishing": True,
-                "is_blacklisted": True,
-                "blacklist_source": source,   # ✅ official / user
-                "explanation": f"偵測到黑名單惡意網址：{u}",
-                "elapsed_time": elapsed
-            })
+        return jsonify({
+            "is_potential_phishing": True,
+            "is_blacklisted": True,
+            "blacklist_source": source,   # ✅ official / user
+            "explanation": f"偵測到黑名單惡意網址：{u}",
+            "elapsed_time": elapsed
+        })
 
-    cleaned = extract_relevant_html(text) if "<html" in text.lower() else text
-    result = analyze_deep(cleaned)
+    if structured:
+        forms = data["forms"]
+    else:
+        forms = page.forms if page is not None else None
+
+    # 准入控制：客戶端送太快、排隊太多或預估等待過長時不排隊，改回快速判定（degraded）
+    scheduler = get_scheduler()
+    priority = parse_priority(request.headers.get("X-Analyze-Priority"))
+    deadline_ms = request.headers.get("X-Analyze-Deadline", type=int)
+    ticket = admission.admit(
+        cid,
+        priority,
+        scheduler,
+        deadline_ms=deadline_ms,
+    )
+    if not ticket.admitted:
+        with stage("shed"):
+            result = get_analyzer().analyze_quick(urls, forms)
+        result["degraded"] = True
+        result["degraded_reason"] = ticket.reason
+        result["is_blacklisted"] = False
+        result["blacklist_source"] = None
+        log("伺服器忙碌 → 快速判定")
+        print(f"客戶端：{ticket.client_id}（{ticket.message}，預估等待 {ticket.predicted_wait:.1f} 秒）")
+        print(f"分析結果：{result['is_potential_phishing']}")
+        # 降載結果不寫入判定快取，下次擷取會重新完整分析
+        return jsonify(result)
+
+    analyzer = get_analyzer()
+    analyze_deep = analyzer.analyze_deep
+    # 頁面與連結主機的 DNS 查詢先送出，與排隊等待重疊（dns_intel 隨 analyzer 載入）
+    analyzer.prefetch_urls(urls)
+    if structured:
+        visible = f"{data['title']}\n{text}" if data["title"] else text
+        run = lambda checkpoint: analyze_deep(
+            text, urls=urls, visible=visible, forms=forms, checkpoint=checkpoint
+        )
+    else:
+        cleaned = extract_relevant_html(page) if is_html else text
+        run = lambda checkpoint: analyze_deep(cleaned, urls=urls, forms=forms, checkpoint=checkpoint)
+
+    # 交給排程器：前景分頁 / 手動擷取優先，排隊超過截止時間或已取消的工作不計算
+    # （剖析中的請求由 profiler.follow 帶到 worker 執行緒繼續取樣）
+    job = scheduler.submit(
+        profiler.follow(run),
+        request_id=request.headers.get("X-Request-Id"),
+        priority=priority,
+        deadline_ms=deadline_ms,
+    )
+    try:
+        with stage("queue_wait"):
+            result = job.wait()
+    except JobDropped as e:
+        log("分析未執行")
+        print(f"請求：{job.request_id}（{e.reason}）")
+        return jsonify({"success": False, "message": e.message, "reason": e.reason}), e.status
+    finally:
+        admission.release(ticket, job)
 
     #非黑名單也要固定回這兩欄，讓前端好判斷
     result["is_blacklisted"] = False
@@ -103,8 +449,25 @@ def analyze_route():
     if result.get("similar_site_detection"):
         print(f"相似網站檢測：{result['similar_site_detection']}")
 
-    return jsonify(result)
+    # 結構化請求帶有頁面網址 → 記錄判定結果，讓擴充功能之後可用 ETag 重新驗證
+    cached = store_verdict(data["url"], result) if structured else None
+    if cached is None:
+        return jsonify(result)
+
+    version, ttl = cached
+    result["verdict_version"] = version
+    result["cache_ttl"] = ttl
+    return _with_verdict_headers(jsonify(result), version, ttl)
 
 if __name__ == "__main__":
-    print("Flask 後端啟動中（Debug Mode）...")
-    app.run(host="127.0.0.1", port=5000, debug=True, use_reloader=True)
+    error = replication.check_bind(replication.HOST)
+    if error:
+        raise SystemExit(f"[REPL] 拒絕啟動：{error}")
+    # Werkzeug 的互動式 debugger 可以執行任意程式碼：只在本機監聽時開啟 debug 與 reloader
+    debug = replication.is_loopback(replication.HOST)
+    if debug:
+        print("Flask 後端啟動中（Debug Mode）...")
+    else:
+        print(f"Flask 後端啟動中（監聽 {replication.HOST}，已關閉 Debug Mode）...")
+        start_services()
+    app.run(host=replication.HOST, port=replication.PORT, debug=debug, use_reloader=debug)
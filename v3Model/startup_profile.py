@@ -0,0 +1,132 @@
+# startup_profile.py — 伺服器啟動時間剖析
+#
+# 以 python -X importtime 匯入 server，整理出最花時間的模組與套件，
+# 並量測「程序啟動 → 第一個請求回應」與分析器背景預熱所需時間。
+#
+#   python startup_profile.py             # 摘要前 15 名
+#   python startup_profile.py --top 30
+#   python startup_profile.py --module analyzer   # 剖析其他模組（例如比較延遲載入前後）
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from collections import defaultdict
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# 在子程序內執行：模擬 reloader 子程序（載入黑名單、啟動預熱），量測第一個回應
+_FIRST_RESPONSE_SCRIPT = r"""
+import json, threading, time
+t0 = time.perf_counter()
+import server
+t_import = time.perf_counter()
+resp = server.app.test_client().get("/user_blacklist")
+t_first = time.perf_counter()
+warm = None
+if {wait_warm_up}:
+    # 等背景預熱執行緒跑完（匯入 analyzer + 規則、模型、字元表、LLM chain）
+    for t in threading.enumerate():
+        if t.name == "analyzer-warm-up":
+            t.join()
+    warm = time.perf_counter() - t0
+print("__RESULT__" + json.dumps({{
+    "import": t_import - t0,
+    "first_response": t_first - t0,
+    "status": resp.status_code,
+    "warm_up": warm,
+}}))
+"""
+
+
+def parse_importtime(stderr: str) -> list:
+    """解析 -X importtime 輸出，回傳 [(self_us, cumulative_us, depth, module)]。"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, rest = line.split(":", 1)
+        parts = rest.split("|")
+        if len(parts) != 3:
+            continue
+        try:
+            self_us, cum_us = int(parts[0]), int(parts[1])
+        except ValueError:
+            continue  # 標題列
+        name = parts[2].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((self_us, cum_us, depth, name.strip()))
+    return rows
+
+
+def summarize(rows: list, top: int) -> None:
+    total = sum(r[0] for r in rows)
+    print(f"匯入模組數：{len(rows)}，總匯入時間：{total / 1000:.0f} ms\n")
+
+    print(f"== 累計時間前 {top} 名的直接匯入（depth ≤ 1）==")
+    direct = sorted((r for r in rows if r[2] <= 1), key=lambda r: -r[1])
+    for self_us, cum_us, depth, name in direct[:top]:
+        print(f"{cum_us / 1000:8.1f} ms  {'  ' * depth}{name}")
+
+    print(f"\n== 各頂層套件自身時間合計（前 {top} 名）==")
+    by_pkg = defaultdict(int)
+    for self_us, _, _, name in rows:
+        by_pkg[name.split(".")[0]] += self_us
+    for pkg, us in sorted(by_pkg.items(), key=lambda kv: -kv[1])[:top]:
+        print(f"{us / 1000:8.1f} ms  {pkg:<24} {us * 100 / max(total, 1):5.1f}%")
+
+
+def measure_first_response(wait_warm_up: bool) -> dict | None:
+    # 使用者黑名單與複寫紀錄寫到暫存目錄，不動到原始碼目錄；不向其他節點同步
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(
+            os.environ,
+            WERKZEUG_RUN_MAIN="true",
+            USER_BLACKLIST_FILE=os.path.join(tmp, "user_blacklist.txt"),
+            REPLICATION_LOG=os.path.join(tmp, "replication_log.jsonl"),
+            PEERS="",
+        )
+        proc = subprocess.run(
+            [sys.executable, "-c", _FIRST_RESPONSE_SCRIPT.format(wait_warm_up=wait_warm_up)],
+            cwd=HERE, env=env, capture_output=True, text=True,
+        )
+    for line in proc.stdout.splitlines():
+        if line.startswith("__RESULT__"):
+            return json.loads(line[len("__RESULT__"):])
+    print(proc.stderr[-2000:])
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="伺服器啟動時間剖析")
+    parser.add_argument("--module", default="server", help="要剖析匯入時間的模組")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--no-warm-up", action="store_true", help="不等待分析器預熱完成")
+    args = parser.parse_args()
+
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {args.module}"],
+        cwd=HERE, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        print(proc.stderr[-2000:])
+        raise SystemExit(f"匯入 {args.module} 失敗")
+    summarize(parse_importtime(proc.stderr), args.top)
+
+    if args.module != "server":
+        return
+
+    print("\n== 啟動 → 第一個回應（/user_blacklist，含官方黑名單載入）==")
+    result = measure_first_response(wait_warm_up=not args.no_warm_up)
+    if result is None:
+        raise SystemExit("量測失敗")
+    print(f"匯入 server：{result['import'] * 1000:8.1f} ms")
+    print(f"第一個回應：{result['first_response'] * 1000:8.1f} ms（HTTP {result['status']}）")
+    if result["warm_up"] is not None:
+        print(f"預熱完成：{result['warm_up'] * 1000:8.1f} ms（背景預熱全部完成，不阻擋上面的回應）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+from types import SimpleNamespace
+
+import pytest
+
+import admission
+from admission import admit, client_id, release
+from scheduler import PRIORITY_BACKGROUND, PRIORITY_FOREGROUND
+
+
+class FakeScheduler:
+    def __init__(self, foreground=0, background=0, running=0):
+        self.depth = {"foreground": foreground, "background": background}
+        self.running = running
+
+    def queue_depth(self):
+        return dict(self.depth)
+
+    def running_count(self):
+        return self.running
+
+
+@pytest.fixture(autouse=True)
+def state(monkeypatch):
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(admission.time, "monotonic", lambda: clock.now)
+    monkeypatch.setattr(admission, "_clients", admission.OrderedDict())
+    monkeypatch.setattr(admission, "_counters", admission.Counter())
+    monkeypatch.setattr(admission, "_shed", admission.Counter())
+    monkeypatch.setattr(admission, "_wait_hist", [0] * (len(admission.WAIT_BUCKETS) + 1))
+    monkeypatch.setattr(admission, "_wait_total", 0.0)
+    monkeypatch.setattr(admission, "_wait_max", 0.0)
+    monkeypatch.setattr(admission, "_service_time", 5.0)
+    monkeypatch.setattr(admission, "WORKERS", 2)
+    monkeypatch.setattr(admission, "CLIENT_RATE", 0.5)
+    monkeypatch.setattr(admission, "CLIENT_BURST", 3)
+    monkeypatch.setattr(admission, "CLIENT_MAX_INFLIGHT", 100)
+    monkeypatch.setattr(admission, "SHED_QUEUE_DEPTH", 24)
+    monkeypatch.setattr(admission, "SHED_PREDICTED_WAIT", 20)
+    return clock
+
+
+def test_token_bucket_limits_and_refills(state):
+    idle = FakeScheduler()
+    tickets = [admit("c", PRIORITY_FOREGROUND, idle) for _ in range(4)]
+    assert [t.admitted for t in tickets] == [True, True, True, False]
+    assert tickets[-1].reason == "client_rate" and tickets[-1].message == "請求過於頻繁"
+    # 其他客戶端各有自己的桶子
+    assert admit("other", PRIORITY_FOREGROUND, idle).admitted
+
+    state.now += 2  # 0.5 token/秒 → 補回 1 個
+    assert admit("c", PRIORITY_FOREGROUND, idle).admitted
+    assert not admit("c", PRIORITY_FOREGROUND, idle).admitted
+
+
+def test_inflight_limit(monkeypatch):
+    monkeypatch.setattr(admission, "CLIENT_MAX_INFLIGHT", 2)
+    idle = FakeScheduler()
+    first = admit("c", PRIORITY_FOREGROUND, idle)
+    admit("c", PRIORITY_FOREGROUND, idle)
+    assert admit("c", PRIORITY_FOREGROUND, idle).reason == "client_inflight"
+    release(first)
+    release(first)  # 重複 release 不會多扣
+    assert admit("c", PRIORITY_FOREGROUND, idle).admitted
+    assert admit("c", PRIORITY_FOREGROUND, idle).reason == "client_inflight"
+
+
+def test_queue_depth_sheds_background_first():
+    busy = FakeScheduler(foreground=4, background=10, running=2)
+    # 背景門檻是前景的一半（12）；背景要算上全部排隊數
+    ticket = admit("bg", PRIORITY_BACKGROUND, busy)
+    assert not ticket.admitted and ticket.reason == "queue_depth"
+    assert admit("fg", PRIORITY_FOREGROUND, FakeScheduler(foreground=4, background=30)).admitted
+    assert admit("fg", PRIORITY_FOREGROUND, FakeScheduler(foreground=24)).reason == "queue_depth"
+
+
+def test_predicted_wait():
+    # 前景：(排隊 6 + 超出 worker 的執行數 1) × 5 秒 / 2 worker = 17.5 秒 < 20
+    sched = FakeScheduler(foreground=6, running=2)
+    ticket = admit("a", PRIORITY_FOREGROUND, sched)
+    assert ticket.admitted and ticket.predicted_wait == 17.5
+    # 背景門檻 10 秒
+    assert admit("b", PRIORITY_BACKGROUND, sched).reason == "predicted_wait"
+    # 截止時間比預估等待短：排了也只會逾時
+    assert admit("c", PRIORITY_FOREGROUND, sched, deadline_ms=10000).reason == "predicted_wait"
+
+
+def test_release_records_wait_and_service_time():
+    ticket = admit("a", PRIORITY_FOREGROUND, FakeScheduler())
+    job = SimpleNamespace(submitted=10.0, started=13.0, finished=23.0, state="done")
+    release(ticket, job)
+    snap = admission.snapshot(FakeScheduler())
+    assert snap["queue_wait"]["count"] == 1
+    assert snap["queue_wait"]["histogram"]["le_5"] == 1
+    # EWMA：5 + 0.2 × (10 - 5)
+    assert snap["service_time_ewma"] == 6.0
+    assert snap["clients_inflight"] == 0
+    assert snap["admitted_foreground"] == 1
+
+
+def test_shed_counters():
+    admit("a", PRIORITY_BACKGROUND, FakeScheduler(background=20))
+    snap = admission.snapshot()
+    assert snap["shed"] == 1
+    assert snap["shed_reasons"]["queue_depth"] == 1
+
+
+def test_client_id():
+    assert client_id(" ext-1 ", "1.2.3.4") == "id:ext-1"
+    assert client_id("x" * 100, None) == "id:" + "x" * admission.CLIENT_ID_MAX_LEN
+    assert client_id(None, "1.2.3.4") == "ip:1.2.3.4"
+    assert client_id("", None) == "ip:unknown"
@@ -0,0 +1,101 @@
+import json
+import os
+import shutil
+import subprocess
+
+import pytest
+
+import blacklist
+import blacklist_filter
+from blacklist_filter import BloomFilter, build_filter, get_filter_update
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BACKGROUND_JS = os.path.join(HERE, "..", "v3Extension", "extension-page_capture3-main", "background.js")
+
+URLS = [
+    "https://evil.example/login",
+    "http://釣魚.example/帳戶",
+    "https://a.example/?q=😀",
+    "https://b.example:8443/path#frag",
+]
+OTHERS = [f"https://safe{i}.example/" for i in range(2000)]
+
+
+def test_membership():
+    listed = URLS + [f"https://phish{i}.example/login" for i in range(1000)]
+    bf = build_filter(listed)
+    assert all(url in bf for url in listed)
+    # 誤判率 1e-6：2000 個不在名單的網址不應命中
+    assert not any(url in bf for url in OTHERS)
+
+
+def test_positions_are_distinct():
+    bf = BloomFilter.for_capacity(1000)
+    for url in URLS + OTHERS[:100]:
+        positions = list(bf._positions(url))
+        assert len(set(positions)) == bf.k
+
+
+def _js_filter_code() -> str:
+    with open(BACKGROUND_JS, encoding="utf-8-sig") as f:
+        source = f.read()
+    start = source.index("const CRC_TABLE")
+    end = source.index("function encodeBits")
+    return source[start:end]
+
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="沒有 node")
+def test_javascript_filter_agrees():
+    bf = build_filter(URLS, fp_rate=1e-3)
+    script = _js_filter_code() + """
+const input = JSON.parse(require("fs").readFileSync(0, "utf-8"));
+const filter = decodeFilter(input.filter);
+console.log(JSON.stringify({
+    positions: input.urls.map(u => [...filterPositions(filter, u)]),
+    has: input.urls.map(u => filterHas(filter, u)),
+}));
+"""
+    urls = URLS + OTHERS[:200]
+    out = subprocess.run(
+        ["node", "-e", script],
+        input=json.dumps({"filter": bf.to_dict(), "urls": urls}),
+        capture_output=True, text=True, encoding="utf-8", check=True,
+    )
+    result = json.loads(out.stdout)
+    assert result["positions"] == [list(bf._positions(u)) for u in urls]
+    assert result["has"] == [u in bf for u in urls]
+
+
+@pytest.fixture
+def lists(monkeypatch):
+    monkeypatch.setattr(blacklist, "OFFICIAL_BLACKLIST", set(URLS))
+    monkeypatch.setattr(blacklist, "OFFICIAL_VERSION", 7)
+    monkeypatch.setattr(blacklist, "USER_BLACKLIST", {"https://mine.example/"})
+    monkeypatch.setattr(blacklist, "USER_VERSION", 3)
+    monkeypatch.setattr(blacklist, "USER_CHANGES", [(2, "add", "https://old.example/"),
+                                                    (3, "add", "https://mine.example/")])
+    monkeypatch.setattr(blacklist_filter, "_official_cache", None)
+    monkeypatch.setattr(blacklist_filter, "_user_cache", None)
+
+
+def test_filter_update(lists, monkeypatch):
+    epoch = blacklist_filter.FILTER_EPOCH
+
+    first = get_filter_update(None, None, None)
+    assert first["official"]["version"] == 7 and "user" in first
+
+    same = get_filter_update(epoch, 7, 3)
+    assert "official" not in same and "user" not in same and same["user_add"] == []
+
+    added = get_filter_update(epoch, 7, 2)
+    assert added["user_add"] == ["https://mine.example/"]
+
+    # 有刪除時 Bloom filter 無法增量更新，改送完整的使用者過濾器
+    monkeypatch.setattr(blacklist, "USER_CHANGES", blacklist.USER_CHANGES + [(4, "delete", "https://mine.example/")])
+    monkeypatch.setattr(blacklist, "USER_VERSION", 4)
+    removed = get_filter_update(epoch, 7, 2)
+    assert "user_add" not in removed and removed["user"]["version"] == 4
+
+    # 伺服器重啟（epoch 不同）時一律重送
+    restarted = get_filter_update("old-epoch", 7, 4)
+    assert "official" in restarted and "user" in restarted
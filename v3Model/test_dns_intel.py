@@ -0,0 +1,111 @@
+import struct
+
+import pytest
+
+import dns_intel
+from dns_intel import DnsResult, build_query, parse_response
+
+
+def _name(host):
+    return b"".join(bytes([len(l)]) + l for l in host.encode().split(b".")) + b"\x00"
+
+
+def response(qid, host, answers=(), rcode=0, soa=None):
+    """組出 DNS 回應：answers 為 [(ip, ttl)]，soa 為 (ttl, minimum)。"""
+    flags = 0x8180 | rcode
+    data = struct.pack(">HHHHHH", qid, flags, 1, len(answers), 1 if soa else 0, 0)
+    data += _name(host) + struct.pack(">HH", 1, 1)
+    for ip, ttl in answers:
+        data += b"\xc0\x0c" + struct.pack(">HHIH", 1, 1, ttl, 4) + bytes(int(x) for x in ip.split("."))
+    if soa:
+        ttl, minimum = soa
+        rdata = _name("ns.example") + _name("admin.example") + struct.pack(">IIIII", 1, 2, 3, 4, minimum)
+        data += b"\xc0\x0c" + struct.pack(">HHIH", 6, 1, ttl, len(rdata)) + rdata
+    return data
+
+
+def test_build_query():
+    q = build_query("www.example.com", 0x1234)
+    assert q[:2] == b"\x12\x34"
+    assert q[12:] == b"\x03www\x07example\x03com\x00" + b"\x00\x01\x00\x01"
+
+
+def test_parse_answers_with_compression():
+    data = response(7, "example.com", [("93.184.216.34", 120), ("93.184.216.35", 60)])
+    rcode, answers, negative = parse_response(data, 7)
+    assert rcode == 0
+    assert answers == [("93.184.216.34", 120), ("93.184.216.35", 60)]
+    assert negative is None
+
+
+def test_parse_nxdomain_uses_soa_minimum():
+    rcode, answers, negative = parse_response(response(9, "nope.example", rcode=3, soa=(900, 60)), 9)
+    assert (rcode, answers, negative) == (3, [], 60)
+
+
+def test_parse_rejects_wrong_id_and_truncated_packets():
+    data = response(1, "example.com", [("1.2.3.4", 30)])
+    with pytest.raises(ValueError):
+        parse_response(data, 2)
+    with pytest.raises(ValueError):
+        parse_response(data[:-3], 1)
+    with pytest.raises(ValueError):
+        parse_response(b"\x00\x01", 1)
+
+
+def ok(ips, ttl=60):
+    return DnsResult("ok", tuple(ips), ttl)
+
+
+def test_fast_flux_needs_short_ttl_and_spread_answer():
+    spread = ["1.1.0.1", "2.2.0.1", "3.3.0.1", "4.4.0.1"]
+    assert dns_intel._is_fast_flux(ok(spread, ttl=60))
+    assert not dns_intel._is_fast_flux(ok(spread, ttl=3600))
+    assert not dns_intel._is_fast_flux(ok(["1.1.0.1", "1.1.0.2", "1.1.0.3", "1.1.0.4"]))
+
+
+@pytest.fixture
+def history(monkeypatch):
+    monkeypatch.setattr(dns_intel, "_history", dns_intel.OrderedDict())
+    monkeypatch.setattr(dns_intel, "_cache", dns_intel.OrderedDict())
+    clock = [1000.0]
+    monkeypatch.setattr(dns_intel.time, "time", lambda: clock[0])
+    return clock
+
+
+def test_cdn_rotation_is_not_new_ip_or_fast_flux(history):
+    # CDN 每次回傳不同網段的 IP：累積再多也不會被標記
+    for i in range(20):
+        history[0] += 600
+        result = dns_intel._remember("cdn.example", "ok", [(f"{10 + i}.{i}.0.1", 60)], 60)
+        assert result.new_ips == ()
+        assert not dns_intel._is_fast_flux(result)
+
+
+def test_stable_host_moving_to_new_range_is_flagged(history):
+    dns_intel._remember("bank.example", "ok", [("203.0.113.10", 300)], 300)
+    history[0] += dns_intel.NEW_IP_MIN_AGE + 1
+    assert dns_intel._remember("bank.example", "ok", [("203.0.113.11", 300)], 300).new_ips == ()
+    moved = dns_intel._remember("bank.example", "ok", [("198.51.100.7", 300)], 300)
+    assert moved.new_ips == ("198.51.100.7",)
+
+
+def test_history_expires(history):
+    dns_intel._remember("old.example", "ok", [("203.0.113.10", 300)], 300)
+    history[0] += dns_intel.HISTORY_WINDOW + 1
+    # 舊紀錄過期：等同第一次看到這個主機
+    assert dns_intel._remember("old.example", "ok", [("198.51.100.7", 300)], 300).new_ips == ()
+
+
+def test_analyze_urls_never_waits(history, monkeypatch):
+    scheduled = []
+    monkeypatch.setattr(dns_intel, "_schedule", scheduled.append)
+    dns_intel._cache["cached.example"] = DnsResult("ok", ("10.0.0.5",), 60, (), history[0] + 60)
+
+    report = dns_intel.analyze_urls(["https://page.example/", "https://cached.example/x"])
+    assert scheduled == [["page.example", "cached.example"]]
+    assert report.page is None and report.pending == 1
+    assert report.internal == [("cached.example", "10.0.0.5")]
+    text = report.text()
+    assert "page.example 尚未解析完成" in text
+    assert "內部或保留位址" in text
@@ -0,0 +1,117 @@
+import pytest
+
+import html_utils
+from html_utils import extract_relevant_html, extract_urls, parse_html
+
+PAGE = """<!DOCTYPE html>
+<html><head>
+<title> 登入 &amp; 驗證 </title>
+<meta name="description" content="帳戶驗證">
+<meta name="viewport" content="width=device-width">
+<script>var s = "<a href='https://script.example/'>不是連結</a>";</script>
+<style>.x { content: "隱藏樣式"; }</style>
+</head><body>
+<h1>請驗證您的帳戶</h1>
+<a href="https://a.example/login">登入</a>
+<a href=" https://a.example/login ">重複</a>
+<a href="/help">說明</a>
+<noscript>請開啟 JavaScript</noscript>
+<form action=" https://evil.example/post " method="POST">
+  <input type="text" name="user">
+  <input type="PASSWORD" name="pw">
+</form>
+<form action="/search"><input name="q"></form>
+<input type="password" name="pin">
+<p>最後一段文字</p>
+</body></html>"""
+
+
+@pytest.fixture(params=["stdlib", "lxml"])
+def backend(request, monkeypatch):
+    if request.param == "stdlib":
+        monkeypatch.setattr(html_utils, "_lxml_etree", None)
+    else:
+        etree = pytest.importorskip("lxml.etree")
+        monkeypatch.setattr(html_utils, "_lxml_etree", etree)
+    return request.param
+
+
+def test_parse_page(backend):
+    page = parse_html(PAGE)
+    assert page.title == "登入 & 驗證"
+    assert page.metas == ['<meta name="description" content="帳戶驗證"/>']
+    assert page.links == ["https://a.example/login", "/help"]
+    assert not page.truncated
+
+
+def test_script_and_style_text_is_skipped(backend):
+    text = parse_html(PAGE).text
+    assert "請驗證您的帳戶" in text and "最後一段文字" in text
+    for hidden in ("不是連結", "隱藏樣式", "請開啟 JavaScript", "script.example"):
+        assert hidden not in text
+    assert "https://script.example/" not in parse_html(PAGE).links
+
+
+def test_forms_and_standalone_password(backend):
+    assert parse_html(PAGE).forms == [
+        {"action": "https://evil.example/post", "method": "post", "password": True},
+        {"action": "/search", "method": "get", "password": False},
+        {"action": "", "method": "post", "password": True},
+    ]
+
+
+def test_backends_agree():
+    etree = pytest.importorskip("lxml.etree")
+    original = html_utils._lxml_etree
+    try:
+        html_utils._lxml_etree = None
+        stdlib = parse_html(PAGE)
+        html_utils._lxml_etree = etree
+        lxml = parse_html(PAGE)
+    finally:
+        html_utils._lxml_etree = original
+    assert lxml == stdlib
+
+
+def test_stops_early_on_large_page(backend, monkeypatch):
+    monkeypatch.setattr(html_utils, "_FEED_CHUNK", 1024)
+    links = "".join(f'<a href="https://x.example/{i}">連結 {i} 的說明文字</a>' for i in range(5000))
+    page = parse_html(f"<html><head><title>t</title></head><body>{links}</body></html>",
+                      max_links=10, max_text=100)
+    assert page.truncated
+    assert len(page.links) == 10
+    assert len(page.text) <= 100
+
+
+def test_max_chars_budget(backend):
+    filler = "<p>" + "字" * 5000 + "</p>"
+    page = parse_html("<html><body>" + filler * 10 + '<a href="https://late.example/">x</a></body></html>',
+                      max_text=10 ** 6, max_chars=20000)
+    assert page.truncated
+    assert page.links == []
+
+
+def test_extract_relevant_html():
+    summary = extract_relevant_html(parse_html(PAGE), max_length=3000)
+    assert summary.startswith("<title>登入 & 驗證</title>")
+    assert "<links>['https://a.example/login', '/help']</links>" in summary
+    assert len(extract_relevant_html(PAGE, max_length=50)) == 50
+
+
+def test_extract_urls_keeps_page_url_first():
+    text = "=== URL === https://page.example/login\n" + PAGE
+    urls = extract_urls(text, max_count=3)
+    # 超過 max_count 時截掉後面的網址，開頭的頁面網址一定保留
+    assert urls == ["https://page.example/login", "https://script.example/", "https://a.example/login"]
+    assert extract_urls(text, max_count=1) == ["https://page.example/login"]
+
+
+def test_extract_urls_normalizes_and_dedupes():
+    text = "見 www.Example.com:80/a 與 https://EXAMPLE.com:443 還有 http://www.example.com/a, javascript:void(0)"
+    assert extract_urls(text) == ["http://www.example.com/a", "https://example.com/"]
+
+
+def test_extract_urls_reuses_parsed_page(monkeypatch):
+    page = parse_html(PAGE)
+    monkeypatch.setattr(html_utils, "parse_html", lambda *a, **k: pytest.fail("不應重新解析"))
+    assert "https://a.example/login" in extract_urls(PAGE, page=page)
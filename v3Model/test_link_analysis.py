@@ -0,0 +1,127 @@
+import itertools
+import os
+
+import pytest
+
+import blacklist
+import link_analysis
+from link_analysis import analyze_links, blacklisted_hosts, site_of
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# 黑名單網域依名單版本快取：每次替換名單都換一個沒用過的版本號
+_versions = itertools.count(10 ** 6)
+
+
+@pytest.fixture
+def official(monkeypatch):
+    """以指定網址取代官方黑名單（並讓黑名單網域重新歸納）。"""
+    def use(urls):
+        monkeypatch.setattr(blacklist, "OFFICIAL_BLACKLIST", set(urls))
+        monkeypatch.setattr(blacklist, "OFFICIAL_VERSION", next(_versions))
+        monkeypatch.setattr(blacklist, "USER_BLACKLIST", set())
+        monkeypatch.setattr(blacklist, "USER_VERSION", next(_versions))
+    return use
+
+
+@pytest.fixture(autouse=True)
+def no_model(monkeypatch):
+    monkeypatch.setattr(link_analysis, "_model_probs", lambda hosts: None)
+
+
+def test_only_root_urls_mark_a_host(official):
+    official([
+        "https://evil-login.example/",
+        "http://bare-origin.example",
+        "https://evil-port.example:8443/",
+        "https://docs.example.org/forms/d/abc/viewform",
+    ])
+    hosts, _ = blacklisted_hosts()
+    assert hosts == {"evil-login.example", "bare-origin.example", "evil-port.example"}
+
+
+def test_safe_and_shared_hosts_are_never_blacklisted(official):
+    official([
+        "https://google.com/",
+        "https://drive.google.com/",
+        "https://forms.gle/",
+        "https://www.linkedin.com/",
+        "https://onedrive.live.com/",
+        "https://t.me/",
+        "https://someone.github.io/",
+        "https://bad-phish.example/",
+    ])
+    hosts, _ = blacklisted_hosts()
+    assert hosts == {"bad-phish.example"}
+
+
+@pytest.mark.skipif(not os.path.exists(os.path.join(HERE, "phishtank.csv")), reason="沒有 phishtank.csv")
+def test_phishtank_does_not_blacklist_common_platforms(official):
+    import csv
+
+    with open(os.path.join(HERE, "phishtank.csv"), encoding="utf-8") as f:
+        official([row["url"].strip() for row in csv.DictReader(f) if row.get("url")])
+    hosts, _ = blacklisted_hosts()
+    for host in ("google.com", "drive.google.com", "forms.gle", "www.linkedin.com",
+                 "onedrive.live.com", "1drv.ms", "storage.googleapis.com", "t.me", "wa.me"):
+        assert host not in hosts
+
+
+def test_user_blacklist_keeps_shared_hosts(official, monkeypatch):
+    official([])
+    monkeypatch.setattr(blacklist, "USER_BLACKLIST", {"https://drive.google.com/"})
+    monkeypatch.setattr(blacklist, "USER_VERSION", next(_versions))
+    _, user = blacklisted_hosts()
+    assert user == {"drive.google.com"}
+
+
+def test_site_of():
+    assert site_of("www.example.com") == "example.com"
+    assert site_of("shop.example.com.tw") == "example.com.tw"
+    assert site_of("10.0.0.1") == "10.0.0.1"
+
+
+def test_batch_link_report(official):
+    official(["https://bad-phish.example/"])
+    urls = [
+        "https://shop.example.com/item",
+        "https://www.example.com/about",
+        "https://bad-phish.example/login",
+        "https://secure-paypal.com/verify",
+        "https://abc12345678.net/",
+        "https://abc12345678.net/other",
+    ]
+    forms = [
+        {"action": "http://abc12345678.net/post", "password": True},
+        {"action": "/local", "password": False},
+    ]
+    report = analyze_links(urls, forms)
+
+    assert report.links == 5
+    assert report.hosts == 4
+    assert report.offsite_hosts == 3
+    assert report.offsite_link_share == 0.8
+    assert report.blacklisted_hosts == ["bad-phish.example"]
+    assert "abc12345678.net" in report.suspicious_hosts
+    assert "secure-paypal.com" in report.suspicious_hosts
+    assert not report.page_blacklisted_host
+
+    form = report.credential_forms[0]
+    assert form["host"] == "abc12345678.net"
+    assert form["reasons"] == ["外部網域", "可疑網域", "未加密連線"]
+
+    evidence = report.evidence()
+    assert "連結指向黑名單網域：bad-phish.example" in evidence
+    assert "密碼表單送往" in evidence
+
+
+def test_page_on_blacklisted_host(official):
+    official(["https://bad-phish.example/"])
+    report = analyze_links(["https://bad-phish.example/login"])
+    assert report.page_blacklisted_host
+    assert report.blacklisted_hosts == []
+
+
+def test_empty_input():
+    report = analyze_links([])
+    assert report.links == 0
+    assert report.evidence() is None
@@ -0,0 +1,232 @@
+import gzip
+import io
+import json
+
+import pytest
+
+import payload
+from payload import PayloadError, apply_text_delta, content_hash, load_analyze_payload
+
+
+def load(data: dict, client: str = "id:test") -> dict:
+    return load_analyze_payload(json.dumps(data).encode("utf-8"), "application/json", client=client)
+
+
+def v2(**fields) -> dict:
+    data = {"v": 2, "url": "https://spa.example/a", "title": "t", "text": "hello", "forms": []}
+    data.update(fields)
+    return data
+
+
+@pytest.fixture(autouse=True)
+def empty_capture_cache(monkeypatch):
+    monkeypatch.setattr(payload, "_link_cache", payload.OrderedDict())
+    monkeypatch.setattr(payload, "_link_cache_chars", 0)
+
+
+# ------------------------------
+# v1 / v2 格式檢查
+# ------------------------------
+def test_v1_and_empty_body():
+    assert load({"text": "=== URL === https://a.example"}) == {"version": 1, "text": "=== URL === https://a.example"}
+    assert load_analyze_payload(b"") == {"version": 1, "text": ""}
+
+
+def test_v2_fields_are_cleaned():
+    data = load(v2(
+        url="  https://a.example/login ",
+        title=" 登入 ",
+        text="密碼",
+        hash=content_hash("密碼"),
+        links=["https://b.example/", 3, None, "https://c.example/"],
+        forms=[{"action": " https://evil.example/post ", "method": "POST", "password": 1}, "not a form"],
+    ))
+    assert data["version"] == 2 and not data["delta"]
+    assert data["url"] == "https://a.example/login"
+    assert data["title"] == "登入"
+    assert data["links"] == ["https://b.example/", "https://c.example/"]
+    assert data["forms"] == [{"action": "https://evil.example/post", "method": "post", "password": True}]
+    assert data["hash"] == content_hash("密碼")
+
+
+@pytest.mark.parametrize("fields", [
+    {"v": 3},
+    {"text": 5},
+    {"url": ["x"]},
+    {"links": "https://a.example/"},
+    {"forms": {"action": "x"}},
+    {"capture_id": ""},
+    {"capture_id": "x" * (payload.CAPTURE_ID_MAX_LEN + 1)},
+    {"base": 1},
+    {"hash": "sha256:0"},
+])
+def test_v2_rejects_bad_fields(fields):
+    with pytest.raises(PayloadError) as e:
+        load(v2(**fields))
+    assert e.value.status == 400
+
+
+@pytest.mark.parametrize("raw", [b"{", b"[1, 2]", b'"text"'])
+def test_rejects_non_object_json(raw):
+    with pytest.raises(PayloadError) as e:
+        load_analyze_payload(raw, "application/json")
+    assert e.value.status == 400
+
+
+def test_limits(monkeypatch):
+    monkeypatch.setattr(payload, "MAX_TEXT_CHARS", 5)
+    monkeypatch.setattr(payload, "MAX_LINKS", 2)
+    text = "0123456789"
+    data = load(v2(text=text, hash=content_hash(text), links=["a", "b", "c"]))
+    assert data["text"] == "01234"
+    assert data["links"] == ["a", "b"]
+    assert load({"text": text})["text"] == "01234"
+
+
+def test_gzip_body():
+    raw = gzip.compress(json.dumps(v2(text="壓縮")).encode("utf-8"))
+    assert load_analyze_payload(raw, "application/json", "gzip")["text"] == "壓縮"
+    with pytest.raises(PayloadError) as e:
+        load_analyze_payload(b"not gzip", "application/json", "gzip")
+    assert e.value.status == 400
+    with pytest.raises(PayloadError) as e:
+        load_analyze_payload(raw, "application/json", "br")
+    assert e.value.status == 415
+
+
+def test_gzip_bomb_is_rejected(monkeypatch):
+    monkeypatch.setattr(payload, "MAX_DECODED_BYTES", 1000)
+    raw = gzip.compress(json.dumps(v2(text="a" * 5000)).encode("utf-8"))
+    with pytest.raises(PayloadError) as e:
+        load_analyze_payload(raw, "application/json", "gzip")
+    assert e.value.status == 413
+
+
+def test_read_body_limit():
+    assert payload.read_body(io.BytesIO(b"x" * 100), 100, limit=100) == b"x" * 100
+    with pytest.raises(PayloadError) as e:
+        payload.read_body(io.BytesIO(b""), 101, limit=100)
+    assert e.value.status == 413
+    # Content-Length 缺少或不實時，讀到超過上限就停止
+    with pytest.raises(PayloadError) as e:
+        payload.read_body(io.BytesIO(b"x" * 1000), None, limit=100)
+    assert e.value.status == 413
+
+
+# ------------------------------
+# capture_id / base：連結與文字的增量
+# ------------------------------
+def test_link_delta_rebuilds_link_list():
+    load(v2(capture_id="c1", links=["https://x.example/1", "https://x.example/2"]))
+    data = load(v2(
+        capture_id="c2", base="c1",
+        links_added=["https://y.example/3", "https://x.example/2"],
+        links_removed=["https://x.example/1"],
+    ))
+    assert data["delta"]
+    assert data["links"] == ["https://x.example/2", "https://y.example/3"]
+
+    # c2 也被記住，可以再當下一次的 base
+    data = load(v2(capture_id="c3", base="c2", links_added=[], links_removed=["https://x.example/2"]))
+    assert data["links"] == ["https://y.example/3"]
+
+
+def test_unknown_or_expired_base_needs_full(monkeypatch):
+    with pytest.raises(PayloadError) as e:
+        load(v2(capture_id="c2", base="missing", links_added=[]))
+    assert e.value.status == 409 and e.value.reason == "need_full"
+
+    load(v2(capture_id="c1", links=[]))
+    monkeypatch.setattr(payload.time, "monotonic", lambda: 1e12)
+    with pytest.raises(PayloadError) as e:
+        load(v2(capture_id="c2", base="c1", links_added=[]))
+    assert e.value.reason == "need_full"
+
+
+def test_capture_cache_is_bounded(monkeypatch):
+    monkeypatch.setattr(payload, "LINK_CACHE_SIZE", 2)
+    for cid in ("c1", "c2", "c3"):
+        load(v2(capture_id=cid, links=[]))
+    assert [cid for _, cid in payload._link_cache] == ["c2", "c3"]
+
+
+def test_capture_cache_is_bounded_by_text_size(monkeypatch):
+    monkeypatch.setattr(payload, "LINK_CACHE_MAX_CHARS", 10)
+    load(v2(capture_id="c1", text="123456", links=[]))
+    load(v2(capture_id="c1", text="1234567", links=[]))  # 同一個 id 重送不重複計算
+    assert payload._link_cache_chars == 7
+    load(v2(capture_id="c2", text="12345", links=[]))
+    assert [cid for _, cid in payload._link_cache] == ["c2"]
+    assert payload._link_cache_chars == 5
+
+
+def test_captures_are_scoped_per_client():
+    load(v2(capture_id="c1", text="secret", links=["https://a.example/"]), client="id:alice")
+    with pytest.raises(PayloadError) as e:
+        load(v2(capture_id="c2", base="c1", links_added=[]), client="id:mallory")
+    assert e.value.reason == "need_full"
+
+    # 其他客戶端用相同的 id 也不會蓋掉
+    load(v2(capture_id="c1", text="other", links=[]), client="id:mallory")
+    data = load(v2(capture_id="c2", base="c1", links_added=[]), client="id:alice")
+    assert data["links"] == ["https://a.example/"]
+
+
+def test_invalid_request_does_not_replace_capture():
+    load(v2(capture_id="c1", text="abc", links=["https://a.example/"]))
+    with pytest.raises(PayloadError):
+        load(v2(capture_id="c1", text="xyz", links=[], forms="bad"))
+    data = load(v2(capture_id="c2", base="c1", links_added=[], hash=content_hash("abcd"), text_delta=[3, 0, "d"]))
+    assert data["text"] == "abcd"
+    assert data["links"] == ["https://a.example/"]
+
+
+def test_text_delta_reuses_previous_text():
+    before = "首頁 😀 歡迎光臨\n最新消息"
+    after = "首頁 😀 商品列表\n最新消息"
+    load(v2(capture_id="c1", text=before, links=[]))
+
+    data = load(v2(capture_id="c2", base="c1", hash=content_hash(after), text_delta=[6, 5, "商品列表"]))
+    assert data["text"] == after
+
+    # 文字沒變：只送 [長度, 0, ""]
+    data = load(v2(capture_id="c3", base="c2", hash=content_hash(after), text_delta=[len(after) + 1, 0, ""]))
+    assert data["text"] == after
+
+
+def test_text_delta_on_text_longer_than_limit(monkeypatch):
+    monkeypatch.setattr(payload, "MAX_TEXT_CHARS", 5)
+    before = "0123456789"
+    after = "0123456789!"
+    data = load(v2(capture_id="c1", text=before, hash=content_hash(before), links=[]))
+    assert data["text"] == "01234"
+
+    # 雜湊與差異都以完整文字計算，伺服器記住的必須是未截斷的文字
+    data = load(v2(capture_id="c2", base="c1", hash=content_hash(after), text_delta=[10, 0, "!"]))
+    assert data["text"] == "01234"
+    data = load(v2(capture_id="c3", base="c2", hash=content_hash(after + "?"), text_delta=[11, 0, "?"]))
+    assert data["hash"] == content_hash(after + "?")
+
+
+def test_text_delta_hash_mismatch_needs_full():
+    load(v2(capture_id="c1", text="abc", links=[]))
+    with pytest.raises(PayloadError) as e:
+        load(v2(capture_id="c2", base="c1", hash=content_hash("abX"), text_delta=[2, 0, "Y"]))
+    assert e.value.reason == "need_full"
+    with pytest.raises(PayloadError) as e:
+        load(v2(capture_id="c2", base="c1", text_delta=[2, 0, "Y"]))
+    assert e.value.status == 400
+
+
+@pytest.mark.parametrize("delta", [[1, 1], ["1", 0, ""], [-1, 0, ""], [2, 2, ""], [0, 0, 5]])
+def test_malformed_text_delta(delta):
+    with pytest.raises(PayloadError) as e:
+        apply_text_delta("abc", delta)
+    assert e.value.status == 400
+
+
+def test_text_delta_counts_utf16_units():
+    # 😀 在 JavaScript 佔兩個索引
+    assert apply_text_delta("a😀b", [3, 1, "c"]) == "a😀cb"
+    with pytest.raises(PayloadError):
+        apply_text_delta("a😀b", [2, 0, ""])
@@ -0,0 +1,58 @@
+import itertools
+
+import pytest
+
+import blacklist
+import precheck
+import url_classifier
+from tools import model_score
+
+_versions = itertools.count(2 * 10 ** 6)
+
+
+@pytest.fixture(autouse=True)
+def lists(monkeypatch):
+    monkeypatch.setattr(blacklist, "OFFICIAL_BLACKLIST", {
+        "https://google.com/",
+        "https://drive.google.com/",
+        "https://docs.google.com/forms/d/e/phish/viewform",
+        "https://bad-phish.example/",
+    })
+    monkeypatch.setattr(blacklist, "OFFICIAL_VERSION", next(_versions))
+    monkeypatch.setattr(blacklist, "USER_BLACKLIST", set())
+    monkeypatch.setattr(blacklist, "USER_VERSION", next(_versions))
+    monkeypatch.setattr(url_classifier, "get_classifier", lambda: None)
+
+
+def test_model_score():
+    assert model_score(None) == (0, [])
+    assert model_score(0.5) == (0, [])
+    assert model_score(1.0) == (20, ["URL 模型評估（+20分）"])
+    assert model_score(0.0) == (-20, ["URL 模型評估（-20分）"])
+
+
+def test_safe_domain_is_not_a_blacklisted_host():
+    # 名單上的 google.com / drive.google.com 根目錄不會讓整個主機變成黑名單網域
+    google, drive = precheck.precheck_urls(["https://google.com/search", "https://drive.google.com/file/d/x"])
+    assert not google["blacklisted"]
+    assert not google["warn"]
+    assert not any("黑名單" in r for r in drive["reasons"])
+    assert google["risk_score"] == 0
+    assert not any("黑名單" in r for r in google["reasons"])
+
+
+def test_listed_url_and_host():
+    exact, same_host = precheck.precheck_urls([
+        "https://docs.google.com/forms/d/e/phish/viewform",
+        "https://bad-phish.example/other",
+    ])
+    assert exact["blacklisted"] and exact["warn"]
+    assert not same_host["blacklisted"]
+    assert any("黑名單" in r for r in same_host["reasons"])
+
+
+def test_http_shortener_scores():
+    (result,) = precheck.precheck_urls(["http://bit.ly/abc"])
+    assert result["risk_score"] == 35
+    assert result["risk_level"] == "中風險"
+    assert not result["warn"]
@@ -0,0 +1,147 @@
+import threading
+import time
+
+import pytest
+
+import profiler
+import server
+from profiler import stage
+
+
+@pytest.fixture(autouse=True)
+def no_session(monkeypatch):
+    monkeypatch.setattr(profiler, "ADMIN_TOKEN", "s3cret")
+    monkeypatch.setattr(profiler, "_session", None)
+    monkeypatch.setattr(profiler, "_enabled", False)
+    yield
+    profiler.stop()
+
+
+@pytest.fixture
+def client():
+    return server.app.test_client()
+
+
+ADMIN = {"X-Admin-Token": "s3cret"}
+
+
+def run_request(work_ms=60):
+    """在另一個執行緒模擬一個被剖析的請求：一個階段內忙碌 work_ms 毫秒。"""
+    def handle():
+        session = profiler.begin_request()
+        try:
+            with stage("rules"):
+                end = time.perf_counter() + work_ms / 1000
+                while time.perf_counter() < end:
+                    sum(range(100))
+        finally:
+            if session is not None:
+                profiler.end_request(session)
+
+    t = threading.Thread(target=handle)
+    t.start()
+    t.join()
+
+
+# ------------------------------
+# /debug/profile 權限與參數
+# ------------------------------
+def test_disabled_without_admin_token(client, monkeypatch):
+    monkeypatch.setattr(profiler, "ADMIN_TOKEN", "")
+    assert client.get("/debug/profile", headers=ADMIN).status_code == 404
+    assert client.post("/debug/profile", json={}, headers={"X-Admin-Token": ""}).status_code == 404
+
+
+def test_wrong_token(client):
+    assert client.get("/debug/profile").status_code == 403
+    assert client.get("/debug/profile", headers={"X-Admin-Token": "nope"}).status_code == 403
+    assert client.post("/debug/profile", json={}, headers={"Authorization": "Bearer nope"}).status_code == 403
+    assert client.get("/debug/profile", headers={"Authorization": "Bearer s3cret"}).status_code == 404  # 尚無紀錄
+
+
+@pytest.mark.parametrize("body", [
+    {"mode": "trace"},
+    {"requests": "many"},
+    {"seconds": "soon"},
+    {"interval_ms": [1]},
+])
+def test_start_rejects_bad_parameters(client, body):
+    resp = client.post("/debug/profile", json=body, headers=ADMIN)
+    assert resp.status_code == 400
+    assert resp.get_json()["success"] is False
+    assert not profiler.enabled()
+
+
+def test_start_stop(client):
+    resp = client.post("/debug/profile", json={"mode": "sample", "requests": 5000, "seconds": 9999}, headers=ADMIN)
+    session = resp.get_json()["session"]
+    assert resp.status_code == 200 and session["running"]
+    assert session["max_requests"] == profiler.MAX_PROFILE_REQUESTS
+    assert session["seconds"] == profiler.MAX_PROFILE_SECONDS
+
+    assert client.post("/debug/profile", json={}, headers=ADMIN).status_code == 409
+    assert client.get("/debug/profile?format=pstats&sort=bogus", headers=ADMIN).status_code == 400
+
+    resp = client.delete("/debug/profile", headers=ADMIN)
+    assert resp.status_code == 200 and not resp.get_json()["session"]["running"]
+    assert not profiler.enabled()
+    assert client.post("/debug/profile", json={"mode": "cprofile"}, headers=ADMIN).status_code == 200
+
+
+def test_wait_returns_when_capture_ends(client):
+    client.post("/debug/profile", json={"requests": 1, "interval_ms": 1}, headers=ADMIN)
+    threading.Timer(0.05, run_request, args=(10,)).start()
+    t0 = time.time()
+    resp = client.get("/debug/profile?wait=1", headers=ADMIN)
+    assert time.time() - t0 < profiler.MAX_WAIT_SECONDS
+    assert resp.get_json()["session"]["running"] is False
+    assert resp.get_json()["session"]["requests"] == 1
+
+
+# ------------------------------
+# 輸出格式
+# ------------------------------
+def test_collapsed_and_speedscope_output(client):
+    client.post("/debug/profile", json={"mode": "sample", "requests": 1, "interval_ms": 1}, headers=ADMIN)
+    run_request()
+    session = profiler.current()
+    assert not session.running
+    assert session.summary()["stages"]["rules"]["calls"] == 1
+
+    text = client.get("/debug/profile?format=collapsed", headers=ADMIN).get_data(as_text=True)
+    lines = text.strip().splitlines()
+    assert lines
+    for line in lines:
+        stack, count = line.rsplit(" ", 1)
+        assert int(count) > 0
+        assert stack.startswith("[stage] rules;")
+    assert sum(int(line.rsplit(" ", 1)[1]) for line in lines) == session.summary()["samples"]
+
+    resp = client.get("/debug/profile?format=speedscope", headers=ADMIN)
+    assert "speedscope.json" in resp.headers["Content-Disposition"]
+    doc = resp.get_json()
+    frames = doc["shared"]["frames"]
+    prof = doc["profiles"][0]
+    assert prof["type"] == "sampled" and prof["unit"] == "milliseconds"
+    assert len(prof["samples"]) == len(prof["weights"]) == len(lines)
+    assert all(0 <= i < len(frames) for sample in prof["samples"] for i in sample)
+    assert prof["endValue"] == pytest.approx(sum(prof["weights"]))
+    assert frames[prof["samples"][0][0]]["name"] == "[stage] rules"
+
+
+def test_collapsed_escapes_semicolons():
+    session = profiler.ProfileSession("sample", 1, 1, 5)
+    session.samples[("a;b", "c")] = 3
+    assert profiler.collapsed(session) == "a,b;c 3\n"
+
+
+def test_cprofile_output(client):
+    client.post("/debug/profile", json={"mode": "cprofile", "requests": 1}, headers=ADMIN)
+    run_request(10)
+    text = client.get("/debug/profile?format=pstats&sort=tottime", headers=ADMIN).get_data(as_text=True)
+    assert "function calls" in text
+
+
+def test_stage_is_free_when_idle():
+    assert stage("x") is profiler._NULL
+    assert profiler.begin_request() is None
@@ -0,0 +1,153 @@
+import threading
+import time
+
+import pytest
+
+import blacklist
+import replication
+
+
+@pytest.fixture(autouse=True)
+def node(tmp_path, monkeypatch):
+    """每個測試一個乾淨的節點：暫存的紀錄檔與使用者名單檔。"""
+    monkeypatch.setattr(replication, "LOG_PATH", str(tmp_path / "log.jsonl"))
+    monkeypatch.setattr(replication, "NODE_ID", "a")
+    monkeypatch.setattr(replication, "_log_id", "test")
+    monkeypatch.setattr(replication, "_seq", 0)
+    monkeypatch.setattr(replication, "_last_ts", 0.0)
+    monkeypatch.setattr(replication, "_log", [])
+    monkeypatch.setattr(replication, "_state", {})
+    monkeypatch.setattr(blacklist, "USER_FILE", str(tmp_path / "user.txt"))
+    monkeypatch.setattr(blacklist, "USER_BLACKLIST", set())
+    monkeypatch.setattr(blacklist, "USER_CHANGES", [])
+    monkeypatch.setattr(blacklist, "USER_CHANGE_LISTENERS", [replication._on_user_change])
+    return tmp_path
+
+
+def record(op, url, ts, origin="b"):
+    return {"op": op, "url": url, "ts": ts, "origin": origin}
+
+
+def file_urls(tmp_path):
+    return {line.strip() for line in (tmp_path / "user.txt").read_text(encoding="utf-8").splitlines() if line.strip()}
+
+
+def test_newer_write_wins(node):
+    assert replication.apply_remote([record("add", "https://x.example/", 10.0)]) == 1
+    assert "https://x.example/" in blacklist.USER_BLACKLIST
+
+    # 較舊的刪除被忽略，較新的刪除生效
+    assert replication.apply_remote([record("delete", "https://x.example/", 5.0)]) == 0
+    assert "https://x.example/" in blacklist.USER_BLACKLIST
+    assert replication.apply_remote([record("delete", "https://x.example/", 11.0)]) == 1
+    assert "https://x.example/" not in blacklist.USER_BLACKLIST
+    assert file_urls(node) == set()
+
+
+def test_same_timestamp_breaks_ties_by_origin(node):
+    replication.apply_remote([record("add", "https://x.example/", 10.0, origin="b")])
+    assert replication.apply_remote([record("delete", "https://x.example/", 10.0, origin="a")]) == 0
+    assert replication.apply_remote([record("delete", "https://x.example/", 10.0, origin="c")]) == 1
+    assert "https://x.example/" not in blacklist.USER_BLACKLIST
+
+
+def test_invalid_records_are_skipped(node):
+    changes = [
+        {"op": "add"},
+        record("rename", "https://x.example/", 1.0),
+        record("add", 42, 1.0),
+        {"op": "add", "url": "https://y.example/", "ts": "soon", "origin": "b"},
+        record("add", "https://z.example/", 1.0),
+    ]
+    assert replication.apply_remote(changes) == 1
+    assert blacklist.USER_BLACKLIST == {"https://z.example/"}
+
+
+def test_local_change_is_stamped_after_remote(node):
+    replication.apply_remote([record("add", "https://x.example/", 10.0)])
+    # 本節點的時間戳一定比看過的新：本機刪除會蓋過剛複寫進來的新增
+    blacklist.delete_from_user_blacklist("https://x.example/")
+    state = replication._state["https://x.example/"]
+    assert state["op"] == "delete" and state["origin"] == "a" and state["ts"] > 10.0
+
+
+def test_incremental_sync_payload(node):
+    blacklist.add_to_user_blacklist("https://x.example/")
+    blacklist.add_to_user_blacklist("https://y.example/")
+    full = replication.sync_payload(None)
+    assert full["snapshot"] and len(full["changes"]) == 2
+
+    delta = replication.sync_payload(1, log_id="test")
+    assert not delta.get("snapshot")
+    assert [c["url"] for c in delta["changes"]] == ["https://y.example/"]
+
+
+def test_concurrent_changes_keep_set_state_and_file_in_sync(node):
+    urls = [f"https://site{i}.example/" for i in range(30)]
+    errors = []
+
+    def local():
+        try:
+            for _ in range(5):
+                for u in urls:
+                    blacklist.add_to_user_blacklist(u)
+                for u in urls[::2]:
+                    blacklist.delete_from_user_blacklist(u)
+        except Exception as e:
+            errors.append(e)
+
+    def remote():
+        try:
+            base = time.time() + 3600  # 對方時鐘較快：本節點之後的異動仍須蓋過
+            for i in range(200):
+                u = urls[i % len(urls)]
+                replication.apply_remote([record("delete" if i % 3 else "add", u, base + i)])
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=local), threading.Thread(target=remote)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert not errors
+    expected = {u for u, r in replication._state.items() if r["op"] == "add"}
+    assert blacklist.USER_BLACKLIST == expected
+    assert file_urls(node) == expected
+
+
+class _Stop(BaseException):
+    pass
+
+
+def test_puller_survives_malformed_peer(monkeypatch):
+    calls = []
+
+    def fetch(peer, params):
+        calls.append(peer)
+        return ["not", "a", "dict"] if peer == "http://bad" else {"success": True, "seq": "x"}
+
+    rounds = iter(range(2))
+
+    def sleep(_):
+        if next(rounds, None) is None:
+            raise _Stop
+
+    monkeypatch.setattr(replication, "PEERS", ["http://bad", "http://worse"])
+    monkeypatch.setattr(replication, "_peers", {})
+    monkeypatch.setattr(replication, "_fetch", fetch)
+    monkeypatch.setattr(replication.time, "sleep", sleep)
+    with pytest.raises(_Stop):
+        replication._puller()
+    assert calls == ["http://bad", "http://worse"] * 3
+
+
+def test_check_bind(monkeypatch):
+    monkeypatch.setattr(replication, "SYNC_TOKEN", "")
+    assert replication.check_bind("127.0.0.1") is None
+    assert replication.check_bind("localhost") is None
+    assert replication.check_bind("::1") is None
+    assert replication.check_bind("0.0.0.0")
+    monkeypatch.setattr(replication, "SYNC_TOKEN", "secret")
+    assert replication.check_bind("0.0.0.0") is None
@@ -0,0 +1,226 @@
+import csv
+import json
+import os
+import re
+import socket
+from urllib.parse import urlparse
+
+import pytest
+
+import rule_engine
+from rule_engine import CompiledRules, RuleError, load_rules
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+URLS = [
+    "https://www.google.com/",
+    "http://secure-paypal.com/account/verify",
+    "https://foo.github.io/login",
+    "https://abc1234.netlify.app/confirm/update",
+    "http://bit.ly/xyz",
+    "https://t.co/abc",
+    "https://ab.example.com/",
+    "https://" + "a" * 31 + ".com/secure",
+    "http://192.168.0.1/login",
+    "https://apple-verify.net/",
+    "https://bank-update.com/account",
+    "https://ab12cd.xyz/",
+    "https://example.com:8080/path",
+    "https://",
+    "",
+]
+
+
+def _phishtank_urls(limit=3000):
+    path = os.path.join(HERE, "phishtank.csv")
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [row["url"].strip() for _, row in zip(range(limit), csv.DictReader(f)) if row.get("url")]
+
+
+CORPUS = URLS + _phishtank_urls()
+
+
+# ------------------------------
+# 改寫前 tools.py 的寫死規則（對照用）
+# ------------------------------
+THIRD_PARTY_HOSTS = ("github.io", "netlify.app", "vercel.app", "pages.dev", "githubusercontent.com", "herokuapp.com")
+SUSPICIOUS_DOMAIN_PATTERNS = [r"[\d]{4,}", r"[a-z]{1,2}\d+[a-z]{1,2}", r"bit\.ly|tinyurl|t\.co|goo\.gl"]
+
+
+def old_url_safety(url):
+    parsed = urlparse(url)
+    domain = parsed.netloc.lower()
+    path = parsed.path.lower()
+    findings = []
+    for host in THIRD_PARTY_HOSTS:
+        if host in domain:
+            findings.append(f"使用第三方託管平台：{host}")
+    for pattern in SUSPICIOUS_DOMAIN_PATTERNS:
+        if re.search(pattern, domain):
+            findings.append(f"域名包含可疑模式：{pattern}")
+    main_domain = domain.split('.')[0]
+    if len(main_domain) < 3:
+        findings.append("主域名過短，可能為可疑網址")
+    elif len(main_domain) > 30:
+        findings.append("主域名過長，可能為混淆設計")
+    for keyword in ["verify", "confirm", "update", "secure", "login", "account"]:
+        if keyword in path:
+            findings.append(f"路徑包含敏感關鍵字：{keyword}")
+    if parsed.scheme == "http":
+        findings.append("使用 HTTP 而非 HTTPS，安全性較低")
+    return findings
+
+
+def old_domain(domain):
+    domain = domain.lower().strip()
+    parts = domain.split('.')
+    findings = []
+    if parts[-1] not in ["com", "org", "net", "edu", "gov", "tw", "cn", "hk", "jp"]:
+        findings.append(f"使用不常見的頂級域名：{parts[-1]}")
+    if re.search(r'\d', parts[0]):
+        findings.append("主域名包含數字，可能是新註冊的可疑域名")
+    try:
+        socket.inet_aton(domain)
+        findings.append("使用 IP 地址而非域名，可能為可疑網站")
+    except OSError:
+        pass
+    return findings
+
+
+def old_similar(domain):
+    findings = []
+    for pattern, desc in [
+        (r"secure-[a-z0-9]+\.(com|net)", "使用可疑的 secure- 前綴"),
+        (r"[a-z0-9]+-verify\.(com|net)", "使用可疑的 verify 後綴"),
+        (r"[a-z0-9]+-update\.(com|net)", "使用可疑的 update 後綴"),
+    ]:
+        if re.search(pattern, domain):
+            findings.append(desc)
+    return findings
+
+
+def old_url_score(url):
+    parsed = urlparse(url)
+    domain = parsed.netloc.lower()
+    score, reasons = 0, []
+    if parsed.scheme == "http":
+        score += 15
+        reasons.append("使用 HTTP（+15分）")
+    if any(host in domain for host in THIRD_PARTY_HOSTS):
+        score += 10
+        reasons.append("第三方託管平台（+10分）")
+    if re.search(r"bit\.ly|tinyurl|t\.co|goo\.gl", domain):
+        score += 20
+        reasons.append("短網址服務（+20分）")
+    if re.search(r"[\d]{4,}", domain):
+        score += 12
+        reasons.append("域名包含大量數字（+12分）")
+    main_domain = domain.split('.')[0]
+    if len(main_domain) < 3 or len(main_domain) > 30:
+        score += 8
+        reasons.append("域名過短（+8分）" if len(main_domain) < 3 else "域名過長（+8分）")
+    return score, reasons
+
+
+@pytest.fixture(scope="module")
+def rules():
+    return load_rules(rule_engine.RULES_PATH)
+
+
+def test_safety_findings_match_old_rules(rules):
+    for url, hits in zip(CORPUS, rules.evaluate_batch(CORPUS)):
+        new = rules.findings(hits, "safety")
+        old = old_url_safety(url)
+        # 可疑模式的訊息文字沿用原本的 regex 字串；比對內容而不比對順序
+        assert sorted(new) == sorted(old), url
+
+
+def test_url_score_matches_old_weights(rules):
+    for url in CORPUS:
+        score, reasons = rules.url_score(rules.evaluate(url))
+        old_score, old_reasons = old_url_score(url)
+        assert score == old_score, url
+        assert sorted(reasons) == sorted(old_reasons), url
+
+
+def test_domain_and_similar_findings_match_old_rules(rules):
+    for url in CORPUS:
+        domain = urlparse(url).netloc.lower()
+        if len(domain.split(".")) < 2:
+            continue
+        hits = rules.evaluate_domain(domain)
+        assert sorted(rules.findings(hits, "domain")) == sorted(old_domain(domain)), domain
+        assert rules.findings(hits, "similar") == old_similar(domain), domain
+
+
+def test_batch_equals_single(rules):
+    batch = rules.evaluate_batch(URLS)
+    assert batch == [rules.evaluate(u) for u in URLS]
+
+
+def test_evidence_score_and_levels(rules):
+    evidence = "未找到聯絡資訊；語言異常：簡體字比例偏高；域名包含可疑模式；官方安全域名"
+    score, reasons = rules.evidence_score(evidence)
+    assert score == 15 + 10 + 12 - 20
+    assert reasons == ["缺少聯絡資訊（+15分）", "語言品質異常（+10分）", "發現可疑模式（+12分）", "官方安全域名（-20分）"]
+    # 同一規則的多個關鍵字只算一次
+    assert rules.evidence_score("可疑模式 可疑特徵 可疑模式")[0] == 12
+    assert rules.evidence_score("")[0] == 0
+    assert [rules.level(s) for s in (0, 19, 20, 49, 50, 74, 75, 100)] == [
+        "低風險", "低風險", "中風險", "中風險", "高風險", "高風險", "極高風險", "極高風險"]
+
+
+def test_anchored_rules_match_every_row_in_a_batch():
+    rules = CompiledRules({"url_rules": [
+        {"id": "starts_with_login", "field": "domain", "regex": "^login[.-]", "weight": 5, "reason": "a"},
+        {"id": "xyz_tld", "field": "domain", "regex": "\\.xyz$", "weight": 7, "reason": "b"},
+        {"id": "first_label", "field": "domain", "regex": "^[^.]+", "findings": {"t": "{match}"}},
+    ]})
+    urls = [
+        "https://login.example.xyz/",
+        "https://www.example.com/",
+        "https://login-secure.bank.xyz/",
+        "https://notlogin.example.xyz/",
+    ]
+    batch = rules.evaluate_batch(urls)
+    assert batch == [rules.evaluate(u) for u in urls]
+    assert [rules.url_score(hits)[0] for hits in batch] == [12, 0, 12, 7]
+    # 貪婪的比對不會跨到下一筆
+    assert [rules.findings(hits, "t") for hits in batch] == [["login"], ["www"], ["login-secure"], ["notlogin"]]
+
+
+@pytest.mark.parametrize("spec", [
+    {"url_rules": [{"id": "x", "field": "domain", "regex": "\\Alogin"}]},
+    {"url_rules": [{"id": "x", "field": "domain", "regex": "xyz\\Z"}]},
+    {"url_rules": [{"id": "x", "field": "nope", "regex": "a"}]},
+    {"url_rules": [{"id": "x", "field": "domain", "regex": "("}]},
+    {"url_rules": [{"id": "x", "field": "domain", "in": "@missing"}]},
+    {"url_rules": [{"id": "x", "field": "domain", "regex": "a"}, {"id": "x", "field": "path", "regex": "b"}]},
+    {"evidence_rules": [{"id": "e"}]},
+])
+def test_invalid_rules(spec):
+    with pytest.raises(RuleError):
+        CompiledRules(spec)
+
+
+def test_hot_reload_keeps_old_rules_on_error(tmp_path, monkeypatch):
+    path = tmp_path / "rules.json"
+    spec = {"version": 1, "url_rules": [{"id": "a", "field": "domain", "regex": "evil", "weight": 5, "reason": "r"}]}
+    path.write_text(json.dumps(spec), encoding="utf-8")
+    monkeypatch.setattr(rule_engine, "RULES_PATH", str(path))
+    monkeypatch.setattr(rule_engine, "RELOAD_INTERVAL", 0)
+    monkeypatch.setattr(rule_engine, "_rules", None)
+    monkeypatch.setattr(rule_engine, "_mtime", None)
+
+    assert rule_engine.get_rules().version == 1
+
+    spec["version"] = 2
+    path.write_text(json.dumps(spec), encoding="utf-8")
+    os.utime(path, (1, 1))
+    assert rule_engine.get_rules().version == 2
+
+    path.write_text("{ broken", encoding="utf-8")
+    os.utime(path, (2, 2))
+    assert rule_engine.get_rules().version == 2
@@ -0,0 +1,125 @@
+import threading
+import time
+
+import pytest
+
+from scheduler import PRIORITY_BACKGROUND, PRIORITY_FOREGROUND, AnalysisScheduler, JobDropped, parse_priority
+
+
+@pytest.fixture
+def blocked():
+    """單一 worker，先用一個卡住的工作佔住，讓之後的工作都留在佇列裡。"""
+    sched = AnalysisScheduler(workers=1)
+    started, release = threading.Event(), threading.Event()
+
+    def block(checkpoint):
+        started.set()
+        release.wait(5)
+
+    blocker = sched.submit(block, "blocker")
+    assert started.wait(5)
+    yield sched, release
+    release.set()
+    blocker.wait()
+
+
+def test_priority_then_deadline_order(blocked):
+    sched, release = blocked
+    order = []
+
+    def record(name):
+        return lambda checkpoint: order.append(name)
+
+    jobs = [
+        sched.submit(record("bg-late"), "bg-late", PRIORITY_BACKGROUND, 10000),
+        sched.submit(record("bg-early"), "bg-early", PRIORITY_BACKGROUND, 5000),
+        sched.submit(record("fg-late"), "fg-late", PRIORITY_FOREGROUND, 10000),
+        sched.submit(record("fg-early"), "fg-early", PRIORITY_FOREGROUND, 5000),
+    ]
+    assert sched.queue_depth() == {"foreground": 2, "background": 2}
+    release.set()
+    for job in jobs:
+        job.wait()
+    assert order == ["fg-early", "fg-late", "bg-early", "bg-late"]
+    assert sched.stats["completed"] == 5
+
+
+def test_cancel_queued_job(blocked):
+    sched, release = blocked
+    ran = []
+    job = sched.submit(lambda checkpoint: ran.append(1), "tab-1")
+    assert sched.cancel("tab-1")
+    assert not sched.cancel("tab-1")
+    with pytest.raises(JobDropped) as e:
+        job.wait()
+    assert e.value.reason == "cancelled" and e.value.status == 409
+
+    after = sched.submit(lambda checkpoint: "ok", "tab-2")
+    release.set()
+    assert after.wait() == "ok"
+    assert ran == []
+    assert sched.stats["cancelled"] == 1
+
+
+def test_cancel_running_job_stops_at_checkpoint():
+    sched = AnalysisScheduler(workers=1)
+    started, go_on = threading.Event(), threading.Event()
+    steps = []
+
+    def analyze(checkpoint):
+        started.set()
+        go_on.wait(5)
+        checkpoint()
+        steps.append("llm")
+
+    job = sched.submit(analyze, "tab-1")
+    assert started.wait(5)
+    assert sched.running_count() == 1
+    sched.cancel("tab-1")
+    go_on.set()
+    with pytest.raises(JobDropped):
+        job.wait()
+    time.sleep(0.05)
+    assert steps == []
+    assert sched.running_count() == 0
+
+
+def test_expired_jobs_are_dropped(blocked):
+    sched, release = blocked
+    ran = []
+    job = sched.submit(lambda checkpoint: ran.append(1), "slow", deadline_ms=10)
+    time.sleep(0.05)
+    release.set()
+    with pytest.raises(JobDropped) as e:
+        job.wait()
+    assert e.value.reason == "expired" and e.value.status == 503
+    assert ran == []
+    assert sched.stats["expired"] == 1
+
+
+def test_resubmit_replaces_previous_job(blocked):
+    sched, release = blocked
+    first = sched.submit(lambda checkpoint: "first", "tab-1")
+    second = sched.submit(lambda checkpoint: "second", "tab-1")
+    release.set()
+    with pytest.raises(JobDropped):
+        first.wait()
+    assert second.wait() == "second"
+
+
+def test_errors_are_reraised():
+    sched = AnalysisScheduler(workers=1)
+
+    def fail(checkpoint):
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        sched.submit(fail).wait()
+    assert sched.stats["failed"] == 1
+
+
+def test_parse_priority():
+    assert parse_priority("Background ") == PRIORITY_BACKGROUND
+    assert parse_priority("foreground") == PRIORITY_FOREGROUND
+    assert parse_priority(None) == PRIORITY_FOREGROUND
+    assert parse_priority("urgent") == PRIORITY_FOREGROUND
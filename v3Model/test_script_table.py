@@ -0,0 +1,37 @@
+import re
+
+import script_table
+from script_table import count_scripts
+
+
+def old_cjk(text):
+    return len(re.findall(r"[一-龥]", text))
+
+
+def test_counts_simplified_and_latin():
+    counts = count_scripts("我们这个网站 Login now")
+    assert counts["simplified"] >= 2  # 们、这
+    assert counts["latin"] == 8
+    assert counts["cjk"] == 6
+
+
+def test_shared_characters_are_not_simplified():
+    counts = count_scripts("後面的里程")
+    assert counts["simplified"] == 0
+
+
+def test_cjk_matches_the_old_range():
+    table = script_table.get_table()
+    # 範圍外的簡體 / 繁體專用字（擴充 A 區等）只算簡繁字數，不算中文字數
+    outside = [chr(cp) for cp in range(0x3400, 0x4DC0)
+               if table[cp] in (script_table.SIMPLIFIED_EXT, script_table.TRADITIONAL_EXT)][:20]
+    text = "登入您的帳戶們这里 abc " + "".join(outside) + "\U00020000ＡＢＣ"
+    counts = count_scripts(text)
+    assert counts["cjk"] == old_cjk(text)
+    assert counts["simplified"] + counts["traditional"] >= sum(
+        1 for c in outside if table[ord(c)] != script_table.OTHER)
+
+
+def test_empty_and_unpaired_surrogate():
+    assert count_scripts("") == {"simplified": 0, "traditional": 0, "cjk": 0, "latin": 0}
+    assert count_scripts("a\ud800中")["cjk"] == 1
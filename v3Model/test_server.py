@@ -0,0 +1,146 @@
+import gzip
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import payload
+import server
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+HEAVY_MODULES = ("analyzer", "tools", "numpy", "langchain_core", "langchain_openai", "openai", "pydantic")
+
+
+def run_python(script: str, tmp_path, **env) -> dict:
+    """在乾淨的子程序執行 script，回傳它印出的 JSON（最後一行）。"""
+    full_env = {k: v for k, v in os.environ.items() if k != "WERKZEUG_RUN_MAIN"}
+    full_env.update({
+        "USER_BLACKLIST_FILE": str(tmp_path / "user.txt"),
+        "REPLICATION_LOG": str(tmp_path / "log.jsonl"),
+        "PEERS": "",
+        "DNS_UPSTREAM": "off",
+        **env,
+    })
+    out = subprocess.run([sys.executable, "-c", script], cwd=HERE, env=full_env,
+                         capture_output=True, text=True, encoding="utf-8", timeout=120)
+    assert out.returncode == 0, out.stderr
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+# ------------------------------
+# 延遲載入與預熱
+# ------------------------------
+_IMPORT_SCRIPT = f"""
+import json, sys, threading
+import server
+print(json.dumps({{
+    "loaded": [m for m in {HEAVY_MODULES!r} if m in sys.modules],
+    "threads": [t.name for t in threading.enumerate()],
+    "official": len(server.replication.blacklist.OFFICIAL_BLACKLIST),
+}}))
+"""
+
+
+def test_import_server_stays_light(tmp_path):
+    result = run_python(_IMPORT_SCRIPT, tmp_path)
+    assert result["loaded"] == []
+    # reloader 的監看程序（沒有 WERKZEUG_RUN_MAIN）不載入黑名單、不預熱
+    assert "analyzer-warm-up" not in result["threads"]
+    assert result["official"] == 0
+
+
+_WARM_UP_SCRIPT = """
+import json, sys, threading, types
+
+calls = []
+fake = types.ModuleType("analyzer")
+fake.warm_up = lambda: calls.append(threading.current_thread().name)
+sys.modules["analyzer"] = fake
+
+import server
+server.start_warm_up()
+server.start_warm_up()
+for t in threading.enumerate():
+    if t.name == "analyzer-warm-up":
+        t.join()
+modules = set()
+workers = [threading.Thread(target=lambda: modules.add(id(server.get_analyzer()))) for _ in range(8)]
+for t in workers:
+    t.start()
+for t in workers:
+    t.join()
+print(json.dumps({
+    "calls": calls,
+    "modules": len(modules),
+    "official": len(server.replication.blacklist.OFFICIAL_BLACKLIST),
+}))
+"""
+
+
+def test_warm_up_runs_once(tmp_path):
+    # 模擬 reloader 子程序：模組載入時啟動一次預熱，之後重複呼叫也不會再跑
+    result = run_python(_WARM_UP_SCRIPT, tmp_path, WERKZEUG_RUN_MAIN="true")
+    assert result["calls"] == ["analyzer-warm-up"]
+    assert result["modules"] == 1
+    assert result["official"] > 0
+
+
+# ------------------------------
+# /analyze 請求內容被拒絕時的 JSON 錯誤
+# ------------------------------
+@pytest.fixture
+def client():
+    return server.app.test_client()
+
+
+def post_analyze(client, body: bytes, **headers):
+    return client.post("/analyze", data=body, content_type="application/json", headers=headers)
+
+
+def assert_json_error(resp, status):
+    assert resp.status_code == status
+    assert resp.is_json
+    body = resp.get_json()
+    assert body["success"] is False and body["message"]
+    return body
+
+
+def test_oversized_body_gets_json_413(client):
+    resp = post_analyze(client, b"x" * (payload.MAX_BODY_BYTES + 1))
+    assert "上限" in assert_json_error(resp, 413)["message"]
+
+
+def test_read_body_limit_without_max_content_length(client, monkeypatch):
+    # 沒有 MAX_CONTENT_LENGTH 時由 read_body 擋下，回傳同樣格式
+    monkeypatch.setitem(server.app.config, "MAX_CONTENT_LENGTH", None)
+    resp = post_analyze(client, b"x" * (payload.MAX_BODY_BYTES + 1))
+    assert_json_error(resp, 413)
+
+
+def test_gzip_bomb_gets_json_413(client):
+    bomb = gzip.compress(b" " * (payload.MAX_DECODED_BYTES + 1))
+    assert_json_error(post_analyze(client, bomb, **{"Content-Encoding": "gzip"}), 413)
+
+
+@pytest.mark.parametrize("body", [
+    b"{not json",
+    b"[1, 2]",
+    json.dumps({"v": 9, "text": "x"}).encode(),
+    json.dumps({"text": 5}).encode(),
+    json.dumps({"v": 2, "url": "https://a.example/", "text": "x", "forms": "bad"}).encode(),
+])
+def test_bad_payload_gets_json_400(client, body):
+    assert_json_error(post_analyze(client, body), 400)
+
+
+def test_unsupported_encoding_gets_json_415(client):
+    assert_json_error(post_analyze(client, b"{}", **{"Content-Encoding": "br"}), 415)
+
+
+def test_need_full_carries_reason(client):
+    body = json.dumps({"v": 2, "url": "https://a.example/", "text": "x", "base": "unknown", "links_added": []})
+    resp = post_analyze(client, body.encode(), **{"X-Client-Id": "test"})
+    assert assert_json_error(resp, 409)["reason"] == "need_full"
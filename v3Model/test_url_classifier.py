@@ -0,0 +1,104 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+import url_classifier
+from url_classifier import N_BUCKETS, UrlClassifier, featurize, train
+
+PHISH = [f"http://secure-login{i}.verify-account.xyz/signin.php?id={i}" for i in range(40)]
+BENIGN = [f"https://www.shop{i}.com/products/item-{i}" for i in range(40)]
+
+
+@pytest.fixture(scope="module")
+def weights():
+    urls = PHISH + BENIGN
+    labels = np.concatenate([np.ones(len(PHISH)), np.zeros(len(BENIGN))])
+    return train(urls, labels, epochs=3, batch_size=16)
+
+
+@pytest.fixture
+def model_path(tmp_path, monkeypatch):
+    path = tmp_path / "url_model.npy"
+    monkeypatch.setattr(url_classifier, "MODEL_PATH", str(path))
+    monkeypatch.setattr(url_classifier, "MODEL_RELOAD_INTERVAL", 0)
+    monkeypatch.setattr(url_classifier, "_model", None)
+    monkeypatch.setattr(url_classifier, "_model_mtime", None)
+    monkeypatch.setattr(url_classifier, "_checked_at", None)
+    return path
+
+
+def test_featurize_counts_ngrams_per_url():
+    bucket, row, norm = featurize(["abc", "https://example.com/"])
+    # "^abc$" 有 5 個字元：3-gram 3 個、4-gram 2 個、5-gram 1 個
+    assert np.sum(row == 0) == 6
+    assert np.all((bucket >= 0) & (bucket < N_BUCKETS))
+    assert norm[0] == pytest.approx(1 / np.sqrt(6))
+
+
+def test_featurize_batch_matches_single():
+    urls = ["https://a.example/x", "HTTP://B.example/Login ", "c"]
+    bucket, row, _ = featurize(urls)
+    for i, url in enumerate(urls):
+        single, _, _ = featurize([url])
+        # n-gram 不會跨越網址，大小寫與前後空白不影響
+        assert sorted(bucket[row == i]) == sorted(single)
+    assert featurize(["https://a.example/x"])[0].tolist() == featurize([" https://A.EXAMPLE/X"])[0].tolist()
+
+
+def test_featurize_empty():
+    bucket, row, norm = featurize([])
+    assert len(bucket) == len(row) == len(norm) == 0
+
+
+def test_train_and_predict(weights):
+    clf = UrlClassifier(weights)
+    assert weights.dtype == np.float32 and len(weights) == N_BUCKETS + 1
+    probs = clf.predict_proba(PHISH[:5] + BENIGN[:5])
+    assert np.all(probs[:5] > 0.5) and np.all(probs[5:] < 0.5)
+    assert clf.score("http://secure-login99.verify-account.xyz/signin.php") > clf.score("https://www.shop99.com/")
+    assert len(clf.predict_proba([])) == 0
+
+
+def test_wrong_model_size():
+    with pytest.raises(ValueError):
+        UrlClassifier(np.zeros(10))
+
+
+def test_missing_model(model_path):
+    assert url_classifier.get_classifier() is None
+    assert url_classifier.phishing_probability("https://a.example/") is None
+
+
+def test_save_and_mmap_load(model_path, weights):
+    np.save(model_path, weights)
+    clf = url_classifier.get_classifier()
+    assert isinstance(clf.weights, np.memmap)
+    assert url_classifier.phishing_probability(PHISH[0]) == pytest.approx(UrlClassifier(weights).score(PHISH[0]))
+
+
+def test_model_trained_while_running_is_picked_up(model_path, weights):
+    assert url_classifier.get_classifier() is None
+    np.save(model_path, weights)
+    assert url_classifier.get_classifier() is not None
+
+    # 重新訓練（mtime 改變）→ 載入新模型；壞掉的檔案沿用舊模型
+    first = url_classifier.get_classifier()
+    model_path.write_bytes(b"broken")
+    os.utime(model_path, (1, 1))
+    assert url_classifier.get_classifier() is first
+
+
+def test_train_command(tmp_path, monkeypatch):
+    phish = tmp_path / "phish.csv"
+    phish.write_text("url\n" + "\n".join(PHISH) + "\n", encoding="utf-8")
+    benign = tmp_path / "benign.txt"
+    benign.write_text("\n".join(f"{i},shop{i}.com" for i in range(40)) + "\n", encoding="utf-8")
+    out = tmp_path / "model.npy"
+    monkeypatch.setattr(sys, "argv", ["url_classifier.py", "train", "--phish", str(phish), "--benign", str(benign),
+                                      "--out", str(out), "--epochs", "1", "--holdout", "0"])
+    url_classifier.main()
+    assert len(np.load(out, mmap_mode="r")) == N_BUCKETS + 1
+    assert (tmp_path / "model.json").exists()
+    assert not (tmp_path / "model.npy.tmp").exists()
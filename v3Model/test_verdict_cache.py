@@ -0,0 +1,97 @@
+import pytest
+
+import verdict_cache
+from verdict_cache import get_verdict, import_verdict, store_verdict, verdict_key
+
+URL = "https://Shop.Example/login?next=1#top"
+SAFE = {"is_potential_phishing": False, "explanation": "正常", "risk_score": 10, "similar_site_detection": None}
+PHISH = {**SAFE, "is_potential_phishing": True, "risk_score": 90}
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(monkeypatch):
+    monkeypatch.setattr(verdict_cache, "_verdicts", verdict_cache.OrderedDict())
+    monkeypatch.setattr(verdict_cache, "VERDICT_LISTENERS", [])
+
+
+def test_verdict_key():
+    assert verdict_key(URL) == "https://shop.example/login"
+    assert verdict_key("https://shop.example") == "https://shop.example/"
+    assert verdict_key("ftp://shop.example/") is None
+    assert verdict_key("not a url") is None
+
+
+def test_version_tracks_only_the_verdict():
+    v1, ttl = store_verdict(URL, {**SAFE, "elapsed": 1.2})
+    assert ttl == verdict_cache.VERDICT_TTL
+    # 耗時等欄位不影響版本（ETag 不變 → 擴充功能重新驗證時拿到 304）
+    v2, _ = store_verdict("https://shop.example/login?other", {**SAFE, "elapsed": 9.9})
+    assert v2 == v1
+    v3, _ = store_verdict(URL, PHISH)
+    assert v3 != v1
+    assert get_verdict(URL)["version"] == v3
+    assert get_verdict(URL)["result"] == PHISH
+
+
+def test_retention(monkeypatch):
+    store_verdict(URL, SAFE)
+    now = verdict_cache.time.time()
+    monkeypatch.setattr(verdict_cache.time, "time", lambda: now + verdict_cache.VERDICT_RETAIN + 1)
+    assert get_verdict(URL) is None
+    assert not verdict_cache._verdicts
+
+
+def test_cache_is_bounded(monkeypatch):
+    monkeypatch.setattr(verdict_cache, "MAX_VERDICTS", 2)
+    for path in ("a", "b", "c"):
+        store_verdict(f"https://x.example/{path}", SAFE)
+    assert get_verdict("https://x.example/a") is None
+    assert get_verdict("https://x.example/c") is not None
+
+
+def test_import_keeps_the_newest():
+    key = verdict_key(URL)
+    now = verdict_cache.time.time()
+    assert import_verdict(key, {"result": PHISH, "version": "v-new", "stored_at": now})
+    assert not import_verdict(key, {"result": SAFE, "version": "v-old", "stored_at": now - 10})
+    assert get_verdict(URL)["version"] == "v-new"
+
+    # 本地較新的判定也不會被較舊的複寫蓋掉
+    version, _ = store_verdict(URL, SAFE)
+    assert not import_verdict(key, {"result": PHISH, "version": "v-new", "stored_at": now})
+    assert get_verdict(URL)["version"] == version
+
+
+@pytest.mark.parametrize("entry", [
+    {},
+    {"result": SAFE, "version": "v"},
+    {"result": "x", "version": "v", "stored_at": 1e18},
+    {"result": SAFE, "version": "v", "stored_at": "soon"},
+    {"result": SAFE, "version": "v", "stored_at": 0},  # 超過保留期限
+    {"result": SAFE, "version": "v", "stored_at": float("nan")},
+])
+def test_import_rejects_bad_entries(entry):
+    assert not import_verdict("https://x.example/", entry)
+
+
+def test_import_rejects_or_clamps_future_timestamps():
+    key = verdict_key(URL)
+    now = verdict_cache.time.time()
+    assert not import_verdict(key, {"result": PHISH, "version": "v-future", "stored_at": now + 10 ** 9})
+    assert get_verdict(URL) is None
+
+    # 容許的時鐘誤差內：接受但壓回現在，之後較新的判定仍能蓋過
+    assert import_verdict(key, {"result": PHISH, "version": "v-skew", "stored_at": now + 5})
+    assert get_verdict(URL)["stored_at"] <= verdict_cache.time.time()
+    verdict_cache.time.sleep(0.01)
+    assert import_verdict(key, {"result": SAFE, "version": "v-later", "stored_at": verdict_cache.time.time()})
+    assert get_verdict(URL)["version"] == "v-later"
+
+
+def test_listeners_only_see_local_verdicts(monkeypatch):
+    seen = []
+    monkeypatch.setattr(verdict_cache, "VERDICT_LISTENERS", [lambda key, entry: seen.append(key),
+                                                               lambda key, entry: 1 / 0])
+    store_verdict(URL, SAFE)
+    import_verdict("https://other.example/", {"result": SAFE, "version": "v", "stored_at": verdict_cache.time.time()})
+    assert seen == ["https://shop.example/login"]
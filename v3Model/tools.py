@@ -1,21 +1,18 @@
 # LangChain 工具定義
 
 from langchain_core.tools import tool
-from typing import List
+from typing import List, Optional
 import re
 from urllib.parse import urlparse
-import socket
 from datetime import datetime
 
-# 常見第三方託管 host
-THIRD_PARTY_HOSTS = ("github.io", "netlify.app", "vercel.app", "pages.dev", "githubusercontent.com", "herokuapp.com")
-
-# 常見可疑域名特徵
-SUSPICIOUS_DOMAIN_PATTERNS = [
-    r"[\d]{4,}",  # 包含大量數字
-    r"[a-z]{1,2}\d+[a-z]{1,2}",  # 短字母+數字組合
-    r"bit\.ly|tinyurl|t\.co|goo\.gl",  # 短網址服務
-]
+# URL / 域名的啟發規則（第三方託管、可疑域名模式、敏感路徑、常見 TLD、評分權重等）
+# 定義在 heuristic_rules.json，由 rule_engine 編譯成單次掃描並支援熱更新
+from rule_engine import get_rules
+# 簡體 / 繁體 / 中文 / 拉丁字母的字元分類表（由 OpenCC 字典建立，第一次使用時載入）
+from script_table import count_scripts
+# DNS 解析與主機位置情報（背景事件迴圈查詢 + TTL 快取）
+import dns_intel
 
 @tool
 def check_url_safety(url: str) -> str:
@@ -33,39 +30,9 @@ def check_url_safety(url: str) -> str:
         return "URL 為空，無法分析。"
     
     try:
-        parsed = urlparse(url)
-        domain = parsed.netloc.lower()
-        path = parsed.path.lower()
-        
-        findings = []
-        
-        # 檢查第三方託管平台
-        for host in THIRD_PARTY_HOSTS:
-            if host in domain:
-                findings.append(f"使用第三方託管平台：{host}")
-        
-        # 檢查可疑域名模式
-        for pattern in SUSPICIOUS_DOMAIN_PATTERNS:
-            if re.search(pattern, domain):
-                findings.append(f"域名包含可疑模式：{pattern}")
-        
-        # 檢查域名長度（過短或過長都可能可疑）
-        domain_parts = domain.split('.')
-        main_domain = domain_parts[0] if domain_parts else ""
-        if len(main_domain) < 3:
-            findings.append("主域名過短，可能為可疑網址")
-        elif len(main_domain) > 30:
-            findings.append("主域名過長，可能為混淆設計")
-        
-        # 檢查路徑中的可疑關鍵字
-        suspicious_paths = ["verify", "confirm", "update", "secure", "login", "account"]
-        for keyword in suspicious_paths:
-            if keyword in path:
-                findings.append(f"路徑包含敏感關鍵字：{keyword}")
-        
-        # 檢查是否使用 HTTP（非 HTTPS）
-        if parsed.scheme == "http":
-            findings.append("使用 HTTP 而非 HTTPS，安全性較低")
+        domain = urlparse(url).netloc.lower()
+        rules = get_rules()
+        findings = rules.findings(rules.evaluate(url), "safety")
         
         if not findings:
             return f"URL 基本檢查通過：{domain}\n未發現明顯可疑特徵。"
@@ -99,26 +66,9 @@ def analyze_domain_age(domain: str) -> str:
         if len(domain_parts) < 2:
             return "域名格式不完整，缺少頂級域名"
         
-        main_domain = domain_parts[0]
-        tld = domain_parts[-1]
-        
-        findings = []
-        
-        # 檢查常見的合法 TLD
-        common_tlds = ["com", "org", "net", "edu", "gov", "tw", "cn", "hk", "jp"]
-        if tld not in common_tlds:
-            findings.append(f"使用不常見的頂級域名：{tld}")
-        
-        # 檢查主域名是否包含數字（可能是新註冊的可疑域名）
-        if re.search(r'\d', main_domain):
-            findings.append("主域名包含數字，可能是新註冊的可疑域名")
-        
-        # 檢查是否為 IP 地址格式
-        try:
-            socket.inet_aton(domain)
-            findings.append("使用 IP 地址而非域名，可能為可疑網站")
-        except:
-            pass
+        # 不常見 TLD、主域名含數字、IP 位址等規則
+        rules = get_rules()
+        findings = rules.findings(rules.evaluate_domain(domain), "domain")
         
         if not findings:
             return f"域名格式檢查通過：{domain}\n格式看起來正常。"
@@ -129,6 +79,30 @@ def analyze_domain_age(domain: str) -> str:
         return f"域名分析失敗：{str(e)}"
 
 
+@tool
+def check_dns_hosting(urls: List[str]) -> str:
+    """檢查頁面與連結網域實際解析到的位置。
+
+    頁面與連結的主機整批以 DNS 查詢（結果依 TTL 快取），檢查 fast-flux、
+    新出現的 IP、內部 / 保留位址與可疑網段。只讀快取、不等待，還沒查完的主機回報為尚未解析完成。
+
+    Args:
+        urls: 網址列表（第一個為頁面網址）
+
+    Returns:
+        DNS 解析分析結果（繁體中文）
+    """
+    if not dns_intel.enabled():
+        return "DNS 檢查未啟用"
+    if not urls:
+        return "沒有網址，無法進行 DNS 檢查。"
+
+    try:
+        return dns_intel.analyze_urls(urls).text()
+    except Exception as e:
+        return f"DNS 檢查失敗：{str(e)}"
+
+
 @tool
 def check_url_patterns(urls: List[str]) -> str:
     """批量檢查多個 URL 的模式特徵。
@@ -167,8 +141,12 @@ def check_url_patterns(urls: List[str]) -> str:
         if len(unique_domains) == 1 and len(urls) > 3:
             findings.append(f"所有 URL 都指向同一個域名：{list(unique_domains)[0]}")
         
-        # 檢查是否有第三方託管
-        third_party_count = sum(1 for d in domains for host in THIRD_PARTY_HOSTS if host in d)
+        # 檢查是否有第三方託管（整批網址一次掃描）
+        rules = get_rules()
+        third_party_count = sum(
+            1 for hits in rules.evaluate_batch(urls[:20])
+            for h in hits if h.rule_id == "third_party_host"
+        )
         if third_party_count > 0:
             findings.append(f"發現 {third_party_count} 個 URL 使用第三方託管平台")
         
@@ -232,9 +210,9 @@ def detect_language_anomaly(text: str) -> str:
 
     findings = []
 
-    # --- 1. 檢查簡體字出現比例 ---
-    simplified_chars = "们这对机国观产层战领举办权进体为发过学说语讲"
-    simp_count = sum(1 for c in text if c in simplified_chars)
+    # --- 1. 檢查簡體字出現比例（OpenCC 字典建立的分類表，一次轉換數出各類字元） ---
+    counts = count_scripts(text)
+    simp_count = counts["simplified"]
     total_chars = len(text)
     ratio = round(simp_count / max(total_chars, 1), 3)
 
@@ -242,8 +220,8 @@ def detect_language_anomaly(text: str) -> str:
         findings.append(f"簡體字比例偏高({ratio})")
 
     # --- 2. 混雜語言檢查（中文 + 英文大量混合） ---
-    zh = len(re.findall(r"[\u4e00-\u9fa5]", text))
-    en = len(re.findall(r"[A-Za-z]", text))
+    zh = counts["cjk"]
+    en = counts["latin"]
     if zh > 0 and en > 0 and (en / (zh + 1)) > 0.4:
         findings.append("語言混雜比例異常")
 
@@ -256,8 +234,18 @@ def detect_language_anomaly(text: str) -> str:
     return "語言異常：" + "、".join(findings)
 
 
+def model_score(model_probability: Optional[float]) -> tuple:
+    """本地 URL 分類器機率換算的加減分（-20 ~ +20分），回傳 (分數, 理由清單)。"""
+    if model_probability is None:
+        return 0, []
+    points = round((model_probability - 0.5) * 40)
+    if not points:
+        return 0, []
+    return points, [f"URL 模型評估（{points:+d}分）"]
+
+
 @tool
-def calculate_risk_score(url: str, evidence: str) -> str:
+def calculate_risk_score(url: str, evidence: str, model_probability: Optional[float] = None) -> str:
     """計算網站的風險評分（0-100分）。
     
     根據 URL 特徵和證據分析，給出風險分數。
@@ -266,6 +254,7 @@ def calculate_risk_score(url: str, evidence: str) -> str:
     Args:
         url: 要評估的 URL
         evidence: 其他工具檢測到的證據（用換行分隔）
+        model_probability: 本地 URL 分類器給出的釣魚機率（0-1，可省略）
         
     Returns:
         風險評分和說明（繁體中文）
@@ -277,74 +266,28 @@ def calculate_risk_score(url: str, evidence: str) -> str:
     reasons = []
     
     try:
-        parsed = urlparse(url)
-        domain = parsed.netloc.lower()
-        
-        # URL 特徵評分（0-40分）
-        # 使用 HTTP 而非 HTTPS
-        if parsed.scheme == "http":
-            score += 15
-            reasons.append("使用 HTTP（+15分）")
+        rules = get_rules()
         
-        # 第三方託管平台
-        for host in THIRD_PARTY_HOSTS:
-            if host in domain:
-                score += 10
-                reasons.append(f"第三方託管平台（+10分）")
-                break
+        # URL 特徵評分（HTTP、第三方託管、短網址、大量數字、域名長度…）
+        url_points, url_reasons = rules.url_score(rules.evaluate(url))
+        score += url_points
+        reasons += url_reasons
         
-        # 短網址服務
-        if re.search(r"bit\.ly|tinyurl|t\.co|goo\.gl", domain):
-            score += 20
-            reasons.append("短網址服務（+20分）")
+        # 證據分析評分（缺少聯絡資訊、語言異常、可疑模式、白名單…）
+        evidence_points, evidence_reasons = rules.evidence_score(evidence)
+        score += evidence_points
+        reasons += evidence_reasons
         
-        # 域名可疑模式
-        if re.search(r"[\d]{4,}", domain):
-            score += 12
-            reasons.append("域名包含大量數字（+12分）")
-        
-        # 證據分析評分（0-40分）
-        if evidence:
-            evidence_lower = evidence.lower()
-            
-            if "未找到聯絡資訊" in evidence:
-                score += 15
-                reasons.append("缺少聯絡資訊（+15分）")
-            
-            if "語言異常" in evidence:
-                score += 10
-                reasons.append("語言品質異常（+10分）")
-            
-            if "可疑模式" in evidence or "可疑特徵" in evidence:
-                score += 12
-                reasons.append("發現可疑模式（+12分）")
-            
-            if "官方安全域名" in evidence or "白名單檢查" in evidence:
-                score -= 20  # 降低風險
-                reasons.append("官方安全域名（-20分）")
-        
-        # 域名長度異常
-        domain_parts = domain.split('.')
-        main_domain = domain_parts[0] if domain_parts else ""
-        if len(main_domain) < 3:
-            score += 8
-            reasons.append("域名過短（+8分）")
-        elif len(main_domain) > 30:
-            score += 8
-            reasons.append("域名過長（+8分）")
+        # 本地 URL 分類器（-20 ~ +20分）
+        model_points, model_reasons = model_score(model_probability)
+        score += model_points
+        reasons += model_reasons
         
         # 確保分數在 0-100 範圍內
         score = max(0, min(100, score))
         
         # 風險等級
-        if score < 20:
-            level = "低風險"
-        elif score < 50:
-            level = "中風險"
-        elif score < 75:
-            level = "高風險"
-        else:
-            level = "極高風險"
+        level = rules.level(score)
         
         result = f"風險評分：{score}/100（{level}）"
         if reasons:
@@ -425,16 +368,9 @@ def detect_similar_sites(url: str, text: str) -> str:
                                 if re.search(rf"{kw}[^.]*\.(com|net|org)", domain):
                                     findings.append(f"域名疑似模仿「{brand_name}」")
         
-        # 檢查常見的釣魚網站特徵
-        suspicious_patterns = [
-            (r"secure-[a-z0-9]+\.(com|net)", "使用可疑的 secure- 前綴"),
-            (r"[a-z0-9]+-verify\.(com|net)", "使用可疑的 verify 後綴"),
-            (r"[a-z0-9]+-update\.(com|net)", "使用可疑的 update 後綴"),
-        ]
-        
-        for pattern, desc in suspicious_patterns:
-            if re.search(pattern, domain):
-                findings.append(desc)
+        # 檢查常見的釣魚網站特徵（secure- 前綴、-verify / -update 後綴）
+        rules = get_rules()
+        findings += rules.findings(rules.evaluate_domain(domain), "similar")
         
         if not findings:
             return "未發現模仿知名網站的跡象"
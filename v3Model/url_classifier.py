@@ -0,0 +1,329 @@
+# url_classifier.py — 以 phishtank.csv 訓練的輕量 URL 分類器
+#
+# 模型：字元 n-gram（3~5）雜湊到固定數量的桶，再做邏輯迴歸。
+# 特徵萃取與推論都以 NumPy 向量化，整批網址一次計算；
+# 權重存成 .npy，載入時以 memory-map 開啟，不必整份讀進記憶體。
+#
+# 訓練：
+#   python url_classifier.py train --benign benign_urls.txt
+#   （phishtank.csv 只有釣魚網址，必須另外提供良性網址清單；
+#     建議使用完整網址而非只有網域，避免模型只學到「有路徑 = 釣魚」）
+# 測試：
+#   python url_classifier.py score https://example.com/login
+
+import argparse
+import csv
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MODEL_PATH = os.environ.get("URL_MODEL_PATH", os.path.join(HERE, "url_model.npy"))
+# 最多每隔幾秒檢查一次模型檔是否更新（伺服器執行中重新訓練的模型不需重啟即可生效）
+MODEL_RELOAD_INTERVAL = float(os.environ.get("URL_MODEL_RELOAD", 5.0))
+BUCKET_BITS = 18
+N_BUCKETS = 1 << BUCKET_BITS
+NGRAMS = (3, 4, 5)
+MAX_URL_LEN = 256
+
+# 分類機率超過 / 低於這兩個門檻時，analyze_deep 可不呼叫 LLM 直接判定
+DECIDE_HIGH = float(os.environ.get("URL_MODEL_DECIDE_HIGH", 0.95))
+DECIDE_LOW = float(os.environ.get("URL_MODEL_DECIDE_LOW", 0.02))
+
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+_BASE = np.uint64(1099511628211)
+
+
+def _encode(urls) -> tuple[np.ndarray, np.ndarray]:
+    """把網址串接成一個 uint8 陣列，回傳 (bytes, 每個位元組所屬的網址編號)。"""
+    encoded = [
+        ("^" + u.strip().lower()[:MAX_URL_LEN] + "$").encode("utf-8", "ignore")
+        for u in urls
+    ]
+    lengths = np.fromiter((len(b) for b in encoded), dtype=np.int64, count=len(encoded))
+    buf = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    rows = np.repeat(np.arange(len(encoded), dtype=np.int64), lengths)
+    return buf, rows
+
+
+def featurize(urls) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """萃取整批網址的雜湊 n-gram 特徵。
+
+    回傳 (bucket, row, norm)：bucket[j] 為第 j 個特徵的桶編號、row[j] 為所屬網址，
+    norm[i] 為第 i 個網址的正規化係數（1 / sqrt(特徵數)）。
+    """
+    urls = list(urls)
+    buf, rows = _encode(urls)
+    values = buf.astype(np.uint64)
+
+    buckets = []
+    owners = []
+    for n in NGRAMS:
+        if len(buf) < n:
+            continue
+        windows = np.lib.stride_tricks.sliding_window_view(values, n)
+        powers = _BASE ** np.arange(n, dtype=np.uint64)
+        with np.errstate(over="ignore"):
+            h = (windows * powers).sum(axis=1, dtype=np.uint64) + np.uint64(n)
+            h = (h * _GOLDEN) >> np.uint64(64 - BUCKET_BITS)
+        # 只保留完全落在同一個網址內的 n-gram
+        valid = rows[: len(rows) - n + 1] == rows[n - 1:]
+        buckets.append(h[valid].astype(np.int64))
+        owners.append(rows[: len(rows) - n + 1][valid])
+
+    if buckets:
+        bucket = np.concatenate(buckets)
+        row = np.concatenate(owners)
+    else:
+        bucket = np.zeros(0, dtype=np.int64)
+        row = np.zeros(0, dtype=np.int64)
+
+    counts = np.bincount(row, minlength=len(urls))
+    norm = 1.0 / np.sqrt(np.maximum(counts, 1))
+    return bucket, row, norm
+
+
+def _sigmoid(z: np.ndarray) -> np.ndarray:
+    return 1.0 / (1.0 + np.exp(-np.clip(z, -30, 30)))
+
+
+class UrlClassifier:
+    """權重向量長度為 N_BUCKETS + 1（最後一個是 bias）。"""
+
+    def __init__(self, weights: np.ndarray):
+        if len(weights) != N_BUCKETS + 1:
+            raise ValueError(f"模型大小不符：{len(weights)} != {N_BUCKETS + 1}")
+        self.weights = weights
+
+    def predict_proba(self, urls) -> np.ndarray:
+        urls = list(urls)
+        if not urls:
+            return np.zeros(0)
+        bucket, row, norm = featurize(urls)
+        w = self.weights
+        z = np.bincount(row, weights=w[bucket], minlength=len(urls)) * norm + w[-1]
+        return _sigmoid(z)
+
+    def score(self, url: str) -> float:
+        return float(self.predict_proba([url])[0])
+
+
+# ------------------------------
+# 載入（lazy、memory-mapped）
+# ------------------------------
+_model_lock = threading.Lock()
+_model = None
+_model_mtime = None   # 上次檢查時模型檔的 mtime（不存在時為 None）
+_checked_at = None
+
+
+def get_classifier() -> UrlClassifier | None:
+    """取得已載入的分類器；模型檔不存在時回傳 None。
+
+    模型檔的 mtime 改變就重新載入，載入失敗或檔案被刪除時沿用舊模型。
+    """
+    global _model, _model_mtime, _checked_at
+    now = time.monotonic()
+    if _checked_at is not None and now - _checked_at < MODEL_RELOAD_INTERVAL:
+        return _model
+
+    with _model_lock:
+        if _checked_at is not None and now - _checked_at < MODEL_RELOAD_INTERVAL:
+            return _model
+        first = _checked_at is None
+        _checked_at = now
+        try:
+            mtime = os.path.getmtime(MODEL_PATH)
+        except OSError:
+            mtime = None
+        if not first and mtime == _model_mtime:
+            return _model
+        _model_mtime = mtime
+
+        if mtime is None:
+            if _model is None:
+                print(f"[URL_MODEL] 找不到模型檔 {MODEL_PATH}，略過模型評分")
+            return _model
+        try:
+            _model = UrlClassifier(np.load(MODEL_PATH, mmap_mode="r"))
+            print(f"[URL_MODEL] 已載入模型 {MODEL_PATH}")
+        except Exception as e:
+            print("[URL_MODEL] 模型載入失敗:", e)
+    return _model
+
+
+def phishing_probability(url: str) -> float | None:
+    """單一網址的釣魚機率；沒有模型時回傳 None。"""
+    clf = get_classifier()
+    if clf is None or not url:
+        return None
+    return clf.score(url)
+
+
+# ------------------------------
+# 訓練
+# ------------------------------
+def train(
+    urls: list[str],
+    labels: np.ndarray,
+    epochs: int = 6,
+    lr: float = 0.5,
+    l2: float = 1e-7,
+    batch_size: int = 4096,
+    seed: int = 0,
+) -> np.ndarray:
+    """以 mini-batch Adagrad 訓練邏輯迴歸，回傳 float32 權重（含 bias）。"""
+    rng = np.random.default_rng(seed)
+    w = np.zeros(N_BUCKETS + 1, dtype=np.float64)
+    g2 = np.full(N_BUCKETS + 1, 1e-8)
+    labels = np.asarray(labels, dtype=np.float64)
+
+    for epoch in range(epochs):
+        order = rng.permutation(len(urls))
+        loss = 0.0
+        for start in range(0, len(order), batch_size):
+            idx = order[start:start + batch_size]
+            bucket, row, norm = featurize([urls[i] for i in idx])
+            y = labels[idx]
+
+            z = np.bincount(row, weights=w[bucket], minlength=len(idx)) * norm + w[-1]
+            p = _sigmoid(z)
+            err = (p - y) / len(idx)
+            loss -= np.sum(y * np.log(p + 1e-12) + (1 - y) * np.log(1 - p + 1e-12))
+
+            grad = np.bincount(bucket, weights=(err * norm)[row], minlength=N_BUCKETS)
+            grad += l2 * w[:-1]
+            g2[:-1] += grad ** 2
+            w[:-1] -= lr * grad / np.sqrt(g2[:-1])
+
+            gb = err.sum()
+            g2[-1] += gb ** 2
+            w[-1] -= lr * gb / np.sqrt(g2[-1])
+
+        print(f"[URL_MODEL] epoch {epoch + 1}/{epochs} loss={loss / len(urls):.4f}")
+
+    return w.astype(np.float32)
+
+
+def _read_urls(path: str) -> list[str]:
+    """讀取網址清單：CSV（含 url 欄）或每行一個網址 / 網域（如 Tranco 的 rank,domain）。"""
+    urls = []
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        first = f.readline()
+        f.seek(0)
+        if first.strip().lower() == "url" or first.lower().startswith("url,"):
+            for row in csv.DictReader(f):
+                u = (row.get("url") or "").strip()
+                if u:
+                    urls.append(u)
+            return urls
+
+        for line in f:
+            u = line.strip().split(",")[-1].strip()
+            if not u:
+                continue
+            if "://" not in u:
+                u = "https://" + u + "/"
+            urls.append(u)
+    return urls
+
+
+def _evaluate(clf: UrlClassifier, urls: list[str], labels: np.ndarray) -> dict:
+    p = clf.predict_proba(urls)
+    pred = p >= 0.5
+    y = labels.astype(bool)
+    tp = int(np.sum(pred & y))
+    fp = int(np.sum(pred & ~y))
+    fn = int(np.sum(~pred & y))
+    return {
+        "accuracy": round(float(np.mean(pred == y)), 4),
+        "precision": round(tp / max(tp + fp, 1), 4),
+        "recall": round(tp / max(tp + fn, 1), 4),
+        "decided_high": round(float(np.mean(p >= DECIDE_HIGH)), 4),
+        "decided_low": round(float(np.mean(p <= DECIDE_LOW)), 4),
+    }
+
+
+def _cmd_train(args):
+    phish = _read_urls(args.phish)
+    benign = _read_urls(args.benign)
+    if not benign:
+        raise SystemExit("良性網址清單為空，無法訓練")
+
+    urls = phish + benign
+    labels = np.concatenate([np.ones(len(phish)), np.zeros(len(benign))])
+    print(f"[URL_MODEL] 釣魚 {len(phish)} 筆、良性 {len(benign)} 筆")
+
+    rng = np.random.default_rng(args.seed)
+    order = rng.permutation(len(urls))
+    n_test = int(len(urls) * args.holdout)
+    test_idx, train_idx = order[:n_test], order[n_test:]
+
+    t0 = time.time()
+    weights = train(
+        [urls[i] for i in train_idx], labels[train_idx],
+        epochs=args.epochs, seed=args.seed,
+    )
+    print(f"[URL_MODEL] 訓練耗時 {time.time() - t0:.1f} 秒")
+
+    metrics = {}
+    if n_test:
+        metrics = _evaluate(UrlClassifier(weights), [urls[i] for i in test_idx], labels[test_idx])
+        print(f"[URL_MODEL] 驗證集：{metrics}")
+
+    # 先寫暫存檔再替換：執行中的伺服器以 memory-map 開著舊檔，直接覆寫會讓它讀到寫到一半的內容
+    tmp_path = args.out + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, weights)
+    os.replace(tmp_path, args.out)
+    meta_path = os.path.splitext(args.out)[0] + ".json"
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "ngrams": NGRAMS,
+            "buckets": N_BUCKETS,
+            "phish": len(phish),
+            "benign": len(benign),
+            "metrics": metrics,
+            "trained_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }, f, ensure_ascii=False, indent=2)
+    print(f"[URL_MODEL] 已輸出 {args.out}（{weights.nbytes // 1024} KB）與 {meta_path}")
+
+
+def _cmd_score(args):
+    clf = get_classifier()
+    if clf is None:
+        raise SystemExit(1)
+    t0 = time.perf_counter()
+    probs = clf.predict_proba(args.urls)
+    elapsed = (time.perf_counter() - t0) * 1e6
+    for url, p in zip(args.urls, probs):
+        print(f"{p:.4f}  {url}")
+    print(f"[URL_MODEL] {len(args.urls)} 筆耗時 {elapsed:.0f} µs")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="輕量 URL 釣魚分類器")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p_train = sub.add_parser("train", help="以 phishtank.csv + 良性網址清單訓練模型")
+    p_train.add_argument("--phish", default=os.path.join(HERE, "phishtank.csv"))
+    p_train.add_argument("--benign", required=True, help="良性網址清單（每行一個網址或網域）")
+    p_train.add_argument("--out", default=MODEL_PATH)
+    p_train.add_argument("--epochs", type=int, default=6)
+    p_train.add_argument("--holdout", type=float, default=0.1)
+    p_train.add_argument("--seed", type=int, default=0)
+    p_train.set_defaults(func=_cmd_train)
+
+    p_score = sub.add_parser("score", help="對網址評分")
+    p_score.add_argument("urls", nargs="+")
+    p_score.set_defaults(func=_cmd_score)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
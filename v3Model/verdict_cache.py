@@ -0,0 +1,114 @@
+# verdict_cache.py — 已判定頁面的結果快取（供擴充功能以 ETag 重新驗證）
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+# 擴充功能端快取多久後需要重新驗證（秒），也作為 Cache-Control 提示
+VERDICT_TTL = int(os.environ.get("VERDICT_TTL", 600))
+# 後端保留判定結果的時間，需長於 VERDICT_TTL 才能讓重新驗證回 304
+VERDICT_RETAIN = int(os.environ.get("VERDICT_RETAIN", 6 * 3600))
+MAX_VERDICTS = int(os.environ.get("VERDICT_CACHE_SIZE", 5000))
+# 其他節點的時鐘最多可以比本機快幾秒；更未來的 stored_at 視為錯誤資料
+VERDICT_MAX_SKEW = float(os.environ.get("VERDICT_MAX_SKEW", 60))
+
+# 只有這些欄位屬於「判定結果」，耗時等欄位不影響版本
+_VERDICT_FIELDS = ("is_potential_phishing", "explanation", "risk_score", "similar_site_detection")
+
+_lock = threading.Lock()
+_verdicts = OrderedDict()  # key -> {"result", "version", "stored_at"}
+
+# 本節點新增判定時的通知對象（replication 用來轉送給其他節點），參數為 (key, entry)
+VERDICT_LISTENERS = []
+
+
+def verdict_key(url: str) -> str | None:
+    """以 origin + path 作為快取鍵（忽略 query 與 fragment）。"""
+    try:
+        parsed = urlparse(url.strip())
+    except Exception:
+        return None
+    if parsed.scheme not in ("http", "https") or not parsed.netloc:
+        return None
+    return f"{parsed.scheme}://{parsed.netloc.lower()}{parsed.path or '/'}"
+
+
+def _verdict_version(result: dict) -> str:
+    body = json.dumps({k: result.get(k) for k in _VERDICT_FIELDS}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(body.encode("utf-8")).hexdigest()[:16]
+
+
+def store_verdict(url: str, result: dict) -> tuple[str, int] | None:
+    """記錄一筆判定結果，回傳 (verdict_version, ttl)；網址無法作為鍵時回傳 None。"""
+    key = verdict_key(url)
+    if key is None:
+        return None
+
+    version = _verdict_version(result)
+    entry = {
+        "result": {k: result.get(k) for k in _VERDICT_FIELDS},
+        "version": version,
+        "stored_at": time.time(),
+    }
+    with _lock:
+        _verdicts[key] = entry
+        _verdicts.move_to_end(key)
+        while len(_verdicts) > MAX_VERDICTS:
+            _verdicts.popitem(last=False)
+
+    for fn in VERDICT_LISTENERS:
+        try:
+            fn(key, entry)
+        except Exception as e:
+            print("[VERDICT] 異動通知失敗:", e)
+
+    return version, VERDICT_TTL
+
+
+def import_verdict(key: str, entry: dict) -> bool:
+    """寫入其他節點複寫過來的判定；只有比現有的新才覆蓋，不通知 VERDICT_LISTENERS。
+
+    stored_at 超過本機時間 VERDICT_MAX_SKEW 秒就拒絕，容許範圍內的未來時間則壓回現在，
+    避免一筆時間戳在未來的判定永遠不過期、也永遠贏過之後的判定。
+    """
+    try:
+        result = {k: entry["result"].get(k) for k in _VERDICT_FIELDS}
+        stored_at = float(entry["stored_at"])
+        version = str(entry["version"])
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return False
+    now = time.time()
+    if not now - VERDICT_RETAIN <= stored_at <= now + VERDICT_MAX_SKEW:
+        return False
+    stored_at = min(stored_at, now)
+
+    with _lock:
+        current = _verdicts.get(key)
+        if current is not None and current["stored_at"] >= stored_at:
+            return False
+        _verdicts[key] = {"result": result, "version": version, "stored_at": stored_at}
+        _verdicts.move_to_end(key)
+        while len(_verdicts) > MAX_VERDICTS:
+            _verdicts.popitem(last=False)
+    return True
+
+
+def get_verdict(url: str) -> dict | None:
+    """取得仍在保留期限內的判定結果。"""
+    key = verdict_key(url)
+    if key is None:
+        return None
+
+    with _lock:
+        entry = _verdicts.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry["stored_at"] > VERDICT_RETAIN:
+            del _verdicts[key]
+            return None
+        _verdicts.move_to_end(key)
+        return entry